@@ -1,13 +1,21 @@
 import sys
+from datetime import datetime
 from PyQt5.QtWidgets import (
     QApplication, QHeaderView, QWidget, QVBoxLayout, QHBoxLayout, QPushButton, QLabel, QLineEdit, QListWidget, QMessageBox, QDialog, QComboBox, QTableWidget, QTableWidgetItem, QSpinBox
 )
-from PyQt5.QtCore import QTimer, Qt
-from services.opcua_service import OPCUAService
+from PyQt5.QtCore import QTimer, Qt, pyqtSignal
+from services.opcua_service import DEFAULT_TIMEOUT
 from services.postgres_service import PostgresService
-from opcua.ua import ExtensionObject
-import services.opcua_structures as opcua_structures
 import services.config_service as config_service
+from services.read_api import LiveStore, ReadApiServer, DEFAULT_HOST, DEFAULT_PORT, DEFAULT_HISTORY_SIZE
+from services.session_manager import sessions
+from services.collector import Collector
+from services.memory_service import approx_size
+
+def acquire_session(url):
+    # Use the settings of the configured server so dialogs share the collector's session
+    server = config_service.find_server_by_url(config_service.load_config(), url) or {}
+    return sessions.acquire(url, server.get('timeout', DEFAULT_TIMEOUT), server.get('security'))
 
 class AddConnectionDialog(QDialog):
     def __init__(self, parent=None):
@@ -49,7 +57,6 @@ class AddConnectionDialog(QDialog):
         self.log_btn.setEnabled(False)
         self.log_btn.clicked.connect(self.accept)
         self.layout.addWidget(self.log_btn)
-        self.opc_service = None
         self.selected_nodes = []
         self.tested = False
 
@@ -59,7 +66,6 @@ class AddConnectionDialog(QDialog):
             self.display_name_input.setText(dlg.display_name_input.text().strip())
             self.server_url_input.setText(dlg.server_url_input.text().strip())
             self.refresh_rate_input.setValue(dlg.refresh_rate_input.value())
-            self.opc_service = dlg.opc_service
             self.selected_nodes = dlg.selected_nodes
             self.tested = True
             self.load_nodes()
@@ -70,9 +76,8 @@ class AddConnectionDialog(QDialog):
             QMessageBox.warning(self, 'Input Error', 'Please enter the OPC UA server URL.')
             return
         try:
-            opc_service = OPCUAService(url)
-            opc_service.connect()
-            opc_service.disconnect()
+            # Instant when a collector or an earlier dialog action already has a session to this server
+            sessions.release(acquire_session(url))
             QMessageBox.information(self, 'Success', 'Successfully connected to OPC UA server.')
             self.tested = True
         except Exception as e:
@@ -88,9 +93,11 @@ class AddConnectionDialog(QDialog):
         self.progress.setText('Loading Nodes from the server...')
         QApplication.processEvents()
         try:
-            self.opc_service = OPCUAService(url)
-            self.opc_service.connect()
-            nodes = self.opc_service.get_nodes()
+            opc_service = acquire_session(url)
+            try:
+                nodes = opc_service.get_nodes()
+            finally:
+                sessions.release(opc_service)
             self.node_list.clear()
             for node in nodes:
                 self.node_list.addItem(f'{node["name"]} ({node["nodeid"]})')
@@ -120,7 +127,7 @@ class AddConnectionDialog(QDialog):
             if server.get('display_name') == display_name:
                 server['url'] = url
                 server['refresh_rate'] = refresh_rate
-                server['nodes'] = self.selected_nodes
+                server['nodes'] = config_service.merge_nodes(server.get('nodes', []), self.selected_nodes)
                 break
         else:
             opcua_servers.append({
@@ -203,6 +210,12 @@ class AddDatabaseDialog(QDialog):
         super().accept()
 
 class OPCUAClientUI(QWidget):
+    # Emitted from the collector's worker threads; Qt queues them onto the GUI thread
+    server_status = pyqtSignal(str, str)
+    config_changed = pyqtSignal(object, object)
+    # Emitted from the pipeline's decode thread with each batch of decoded records
+    values_decoded = pyqtSignal(object)
+
     def __init__(self):
         super().__init__()
         self.setWindowTitle('OPC UA to Postgres Collector')
@@ -219,8 +232,8 @@ class OPCUAClientUI(QWidget):
         main_layout.addLayout(filter_layout)
         # Node table
         node_layout = QHBoxLayout()
-        self.node_table = QTableWidget(0, 6)
-        self.node_table.setHorizontalHeaderLabels(['Node ID', 'Node Name','Server Display Name', 'Last Value', 'DataType','Timestamp'])
+        self.node_table = QTableWidget(0, 7)
+        self.node_table.setHorizontalHeaderLabels(['Node ID', 'Node Name','Server Display Name', 'Last Value', 'DataType','Timestamp', 'Status'])
         self.node_table.horizontalHeader().setSectionResizeMode(QHeaderView.Stretch)
         node_layout.addWidget(self.node_table)
         main_layout.addLayout(node_layout)
@@ -255,122 +268,171 @@ class OPCUAClientUI(QWidget):
         db_layout.addWidget(self.pg_conn_input)
         controls_layout.addWidget(self.db_group)
         main_layout.addLayout(controls_layout)
+        self.pipeline_label = QLabel('', self)
+        main_layout.addWidget(self.pipeline_label)
         # Data
-        self.servers = []  # List of dicts: {opc_service, pg_service, display_name, refresh_rate, nodes, timers, url}
         self.pg_service = None
-        self.node_data = []  # List of dicts: {node_id, node_name, server_display_name, last_value, timestamp}
+        self.node_data = []  # List of dicts: {node_id, node_name, server_display_name, last_value, timestamp, status}
+        # OPC UA sessions are shared between collectors and dialogs and closed after being idle for a while
+        session_config = config_service.load_config().get('sessions', {})
+        sessions.idle_timeout = session_config.get('idle_timeout', sessions.idle_timeout)
+        sessions.keepalive_interval = session_config.get('keepalive_interval', sessions.keepalive_interval)
+        self.server_status.connect(self.on_server_status)
+        # Edits to config.json, from the dialogs or on disk, are applied to running collectors
+        self.config_changed.connect(self.apply_config_change)
+        config_service.subscribe(self.config_changed.emit)
+        self.config_watch_timer = QTimer()
+        self.config_watch_timer.timeout.connect(config_service.load_config)
+        self.config_watch_timer.start(2000)
+        # Latest values and recent history are served over local HTTP without touching the database
+        api_config = config_service.load_config().get('read_api', {})
+        self.live_store = LiveStore(api_config.get('history_size', DEFAULT_HISTORY_SIZE))
+        # Connecting, polling (one read lane per server), decoding and database writes all run on the
+        # collector's and pipeline's own threads; the GUI thread only gets queued, batched updates
+        self.values_decoded.connect(self.on_values_decoded)
+        self.collector = Collector(config_service.load_config(),
+                                   on_status=self.server_status.emit,
+                                   on_decoded=self.values_decoded.emit,
+                                   live_store=self.live_store)
+        self.collector.start()
+        # Decoded values are applied to the table a few times per second, not once per batch
+        self.pending_records = {}  # (server_name, node_id) -> latest record
+        self.table_timer = QTimer()
+        self.table_timer.timeout.connect(self.refresh_node_values)
+        self.table_timer.start(250)
+        self.collector.memory.register('ui', self.ui_memory_bytes)
+        self.pipeline_timer = QTimer()
+        self.pipeline_timer.timeout.connect(self.update_pipeline_label)
+        self.pipeline_timer.start(1000)
+        self.read_api = None
+        if api_config.get('enabled', True):
+            try:
+                self.read_api = ReadApiServer(self.live_store, api_config.get('host', DEFAULT_HOST),
+                                              api_config.get('port', DEFAULT_PORT), api_config.get('sse', True),
+                                              self.collector_stats, self.collector.memory)
+                self.read_api.start()
+            except OSError as e:
+                print(f"Read API disabled: {e}")
 
     # Load existing config
     def load_opcua_config(self):
+        # Get Postgres connection string
+        pg_conn_str = self.pg_conn_input.text().strip()
+        if not pg_conn_str:
+            QMessageBox.warning(self, 'Input Error', 'Please add a database connection first.')
+            return
+        self.collector.pipeline.set_conn_str(pg_conn_str)
         config = config_service.load_config()
-        opcua_servers = config.get('opcua_servers', [])
-        for server in opcua_servers:
-            url = server.get('url', '')
-            display_name = server.get('display_name', url)
-            refresh_rate = server.get('refresh_rate', 10)
-            nodes = server.get('nodes', [])
-            # Get Postgres connection string
-            pg_conn_str = self.pg_conn_input.text().strip()
-            if not pg_conn_str:
-                QMessageBox.warning(self, 'Input Error', 'Please add a database connection first.')
-                return
-            
-            # Add the server to the filter if not already present
-            if display_name not in [self.server_filter.itemText(i) for i in range(self.server_filter.count())]:
-                self.server_filter.addItem(display_name)
+        self.collector.config = config
+        for server in config.get('opcua_servers', []):
+            self.start_server(server)
+        self.update_node_table()
 
-            # Skip if no URL or Postgres connection string
-            
-            try:
-                opc_service = OPCUAService(url)
-                opc_service.connect()
-                timer = QTimer()
-                pg_service = PostgresService(pg_conn_str)
-                pg_service.connect() 
-                server_info = {
-                    'opc_service': opc_service,
-                    'pg_service': pg_service,
-                    'display_name': display_name,
-                    'refresh_rate': refresh_rate,
-                    'nodes': nodes,
-                    'timer': timer,
-                    'url': url,
-                    'disconnected': False,
-                    'retry_timer': None  
-                }
-                timer.timeout.connect(lambda s=server_info: self.update_node_values_multi(s))
-                timer.start(refresh_rate * 1000)
-                self.servers.append(server_info)
-                # Add nodes to node_data
-                for node_id in nodes:
-                    node_name = node_id.split(';')[1]
-                    node_name = node_name[2:]  # Optionally parse for better name
-                    node_name = node_name.split('.')[1]
-                    self.node_data.append({
-                        'node_id': node_id,
-                        'node_name': node_name,
-                        'server_display_name': display_name,
-                        'last_value': '',
-                        'datatype': '',  # Placeholder for datatype
-                        'timestamp': ''
-                    })
-                self.update_node_table()
-            except Exception as e:
-                QMessageBox.critical(self, 'Connection Error', f'Failed to connect to server {display_name}: {str(e)}')
-                pass  # Optionally log error
+    def find_server(self, display_name):
+        return self.collector.servers.get(display_name)
+
+    def start_server(self, server):
+        url = server.get('url', '')
+        display_name = server.get('display_name', url)
+        # Skip servers that are already connected or still connecting
+        if not url or self.find_server(display_name):
+            return None
+
+        # Add the server to the filter if not already present
+        if display_name not in [self.server_filter.itemText(i) for i in range(self.server_filter.count())]:
+            self.server_filter.addItem(display_name)
+
+        server_info = self.collector.start_server(server)
+        self.add_node_rows(display_name, server_info['nodes'], server_info.get('status', ''))
+        return server_info
+
+    def stop_server(self, display_name):
+        self.collector.stop_server(display_name)
+        self.node_data = [n for n in self.node_data if n['server_display_name'] != display_name]
+        index = self.server_filter.findText(display_name)
+        if index > 0:
+            self.server_filter.removeItem(index)
+        self.update_node_table()
+
+    def apply_config_change(self, old_config, new_config):
+        # Only touch what changed so unaffected sessions keep running
+        diff = config_service.diff_servers(old_config, new_config)
+        pg_conn_str = self.pg_conn_input.text().strip()
+        self.collector.config = new_config
+        for server in diff['removed']:
+            display_name = server.get('display_name', server.get('url', ''))
+            if self.find_server(display_name):
+                print(f"Config: removing server {display_name}")
+                self.stop_server(display_name)
+        for server in diff['added']:
+            if pg_conn_str:
+                print(f"Config: adding server {server.get('display_name', server.get('url', ''))}")
+                self.start_server(server)
+        for old, new, changes in diff['changed']:
+            server_info = self.find_server(new.get('display_name', new.get('url', '')))
+            if not server_info:
+                continue
+            if changes['reconnect']:
+                print(f"Config: reconnecting server {server_info['display_name']}")
+                self.stop_server(server_info['display_name'])
+                self.start_server(new)
+                continue
+            self.collector.update_server(new, changes)
+            if changes['nodes_added'] or changes['nodes_removed']:
+                removed = set(changes['nodes_removed'])
+                self.node_data = [n for n in self.node_data
+                                  if not (n['server_display_name'] == server_info['display_name'] and n['node_id'] in removed)]
+                self.add_node_rows(server_info['display_name'], changes['nodes_added'], server_info.get('status', ''))
+        self.update_node_table()
+
+    def add_node_rows(self, display_name, nodes, status=''):
+        existing = {n['node_id'] for n in self.node_data if n['server_display_name'] == display_name}
+        for node_id in nodes:
+            if node_id in existing:
+                continue  # Re-adding a server or node must not duplicate its row
+            existing.add(node_id)
+            node_name = node_id.split(';')[1]
+            node_name = node_name[2:]  # Optionally parse for better name
+            node_name = node_name.split('.')[1]
+            self.node_data.append({
+                'node_id': node_id,
+                'node_name': node_name,
+                'server_display_name': display_name,
+                'last_value': '',
+                'datatype': '',  # Placeholder for datatype
+                'timestamp': '',
+                'status': status
+            })
+
+    def on_server_status(self, display_name, status):
+        for node in self.node_data:
+            if node['server_display_name'] == display_name:
+                node['status'] = status
+        self.update_node_table()
 
     def open_add_connection_dialog(self):
         dlg = AddConnectionDialog(self)
         if dlg.exec_() == QDialog.Accepted:
             url = dlg.server_url_input.text().strip()
             display_name = dlg.display_name_input.text().strip() or url
-            refresh_rate = dlg.refresh_rate_input.value()
-            selected_nodes = dlg.selected_nodes
-            opc_service = dlg.opc_service
             # Add server to filter if new
             if display_name not in [self.server_filter.itemText(i) for i in range(self.server_filter.count())]:
                 self.server_filter.addItem(display_name)
-            # Start logging (if DB info is set)
-            pg_conn_str = self.pg_conn_input.text().strip()
-            if pg_conn_str:
-                try:
-                    if not self.pg_service:
-                        self.pg_service = PostgresService(pg_conn_str)
-                        self.pg_service.connect()
-                    timer = QTimer()
-                    server_info = {
-                        'opc_service': opc_service,
-                        'pg_service': self.pg_service,
-                        'display_name': display_name,
-                        'refresh_rate': refresh_rate,
-                        'nodes': selected_nodes,
-                        'timer': timer,
-                        'url': url
-                    }
-                    timer.timeout.connect(lambda s=server_info: self.update_node_values_multi(s))
-                    timer.start(refresh_rate * 1000)
-                    self.servers.append(server_info)
-                    # Add nodes to node_data
-                    for node_id in selected_nodes:
-                        node_name = node_id.split(';')[1]
-                        node_name = node_name[2:]  # Optionally parse for better name
-                        node_name = node_name.split('.')[1]
-                        self.node_data.append({
-                            'node_id': node_id,
-                            'node_name': node_name,
-                            'server_display_name': display_name,
-                            'last_value': '',
-                            'datatype': '',  # Placeholder for datatype
-                            'timestamp': ''
-                        })
-                    self.update_node_table()
-                except Exception as e:
-                    QMessageBox.critical(self, 'DB Error', str(e))
+            # Start logging (if DB info is set). apply_config_change only starts servers that are new to
+            # config.json; one that was already saved but not loaded yet is started here. start_server
+            # skips it if it is already running, reusing the dialog's session either way.
+            if self.pg_conn_input.text().strip():
+                for server in config_service.load_config().get('opcua_servers', []):
+                    if server.get('display_name', server.get('url', '')) == dlg.display_name_input.text().strip():
+                        self.start_server(server)
+                        self.update_node_table()
+                        break
 
     def open_add_db_dialog(self):
         dlg = AddDatabaseDialog(self)
         if dlg.exec_() == QDialog.Accepted:
             self.pg_conn_input.setText(dlg.conn_str)
+            self.collector.pipeline.set_conn_str(dlg.conn_str)
             try:
                 self.pg_service = PostgresService(dlg.conn_str)
                 self.pg_service.connect()
@@ -390,78 +452,49 @@ class OPCUAClientUI(QWidget):
         except Exception as e:
             QMessageBox.critical(self, 'Database Error', str(e))
     
-    def update_node_values_multi(self, server_info):
-        for node_id in server_info['nodes']:
-            try:
-                value = server_info['opc_service'].get_value(node_id)
-                datatype_node = server_info['opc_service'].get_datatype(node_id)
-                datatype_name = datatype_node.Name
-                datatype_id = datatype_node.NamespaceIndex
-                
-
-                if datatype_id == 2:  # Assuming namespace index 2 is for custom structures
-                    StructClass = opcua_structures.map_structures(datatype_name)
-                    if StructClass:
-                        value = server_info['opc_service'].get_value(node_id)
-                        if isinstance(value, ExtensionObject):
-                            struct_instance = StructClass(value.Body)
-                            value = struct_instance.as_dict()
-                        else:
-                            # It is an array of ExtensionObjects
-                            value = [StructClass(item.Body).as_dict() for item in value if isinstance(item, ExtensionObject)]
-                            value = str(value)
-                
-                
-                server_info['pg_service'].insert_data(node_id, value, server_info['display_name'])
-                # Update node_data
-                for node in self.node_data:
-                    if node['node_id'] == node_id and node['server_display_name'] == server_info['display_name']:
-                        node['last_value'] = str(value)
-                        from datetime import datetime
-                        node['timestamp'] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-                        node['datatype'] = datatype_name  # Store datatype name
-                        #node['node_display_name'] = self.client.get_node(node_id).get_browse_name().Name  # Store display name
-
-                self.update_node_table()
-                server_info['disconnected'] = False
-            except Exception as e:
-                print(f"Error reading from server {server_info['display_name']}: {e}")
-                if not server_info.get('disconnected', False):
-                    server_info['disconnected'] = True
-                    self.handle_server_disconnect(server_info)
-                # Optionally show error in UI
-                pass
-    def handle_server_disconnect(self, server_info):
-        # Stop the regular polling timer
-        server_info['timer'].stop()
-        print(f"Server {server_info['display_name']} disconnected. Will retry in 5 minutes.")
-
-        # Start a retry timer if not already started
-        if not server_info.get('retry_timer'):
-            retry_timer = QTimer()
-            retry_timer.setSingleShot(False)
-            retry_timer.timeout.connect(lambda: self.try_reconnect_server(server_info))
-            retry_timer.start(5 * 60 * 1000)  # 5 minutes
-            server_info['retry_timer'] = retry_timer
-
-    def try_reconnect_server(self, server_info):
-        try:
-            print(f"Attempting to reconnect to {server_info['display_name']}...")
-            server_info['opc_service'].connect()
-            # Optionally reload nodes if needed
-            nodes = server_info['opc_service'].get_nodes()
-            server_info['nodes'] = [n["nodeid"] for n in nodes]
-            # Restart the regular polling timer
-            server_info['timer'].start(server_info['refresh_rate'] * 1000)
-            # Stop the retry timer
-            if server_info.get('retry_timer'):
-                server_info['retry_timer'].stop()
-                server_info['retry_timer'] = None
-            server_info['disconnected'] = False
-            print(f"Reconnected to {server_info['display_name']}.")
-        except Exception as e:
-            print(f"Reconnect failed for {server_info['display_name']}: {e}")
-            # Will retry again in 5 minutes automatically
+    def on_values_decoded(self, records):
+        # Queued from the decode thread; only the newest record per node is kept until the next refresh
+        for record in records:
+            self.pending_records[(record['server_name'], record['node_id'])] = record
+
+    def refresh_node_values(self):
+        if not self.pending_records:
+            return
+        latest, self.pending_records = self.pending_records, {}
+        for node in self.node_data:
+            record = latest.get((node['server_display_name'], node['node_id']))
+            if record:
+                node['last_value'] = str(record['value'])
+                node['timestamp'] = datetime.fromtimestamp(record['timestamp']).strftime('%Y-%m-%d %H:%M:%S')
+                node['datatype'] = record['datatype_name']  # Store datatype name
+        self.update_node_table()
+
+    def update_pipeline_label(self):
+        stats = self.collector.pipeline.stats()
+        decode = stats['queues']['decode']
+        parts = [f"decode queue {decode['depth']}/{decode['maxsize']} ({decode['dropped']} dropped)"]
+        for name, sink in stats['sinks'].items():
+            text = f"{name} queue {sink['depth']}/{sink['maxsize']} ({sink['dropped']} dropped, {sink['written']} written)"
+            if sink['last_error']:
+                text += f" error: {sink['last_error']}"
+            parts.append(text)
+        self.pipeline_label.setText('Pipeline: ' + ', '.join(parts))
+
+    def ui_memory_bytes(self):
+        # Called from the memory monitor thread; copies so the GUI thread can keep changing them
+        return approx_size(list(self.node_data)) + approx_size(dict(self.pending_records))
+
+    def collector_stats(self):
+        # Called from the read API thread; only uses thread-safe services
+        return self.collector.stats()
+
+    def closeEvent(self, event):
+        # Stops polling, drains the queues and writes the still-open buckets; the upsert merges them if they are continued later
+        self.collector.stop()
+        sessions.close_all()
+        if self.read_api:
+            self.read_api.stop()
+        super().closeEvent(event)
 
     def update_node_table(self):
         filter_name = self.server_filter.currentText()
@@ -474,6 +507,7 @@ class OPCUAClientUI(QWidget):
             self.node_table.setItem(row, 3, QTableWidgetItem(node['last_value']))
             self.node_table.setItem(row, 4, QTableWidgetItem(node['datatype']))
             self.node_table.setItem(row, 5, QTableWidgetItem(node['timestamp']))
+            self.node_table.setItem(row, 6, QTableWidgetItem(node.get('status', '')))
 
 class EditConnectionDialog(QDialog):
     def __init__(self, parent=None):
@@ -538,16 +572,16 @@ class EditConnectionDialog(QDialog):
                 server['display_name'] = display_name
                 server['url'] = url
                 server['refresh_rate'] = refresh_rate
-                server['nodes'] = [item.text().split('(')[-1][:-2] for item in self.node_list.selectedItems()]
+                server['nodes'] = config_service.merge_nodes(server.get('nodes', []), [item.text().split('(')[-1][:-2] for item in self.node_list.selectedItems()])
                 break
-            else:
-                # If the server is not found, add a new entry
-                opcua_servers.append({
-                    'display_name': display_name,
-                    'url': url,
-                    'refresh_rate': refresh_rate,
-                    'nodes': [item.text().split('(')[-1][:-2] for item in self.node_list.selectedItems()]
-                })
+        else:
+            # If the server is not found, add a new entry
+            opcua_servers.append({
+                'display_name': display_name,
+                'url': url,
+                'refresh_rate': refresh_rate,
+                'nodes': [item.text().split('(')[-1][:-2] for item in self.node_list.selectedItems()]
+            })
         config['opcua_servers'] = opcua_servers
         config_service.save_config(config)
 
@@ -557,9 +591,8 @@ class EditConnectionDialog(QDialog):
             QMessageBox.warning(self, 'Input Error', 'Please enter the OPC UA server URL.')
             return
         try:
-            opc_service = OPCUAService(url)
-            opc_service.connect()
-            opc_service.disconnect()
+            # Instant when a collector or an earlier dialog action already has a session to this server
+            sessions.release(acquire_session(url))
             QMessageBox.information(self, 'Success', 'Successfully connected to OPC UA server.')
         except Exception as e:
             QMessageBox.critical(self, 'Connection Error', str(e))
@@ -576,13 +609,14 @@ class EditConnectionDialog(QDialog):
         for server in opcua_servers:
             if server.get('display_name') == display_name:
                 url = server.get('url', '')
-                opc_service = OPCUAService(url)
-                opc_service.connect()
-                nodes = opc_service.get_nodes()
+                opc_service = acquire_session(url)
+                try:
+                    nodes = opc_service.get_nodes()
+                finally:
+                    sessions.release(opc_service)
                 self.node_list.clear()
                 for node in nodes:
                     self.node_list.addItem(f'{node["name"]} ({node["nodeid"]})')
-                opc_service.disconnect()
                 break
     
     def update_server_info(self):
@@ -598,7 +632,7 @@ class EditConnectionDialog(QDialog):
                     self.display_name_input.setText(server.get('display_name', ''))
                     self.server_url_input.setText(server.get('url', ''))
                     self.refresh_rate_input.setValue(server.get('refresh_rate', 10))
-                    self.selected_nodes = server.get('nodes', [])
+                    self.selected_nodes = config_service.node_ids(server)
                     break
 
     def update_server_list(self):
@@ -0,0 +1,636 @@
+import argparse
+import json
+import mmap
+import os
+import struct
+import time
+from datetime import datetime, timedelta, timezone
+from services.memory_service import approx_size
+
+# Compressed local history archive for the Pi's SD card, written by the
+# archive sink (see sinks.ArchiveSink). Values are buffered per node and
+# appended as chunks of up to max_points samples, at most window seconds wide
+# and at most max_age seconds old, to one file per UTC day:
+# <directory>/history-YYYYMMDD.opch. Files are only ever appended to, in
+# large sequential writes, and there is no separate index to update.
+#
+# A chunk stores its samples column-wise:
+#   timestamps  milliseconds, first value in the chunk header, then
+#               delta-of-delta zigzag varints (regular polling: 1 byte each)
+#   shapes      run-length encoded (scalar, structure or array and its length)
+#   one column per field of the decoded structures (a single '' column for
+#   scalars), array elements ordered by index so element i of consecutive
+#   samples is adjacent:
+#     float     XOR with the previous value, leading and trailing zero bytes dropped
+#     int/bool  zigzag varint deltas
+#     datetime  zigzag varint deltas of microseconds since the epoch (naive UTC)
+#     str/bytes per-chunk dictionary (GUIDs, names and states are stored once) + varint indices
+#     other     per-chunk dictionary of JSON texts (mixed types, nested values)
+#   with a status byte per value (present, None, missing) only in columns
+#   that have gaps.
+#
+# File layout: MAGIC, then frames of <type:B><length:I><payload>.
+#   SERIES_FRAME  <series id:I> + JSON {kind, server_name, node_id, datatype_name}; ids
+#                 are reassigned by every writer session, the latest definition applies
+#   CHUNK_FRAME   <series id:I><count:I><first ms:q><last ms:q> + columns
+# ArchiveReader maps the files into memory and only decodes the chunks whose
+# node and time range match, so range scans skip most of the data.
+
+MAGIC = b'OPCUAHST\x01'
+SERIES_FRAME = 1
+CHUNK_FRAME = 2
+
+FRAME_HEADER = struct.Struct('<BI')
+CHUNK_HEADER = struct.Struct('<IIqq')
+
+# Column types
+FLOAT = 1
+INT = 2
+BOOL = 3
+STR = 4
+BYTES = 5
+DATETIME = 6
+JSON = 7
+
+# Sample shapes
+SCALAR = 0
+STRUCT = 1
+STRUCT_ARRAY = 2
+SCALAR_ARRAY = 3
+
+# Value status in columns with gaps
+PRESENT = 0
+NONE = 1
+MISSING = 2
+
+_ABSENT = object()  # Field not set in a record, as opposed to set to None
+
+DEFAULT_ARCHIVE_DIRECTORY = 'data/history'
+DEFAULT_WINDOW = 3600      # Seconds a chunk may span
+DEFAULT_MAX_POINTS = 4096  # Samples per chunk
+DEFAULT_MAX_AGE = 300      # Seconds a sample may stay buffered, i.e. what a crash can lose
+
+EPOCH = datetime(1970, 1, 1)
+
+# Extra fields of archived entity changes, so their elements share the columns of the element fields
+ENTITY_KEY_FIELD = '@entity_key'
+ENTITY_OP_FIELD = '@op'
+
+def entity_value(entity_key, op, element):
+    '''Archived value of an entity change (see entity_diff); ArchiveReader.read splits it up again.'''
+    return dict(element or {}, **{ENTITY_KEY_FIELD: entity_key, ENTITY_OP_FIELD: op})
+
+def _put_uvarint(out, n):
+    while n >= 0x80:
+        out.append((n & 0x7f) | 0x80)
+        n >>= 7
+    out.append(n)
+
+def _get_uvarint(buf, pos):
+    result = 0
+    shift = 0
+    while True:
+        b = buf[pos]
+        pos += 1
+        result |= (b & 0x7f) << shift
+        if b < 0x80:
+            return result, pos
+        shift += 7
+
+def _zigzag(n):
+    return n << 1 if n >= 0 else ((-n) << 1) - 1
+
+def _unzigzag(z):
+    return z >> 1 if not z & 1 else -((z + 1) >> 1)
+
+def _put_deltas(out, values):
+    previous = 0
+    for value in values:
+        _put_uvarint(out, _zigzag(value - previous))
+        previous = value
+
+def _get_deltas(buf, pos, count):
+    values = []
+    previous = 0
+    for _ in range(count):
+        z, pos = _get_uvarint(buf, pos)
+        previous += _unzigzag(z)
+        values.append(previous)
+    return values, pos
+
+def _put_xor_floats(out, values):
+    bits = struct.unpack(f'<{len(values)}Q', struct.pack(f'<{len(values)}d', *values))
+    previous = 0
+    for b in bits:
+        x = b ^ previous
+        previous = b
+        if not x:
+            out.append(0)
+            continue
+        leading = (64 - x.bit_length()) // 8
+        trailing = ((x & -x).bit_length() - 1) // 8
+        length = 8 - leading - trailing
+        out.append(leading << 4 | length)
+        out += (x >> (trailing * 8)).to_bytes(length, 'big')
+
+def _get_xor_floats(buf, pos, count):
+    bits = []
+    previous = 0
+    for _ in range(count):
+        control = buf[pos]
+        pos += 1
+        if control:
+            length = control & 0x0f
+            trailing = 8 - (control >> 4) - length
+            previous ^= int.from_bytes(buf[pos:pos + length], 'big') << (trailing * 8)
+            pos += length
+        bits.append(previous)
+    return list(struct.unpack(f'<{count}d', struct.pack(f'<{count}Q', *bits))), pos
+
+def _put_dictionary(out, items):
+    '''items are bytes; each distinct one is stored once, followed by one index per item.'''
+    index = {}
+    indices = []
+    for item in items:
+        i = index.get(item)
+        if i is None:
+            i = index[item] = len(index)
+        indices.append(i)
+    _put_uvarint(out, len(index))
+    for item in index:
+        _put_uvarint(out, len(item))
+        out += item
+    for i in indices:
+        _put_uvarint(out, i)
+
+def _get_dictionary(buf, pos, count):
+    size, pos = _get_uvarint(buf, pos)
+    entries = []
+    for _ in range(size):
+        length, pos = _get_uvarint(buf, pos)
+        entries.append(bytes(buf[pos:pos + length]))
+        pos += length
+    items = []
+    for _ in range(count):
+        i, pos = _get_uvarint(buf, pos)
+        items.append(entries[i])
+    return items, pos
+
+def _micros(value):
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    delta = value - EPOCH
+    return (delta.days * 86400 + delta.seconds) * 1000000 + delta.microseconds
+
+def _column_type(values):
+    types = {type(v) for v in values}
+    if types == {bool}:
+        return BOOL
+    if types == {int}:
+        return INT
+    if types == {float}:
+        return FLOAT
+    if types == {str}:
+        return STR
+    if types <= {bytes, bytearray, memoryview}:
+        return BYTES
+    if types == {datetime}:
+        return DATETIME
+    return JSON
+
+def _put_column(out, name, values):
+    '''values: one entry per record, _ABSENT where the record has no such field.'''
+    present = [v for v in values if v is not None and v is not _ABSENT]
+    column_type = _column_type(present) if present else JSON
+    name_bytes = name.encode('utf-8')
+    _put_uvarint(out, len(name_bytes))
+    out += name_bytes
+    out.append(column_type)
+    if len(present) == len(values):
+        out.append(0)
+    else:
+        out.append(1)
+        out += bytes(MISSING if v is _ABSENT else NONE if v is None else PRESENT for v in values)
+    if column_type == FLOAT:
+        _put_xor_floats(out, present)
+    elif column_type in (INT, BOOL):
+        _put_deltas(out, [int(v) for v in present])
+    elif column_type == DATETIME:
+        _put_deltas(out, [_micros(v) for v in present])
+    elif column_type == STR:
+        _put_dictionary(out, [v.encode('utf-8') for v in present])
+    elif column_type == BYTES:
+        _put_dictionary(out, [bytes(v) for v in present])
+    else:
+        _put_dictionary(out, [json.dumps(v, default=str).encode('utf-8') for v in present])
+
+def _get_column(buf, pos, count):
+    length, pos = _get_uvarint(buf, pos)
+    name = bytes(buf[pos:pos + length]).decode('utf-8')
+    pos += length
+    column_type = buf[pos]
+    has_status = buf[pos + 1]
+    pos += 2
+    if has_status:
+        status = bytes(buf[pos:pos + count])
+        pos += count
+    else:
+        status = bytes(count)
+    present = status.count(PRESENT)
+    if column_type == FLOAT:
+        values, pos = _get_xor_floats(buf, pos, present)
+    elif column_type == INT:
+        values, pos = _get_deltas(buf, pos, present)
+    elif column_type == BOOL:
+        values, pos = _get_deltas(buf, pos, present)
+        values = [bool(v) for v in values]
+    elif column_type == DATETIME:
+        values, pos = _get_deltas(buf, pos, present)
+        values = [EPOCH + timedelta(microseconds=v) for v in values]
+    elif column_type == STR:
+        values, pos = _get_dictionary(buf, pos, present)
+        values = [v.decode('utf-8') for v in values]
+    elif column_type == BYTES:
+        values, pos = _get_dictionary(buf, pos, present)
+    else:
+        values, pos = _get_dictionary(buf, pos, present)
+        values = [json.loads(v) for v in values]
+    it = iter(values)
+    return name, [next(it) if s == PRESENT else None if s == NONE else _ABSENT for s in status], pos
+
+def _shape(value):
+    if isinstance(value, dict):
+        return STRUCT, 1
+    if isinstance(value, list):
+        if value and all(isinstance(v, dict) for v in value):
+            return STRUCT_ARRAY, len(value)
+        return SCALAR_ARRAY, len(value)
+    return SCALAR, 1
+
+def _record_order(lengths):
+    '''(sample, element) pairs of every record, element-major so element i of consecutive samples is adjacent.'''
+    order = []
+    for element in range(max(lengths, default=0)):
+        order.extend((sample, element) for sample, length in enumerate(lengths) if length > element)
+    return order
+
+def encode_chunk(timestamps, values):
+    '''Encodes one node's samples (epoch seconds, decoded values) into a chunk body. Returns (first ms, last ms, body).'''
+    millis = [int(round(t * 1000)) for t in timestamps]
+    out = bytearray()
+    delta = 0
+    for previous, current in zip(millis, millis[1:]):
+        _put_uvarint(out, _zigzag(current - previous - delta))
+        delta = current - previous
+    shapes = [_shape(v) for v in values]
+    runs = []
+    for shape in shapes:
+        if runs and runs[-1][0] == shape:
+            runs[-1][1] += 1
+        else:
+            runs.append([shape, 1])
+    _put_uvarint(out, len(runs))
+    for (kind, length), run in runs:
+        out.append(kind)
+        _put_uvarint(out, length)
+        _put_uvarint(out, run)
+    order = _record_order([length for kind, length in shapes])
+    records = []
+    for sample, element in order:
+        kind = shapes[sample][0]
+        value = values[sample]
+        if kind == STRUCT:
+            records.append(value)
+        elif kind == STRUCT_ARRAY:
+            records.append(value[element])
+        elif kind == SCALAR_ARRAY:
+            records.append({'': value[element]})
+        else:
+            records.append({'': value})
+    fields = {}
+    for record in records:
+        for field in record:
+            fields.setdefault(field, None)
+    _put_uvarint(out, len(fields))
+    for field in fields:
+        _put_column(out, field, [record.get(field, _ABSENT) for record in records])
+    return millis[0], millis[-1], bytes(out)
+
+def decode_chunk(buf, pos, count, first):
+    '''Reverses encode_chunk for the body at buf[pos:]. Returns (timestamps in epoch seconds, values).'''
+    millis = [first]
+    delta = 0
+    for _ in range(count - 1):
+        z, pos = _get_uvarint(buf, pos)
+        delta += _unzigzag(z)
+        millis.append(millis[-1] + delta)
+    run_count, pos = _get_uvarint(buf, pos)
+    shapes = []
+    for _ in range(run_count):
+        kind = buf[pos]
+        length, pos = _get_uvarint(buf, pos + 1)
+        run, pos = _get_uvarint(buf, pos)
+        shapes.extend([(kind, length)] * run)
+    order = _record_order([length for kind, length in shapes])
+    field_count, pos = _get_uvarint(buf, pos)
+    records = [{} for _ in order]
+    for _ in range(field_count):
+        name, column, pos = _get_column(buf, pos, len(order))
+        for record, value in zip(records, column):
+            if value is not _ABSENT:
+                record[name] = value
+    values = [None if kind == SCALAR else {} if kind == STRUCT else [None] * length for kind, length in shapes]
+    for (sample, element), record in zip(order, records):
+        kind = shapes[sample][0]
+        if kind == SCALAR:
+            values[sample] = record.get('')
+        elif kind == STRUCT:
+            values[sample] = record
+        elif kind == STRUCT_ARRAY:
+            values[sample][element] = record
+        else:
+            values[sample][element] = record.get('')
+    return [m / 1000 for m in millis], values
+
+def _day(timestamp):
+    return datetime.fromtimestamp(timestamp, timezone.utc).strftime('%Y%m%d')
+
+def _frames_end(buf):
+    '''Offset after the last complete frame of a file's contents.'''
+    pos = len(MAGIC)
+    while pos + FRAME_HEADER.size <= len(buf):
+        _, length = FRAME_HEADER.unpack_from(buf, pos)
+        if pos + FRAME_HEADER.size + length > len(buf):
+            break
+        pos += FRAME_HEADER.size + length
+    return pos
+
+def _repair(path):
+    '''Cuts off a partly written last frame (power loss, full card) so new frames follow a complete one.'''
+    size = os.path.getsize(path)
+    if size < len(MAGIC):
+        os.truncate(path, 0)
+        return
+    with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        end = _frames_end(mm)
+    if end < size:
+        print(f"Archive: dropping {size - end} bytes of an incomplete frame at the end of {path}")
+        os.truncate(path, end)
+
+class ArchiveWriter:
+    '''
+    Buffers samples per node and appends them as compressed chunks. Not
+    thread-safe; the archive sink calls it from its own thread.
+    '''
+    def __init__(self, directory=DEFAULT_ARCHIVE_DIRECTORY, window=DEFAULT_WINDOW, max_points=DEFAULT_MAX_POINTS,
+                 max_age=DEFAULT_MAX_AGE, retention_days=None, fsync=False):
+        self.directory = directory
+        self.window = window
+        self.max_points = max_points
+        self.max_age = max_age
+        self.retention_days = retention_days
+        self.fsync = fsync
+        self.buffers = {}  # (kind, server_name, node_id, datatype_name) -> {window, since, timestamps, values}
+        self.ready = []  # (key, buffer) of complete chunks not written yet
+        self.file = None
+        self.day = None
+        self.series_ids = {}  # Series defined in the open file
+        self.points = 0
+        self.chunks = 0
+        self.bytes_written = 0
+
+    def _path(self, day):
+        return os.path.join(self.directory, f'history-{day}.opch')
+
+    def _open(self, day):
+        if day == self.day and self.file is not None:
+            return
+        self._close_file()
+        os.makedirs(self.directory, exist_ok=True)
+        path = self._path(day)
+        if os.path.exists(path):
+            _repair(path)
+        self.file = open(path, 'ab')
+        if self.file.tell() == 0:
+            self.file.write(MAGIC)
+            self.bytes_written += len(MAGIC)
+        self.day = day
+        self.series_ids = {}
+        self._expire()
+
+    def _expire(self):
+        if not self.retention_days:
+            return
+        oldest = _day(time.time() - self.retention_days * 86400)
+        for name in os.listdir(self.directory):
+            if name.startswith('history-') and name.endswith('.opch') and name[8:16] < oldest:
+                try:
+                    os.remove(os.path.join(self.directory, name))
+                    print(f"Archive: removed {name}, older than {self.retention_days} days")
+                except OSError as e:
+                    print(f"Archive: could not remove {name}: {e}")
+
+    def _frame(self, frame_type, payload):
+        self.file.write(FRAME_HEADER.pack(frame_type, len(payload)) + payload)
+        self.bytes_written += FRAME_HEADER.size + len(payload)
+
+    def append(self, server_name, node_id, datatype_name, timestamp, value, kind='sample'):
+        '''
+        Buffers one sample; chunks are only written by write_ready(), flush_due()
+        and flush(). Entity changes (kind 'entity') are archived as a series of
+        their own, with the value from entity_value().
+        '''
+        key = (kind, server_name, node_id, datatype_name)
+        window = int(timestamp // self.window)
+        buffer = self.buffers.get(key)
+        if buffer is not None and buffer['window'] != window:
+            self.ready.append((key, self.buffers.pop(key)))
+            buffer = None
+        if buffer is None:
+            buffer = self.buffers[key] = {'window': window, 'since': time.monotonic(), 'timestamps': [], 'values': []}
+        buffer['timestamps'].append(timestamp)
+        buffer['values'].append(value)
+        self.points += 1
+        if len(buffer['timestamps']) >= self.max_points:
+            self.ready.append((key, self.buffers.pop(key)))
+
+    def _write_chunk(self, key, buffer):
+        first, last, body = encode_chunk(buffer['timestamps'], buffer['values'])
+        self._open(_day(buffer['timestamps'][0]))
+        try:
+            series_id = self.series_ids.get(key)
+            if series_id is None:
+                series_id = len(self.series_ids)
+                meta = dict(zip(('kind', 'server_name', 'node_id', 'datatype_name'), key))
+                self._frame(SERIES_FRAME, struct.pack('<I', series_id) + json.dumps(meta).encode('utf-8'))
+                self.series_ids[key] = series_id
+            self._frame(CHUNK_FRAME, CHUNK_HEADER.pack(series_id, len(buffer['timestamps']), first, last) + body)
+        except OSError:
+            # E.g. a full card: the chunk stays ready and the file is repaired when it is reopened
+            self._discard_file()
+            raise
+        self.chunks += 1
+
+    def _sync(self):
+        if self.file is not None:
+            self.file.flush()
+            if self.fsync:
+                os.fsync(self.file.fileno())
+
+    def write_ready(self):
+        '''Writes the chunks that are complete (full or past their window), oldest first.'''
+        if not self.ready:
+            return
+        while self.ready:
+            self._write_chunk(*self.ready[0])
+            self.ready.pop(0)
+        self._sync()
+
+    def flush_due(self):
+        '''Writes the complete chunks and those that have been buffered for max_age seconds.'''
+        now = time.monotonic()
+        for key in [key for key, buffer in self.buffers.items() if now - buffer['since'] >= self.max_age]:
+            self.ready.append((key, self.buffers.pop(key)))
+        self.write_ready()
+
+    def flush(self):
+        '''Writes every buffered sample.'''
+        self.ready.extend(self.buffers.items())
+        self.buffers = {}
+        self.write_ready()
+
+    def buffered_points(self):
+        return sum(len(buffer['timestamps']) for buffer in list(self.buffers.values()) + [b for _, b in self.ready])
+
+    def _close_file(self):
+        if self.file is not None:
+            self._sync()
+            self.file.close()
+            self.file = None
+            self.day = None
+
+    def _discard_file(self):
+        try:
+            self.file.close()
+        except OSError:
+            pass
+        self.file = None
+        self.day = None
+
+    def close(self):
+        try:
+            self.flush()
+        finally:
+            if self.file is not None:
+                self._close_file()
+
+    def memory_bytes(self):
+        return approx_size(self.buffers) + approx_size(self.ready)
+
+    def stats(self):
+        return {'points': self.points, 'chunks': self.chunks, 'bytes': self.bytes_written,
+                'buffered': self.buffered_points()}
+
+class ArchiveReader:
+    '''Reads archive files through memory maps.'''
+    def __init__(self, directory=DEFAULT_ARCHIVE_DIRECTORY):
+        self.directory = directory
+
+    def files(self, start=None, end=None):
+        '''Archive files whose day overlaps [start, end) (epoch seconds), oldest first.'''
+        if not os.path.isdir(self.directory):
+            return []
+        first = _day(start) if start is not None else ''
+        last = _day(end) if end is not None else '99999999'
+        return [os.path.join(self.directory, name) for name in sorted(os.listdir(self.directory))
+                if name.startswith('history-') and name.endswith('.opch') and first <= name[8:16] <= last]
+
+    def _frames(self, path):
+        '''Yields (series meta, count, first ms, last ms, buffer, body offset) for every chunk of a file.'''
+        with open(path, 'rb') as f:
+            if os.fstat(f.fileno()).st_size < len(MAGIC):
+                return
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                if mm[:len(MAGIC)] != MAGIC:
+                    raise ValueError(f'{path} is not an archive file')
+                series = {}
+                pos = len(MAGIC)
+                size = len(mm)
+                while pos + FRAME_HEADER.size <= size:
+                    frame_type, length = FRAME_HEADER.unpack_from(mm, pos)
+                    pos += FRAME_HEADER.size
+                    if pos + length > size:
+                        return  # Truncated last frame, e.g. power loss while writing
+                    if frame_type == SERIES_FRAME:
+                        series[struct.unpack_from('<I', mm, pos)[0]] = json.loads(mm[pos + 4:pos + length].decode('utf-8'))
+                    elif frame_type == CHUNK_FRAME:
+                        series_id, count, first, last = CHUNK_HEADER.unpack_from(mm, pos)
+                        yield series[series_id], count, first, last, mm, pos + CHUNK_HEADER.size
+                    pos += length
+
+    def series(self, start=None, end=None):
+        '''Returns {(server_name, node_id): {kind, datatype_name, chunks, points, first, last}} without decoding chunks.'''
+        result = {}
+        for path in self.files(start, end):
+            for meta, count, first, last, _, _ in self._frames(path):
+                entry = result.setdefault((meta['server_name'], meta['node_id']), {
+                    'kind': meta['kind'], 'datatype_name': meta['datatype_name'], 'chunks': 0, 'points': 0,
+                    'first': first / 1000, 'last': last / 1000})
+                entry['chunks'] += 1
+                entry['points'] += count
+                entry['first'] = min(entry['first'], first / 1000)
+                entry['last'] = max(entry['last'], last / 1000)
+        return result
+
+    def read(self, start=None, end=None, servers=None, nodes=None):
+        '''
+        Yields {kind, server_name, node_id, datatype_name, timestamp, value} (plus
+        entity_key and op for entity changes) for every sample in [start, end)
+        (epoch seconds) of the selected servers and nodes, in order per node.
+        Chunks outside the selection are skipped undecoded.
+        '''
+        start_ms = start * 1000 if start is not None else None
+        end_ms = end * 1000 if end is not None else None
+        for path in self.files(start, end):
+            for meta, count, first, last, buf, pos in self._frames(path):
+                if servers and meta['server_name'] not in servers or nodes and meta['node_id'] not in nodes:
+                    continue
+                if start_ms is not None and last < start_ms or end_ms is not None and first >= end_ms:
+                    continue
+                timestamps, values = decode_chunk(buf, pos, count, first)
+                for timestamp, value in zip(timestamps, values):
+                    if (start is None or timestamp >= start) and (end is None or timestamp < end):
+                        sample = dict(meta, timestamp=timestamp, value=value)
+                        if meta['kind'] == 'entity':
+                            value = dict(value)
+                            sample['entity_key'] = value.pop(ENTITY_KEY_FIELD)
+                            sample['op'] = value.pop(ENTITY_OP_FIELD)
+                            sample['value'] = value or None  # Removals have no element
+                        yield sample
+
+def _epoch(text):
+    return datetime.fromisoformat(text).timestamp()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Inspect or read the local history archive.')
+    parser.add_argument('command', choices=['info', 'read'])
+    parser.add_argument('directory', nargs='?', default=DEFAULT_ARCHIVE_DIRECTORY)
+    parser.add_argument('--start', type=_epoch, help='e.g. 2025-01-01 or 2025-01-01T06:00 (local time)')
+    parser.add_argument('--end', type=_epoch)
+    parser.add_argument('--server', action='append', help='Server display name; can be repeated')
+    parser.add_argument('--node', action='append', help='Node id; can be repeated')
+    args = parser.parse_args()
+    reader = ArchiveReader(args.directory)
+    if args.command == 'info':
+        files = reader.files(args.start, args.end)
+        total = sum(os.path.getsize(path) for path in files)
+        series = reader.series(args.start, args.end)
+        points = sum(entry['points'] for entry in series.values())
+        for (server_name, node_id), entry in sorted(series.items()):
+            print(f"{server_name:<16} {node_id:<40} {entry['datatype_name'] or '':<20} {entry['points']:>10} points "
+                  f"{entry['chunks']:>6} chunks")
+        print(f"{len(files)} files, {total / 1e6:.1f} MB, {points} points, {total / max(points, 1):.1f} bytes/point")
+    else:
+        for sample in reader.read(args.start, args.end, args.server, args.node):
+            sample['timestamp'] = datetime.fromtimestamp(sample['timestamp']).isoformat()
+            print(json.dumps(sample, default=lambda v: v.hex() if isinstance(v, bytes) else str(v)))
@@ -0,0 +1,285 @@
+import argparse
+import json
+import os
+import struct
+import threading
+import time
+from datetime import datetime
+from opcua import ua
+from opcua.common.utils import Buffer
+from opcua.ua.ua_binary import variant_to_binary, variant_from_binary
+import services.opcua_structures as opcua_structures
+import services.type_dictionary as type_dictionary
+
+# Capture and replay of the values read from the OPC UA servers. In capture
+# mode every sample handed to the pipeline is appended to a capture file
+# before it is decoded: ExtensionObjects as their type id and undecoded body
+# bytes, everything else in the OPC UA binary Variant encoding. The type
+# dictionaries of each server are stored once and compiled again on replay,
+# so a replay decodes exactly like the collector did; no code is ever loaded
+# from a capture file. Replaying a capture feeds the samples through the same
+# decode and sink pipeline at real time, N times faster or as fast as
+# possible, which reproduces production load and decoder edge cases without a
+# laser.
+#
+# File layout: MAGIC, then frames of <type:B><length:I><payload>.
+#   NODE_FRAME    <index:I> + JSON {server_name, node_id, datatype_name, datatype_ns, ingest_mode}
+#   CODECS_FRAME  <index:I> + <json length:I> + JSON {server_name, version, lengths} + the type dictionaries
+#                 (XML, lengths[i] bytes each)
+#   SAMPLE_FRAME  <node index:I><codecs index:i (-1: none)><timestamp:d><value kind:B> + value
+#
+# Version 1 files stored generated decoder source instead of the dictionaries;
+# their samples are replayed with the hand-written decoders.
+
+MAGIC = b'OPCUACAP\x02'
+MAGIC_V1 = b'OPCUACAP\x01'
+NODE_FRAME = 1
+CODECS_FRAME = 2
+SAMPLE_FRAME = 3
+
+VALUE_VARIANT = 0     # variant_to_binary
+VALUE_EXTENSION = 1   # <type id length:H> type id + body
+VALUE_EXTENSIONS = 2  # <type id length:H> type id + pack_bodies of the element bodies
+
+FRAME_HEADER = struct.Struct('<BI')
+SAMPLE_HEADER = struct.Struct('<IidB')
+
+DEFAULT_CAPTURE_DIRECTORY = 'data/captures'
+DEFAULT_MAX_MB = 1024
+
+def encode_value(value):
+    '''Returns (value kind, bytes) for a value as returned by OPCUAService.get_values.'''
+    if isinstance(value, ua.ExtensionObject):
+        type_id = value.TypeId.to_string().encode('utf-8')
+        return VALUE_EXTENSION, struct.pack('<H', len(type_id)) + type_id + bytes(value.Body or b'')
+    if isinstance(value, list) and value and all(isinstance(item, ua.ExtensionObject) for item in value):
+        type_id = value[0].TypeId.to_string().encode('utf-8')
+        return VALUE_EXTENSIONS, (struct.pack('<H', len(type_id)) + type_id
+                                  + opcua_structures.pack_bodies([bytes(item.Body or b'') for item in value]))
+    return VALUE_VARIANT, variant_to_binary(ua.Variant(value))
+
+def _extension_object(type_id, body):
+    value = ua.ExtensionObject()
+    value.TypeId = type_id
+    value.Encoding = 1  # Binary body
+    value.Body = body
+    return value
+
+def decode_value(kind, data):
+    '''Reverses encode_value.'''
+    if kind == VALUE_VARIANT:
+        return variant_from_binary(Buffer(data)).Value
+    length = struct.unpack_from('<H', data, 0)[0]
+    type_id = ua.NodeId.from_string(data[2:2 + length].decode('utf-8'))
+    body = data[2 + length:]
+    if kind == VALUE_EXTENSION:
+        return _extension_object(type_id, body)
+    return [_extension_object(type_id, item) for item in opcua_structures.unpack_bodies(body)]
+
+class CaptureWriter:
+    '''
+    Appends samples (see pipeline.decode_sample) to a capture file. Thread-safe.
+    Capturing stops with a message once the file reaches max_bytes.
+    '''
+    def __init__(self, path, max_bytes=DEFAULT_MAX_MB * 1024 * 1024):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self.max_bytes = max_bytes
+        self.file = open(path, 'wb')
+        self.file.write(MAGIC)
+        self.size = len(MAGIC)
+        self.nodes = {}  # (server_name, node_id, datatype_name, datatype_ns, ingest_mode) -> index
+        self.codecs = {}  # (server_name, id(codecs)) -> (index, codecs); the codecs are kept so the id stays unique
+        self.samples = 0
+        self.errors = 0
+        self.full = False
+        self.lock = threading.Lock()
+
+    def _frame(self, frame_type, payload):
+        self.file.write(FRAME_HEADER.pack(frame_type, len(payload)))
+        self.file.write(payload)
+        self.size += FRAME_HEADER.size + len(payload)
+
+    def _node_index(self, sample):
+        key = (sample['server_name'], sample['node_id'], sample['datatype_name'], sample['datatype_ns'], sample['ingest_mode'])
+        index = self.nodes.get(key)
+        if index is None:
+            index = len(self.nodes)
+            self.nodes[key] = index
+            meta = dict(zip(('server_name', 'node_id', 'datatype_name', 'datatype_ns', 'ingest_mode'), key))
+            self._frame(NODE_FRAME, struct.pack('<I', index) + json.dumps(meta).encode('utf-8'))
+        return index
+
+    def _codecs_index(self, sample):
+        codecs = sample.get('codecs')
+        if codecs is None:
+            return -1
+        key = (sample['server_name'], id(codecs))
+        entry = self.codecs.get(key)
+        if entry is None:
+            entry = (len(self.codecs), codecs)
+            self.codecs[key] = entry
+            meta = json.dumps({
+                'server_name': sample['server_name'],
+                'version': codecs.version,
+                'lengths': [len(xml_bytes) for xml_bytes in codecs.dictionaries],
+            }).encode('utf-8')
+            self._frame(CODECS_FRAME, struct.pack('<II', entry[0], len(meta)) + meta + b''.join(codecs.dictionaries))
+        return entry[0]
+
+    def write(self, sample):
+        try:
+            kind, data = encode_value(sample['value'])
+        except Exception as e:
+            # Capturing must never interfere with polling
+            self.errors += 1
+            print(f"Cannot capture {sample['node_id']} on {sample['server_name']}: {e}")
+            return
+        with self.lock:
+            if self.full or self.file.closed:
+                return
+            if self.size >= self.max_bytes:
+                self.full = True
+                print(f"Capture {self.path} reached {self.max_bytes // (1024 * 1024)} MB, capturing stopped.")
+                return
+            node_index = self._node_index(sample)
+            codecs_index = self._codecs_index(sample)
+            self._frame(SAMPLE_FRAME, SAMPLE_HEADER.pack(node_index, codecs_index, sample['timestamp'], kind) + data)
+            self.samples += 1
+
+    def flush(self):
+        with self.lock:
+            if not self.file.closed:
+                self.file.flush()
+
+    def close(self):
+        with self.lock:
+            if not self.file.closed:
+                self.file.close()
+
+    def stats(self):
+        with self.lock:
+            return {'path': self.path, 'samples': self.samples, 'bytes': self.size, 'errors': self.errors, 'full': self.full}
+
+def open_capture(config):
+    '''Returns a CaptureWriter for the "capture" config section, or None if capturing is disabled.'''
+    if not config.get('enabled', False):
+        return None
+    directory = config.get('directory', DEFAULT_CAPTURE_DIRECTORY)
+    path = os.path.join(directory, f"capture-{datetime.now().strftime('%Y%m%d-%H%M%S')}.opcap")
+    return CaptureWriter(path, int(config.get('max_mb', DEFAULT_MAX_MB) * 1024 * 1024))
+
+def read_capture(path):
+    '''
+    Yields the samples of a capture file in the order they were captured, in the
+    form IngestPipeline.submit takes them (with codecs compiled from the captured
+    type dictionaries).
+    '''
+    nodes = {}
+    codecs = {}
+    with open(path, 'rb') as f:
+        magic = f.read(len(MAGIC))
+        if magic == MAGIC_V1:
+            print(f"{path} stores decoder source, which is not loaded; using the hand-written decoders instead.")
+        elif magic != MAGIC:
+            raise ValueError(f'{path} is not a capture file')
+        while True:
+            header = f.read(FRAME_HEADER.size)
+            if len(header) < FRAME_HEADER.size:
+                return
+            frame_type, length = FRAME_HEADER.unpack(header)
+            payload = f.read(length)
+            if len(payload) < length:
+                return  # Truncated last frame, e.g. the collector was killed while capturing
+            if frame_type == NODE_FRAME:
+                nodes[struct.unpack_from('<I', payload, 0)[0]] = json.loads(payload[4:].decode('utf-8'))
+            elif frame_type == CODECS_FRAME and magic == MAGIC:
+                index, meta_length = struct.unpack_from('<II', payload, 0)
+                meta = json.loads(payload[8:8 + meta_length].decode('utf-8'))
+                dictionaries = []
+                offset = 8 + meta_length
+                for length in meta['lengths']:
+                    dictionaries.append(payload[offset:offset + length])
+                    offset += length
+                codecs[index] = type_dictionary.compile_codecs(dictionaries)
+            elif frame_type == SAMPLE_FRAME:
+                node_index, codecs_index, timestamp, kind = SAMPLE_HEADER.unpack_from(payload, 0)
+                sample = dict(nodes[node_index])
+                sample['timestamp'] = timestamp
+                sample['value'] = decode_value(kind, payload[SAMPLE_HEADER.size:])
+                sample['codecs'] = codecs.get(codecs_index)
+                yield sample
+
+def replay(path, pipeline, speed=1.0, retime=False):
+    '''
+    Feeds a capture file through an IngestPipeline.
+
+    Parameters
+    ----------
+    path: Capture file.
+    pipeline: A started IngestPipeline.
+    speed: 1.0 replays at the captured pace, N replays N times faster, 0 as fast as possible.
+    retime: Replace the captured timestamps with the time of the replay.
+
+    Returns
+    -------
+    count: Number of samples replayed.
+    '''
+    count = 0
+    start = time.monotonic()
+    first = None
+    for sample in read_capture(path):
+        if first is None:
+            first = sample['timestamp']
+        if speed:
+            delay = (sample['timestamp'] - first) / speed - (time.monotonic() - start)
+            if delay > 0:
+                time.sleep(delay)
+        if retime:
+            sample['timestamp'] = time.time()
+        pipeline.submit(sample)
+        count += 1
+    return count
+
+if __name__ == '__main__':
+    import services.config_service as config_service
+    import services.sinks as sinks
+    from services.pipeline import IngestPipeline, BLOCK
+    from services.entity_diff import EntityDiffer
+    from services.lifecycle import LifecycleTracker, DEFAULT_TERMINAL_STATES
+    from services.rollup_service import build_aggregator
+    from services.postgres_service import DEFAULT_LAYOUT, DEFAULT_WRITE_METHOD
+    parser = argparse.ArgumentParser(description='Replay a capture file through the decode and sink pipeline.')
+    parser.add_argument('capture', help='Capture file (.opcap)')
+    parser.add_argument('--speed', type=float, default=1.0, help='1 = real time, N = N times faster, 0 = as fast as possible')
+    parser.add_argument('--sink', action='append', choices=sorted(sinks.SINK_TYPES),
+                        help='Sink type with default settings; can be repeated. Defaults to the sinks in data/config.json')
+    parser.add_argument('--conn-str', help='Postgres connection string for postgres sinks')
+    parser.add_argument('--retime', action='store_true', help='Store the samples with the replay time instead of the captured time')
+    args = parser.parse_args()
+    config = config_service.load_config()
+    sink_configs = [{'type': sink_type} for sink_type in args.sink] if args.sink else sinks.sink_configs(config)
+    # Nothing is dropped on purpose: every queue waits for the stage behind it, however long it takes
+    sink_configs = [dict(c, queue=dict(c.get('queue', {}), policy=BLOCK), block_timeout=None) for c in sink_configs]
+    storage_config = config.get('storage', {})
+    pipeline_sinks = sinks.build_sinks(sink_configs, conn_str=args.conn_str,
+                                       layout=storage_config.get('layout', DEFAULT_LAYOUT),
+                                       write_method=storage_config.get('write_method', DEFAULT_WRITE_METHOD))
+    pipeline_config = dict(config.get('pipeline', {}), block_timeout=None)
+    pipeline_config['decode_queue'] = dict(pipeline_config.get('decode_queue', {}), policy=BLOCK)
+    rollup_config = config.get('rollups', {})
+    pipeline = IngestPipeline(pipeline_config, pipeline_sinks,
+                              differ=EntityDiffer() if config.get('entity_diff', False) else None,
+                              rollups=build_aggregator(rollup_config),
+                              rollup_flush_interval=rollup_config.get('flush_interval', 30))
+    lifecycle = LifecycleTracker(pipeline.emit, config.get('lifecycle', {}).get('terminal_states', DEFAULT_TERMINAL_STATES))
+    pipeline.listeners.append(lifecycle)
+    pipeline.start()
+    started = time.monotonic()
+    count = replay(args.capture, pipeline, args.speed, args.retime)
+    pipeline.stop(timeout=60.0)
+    elapsed = time.monotonic() - started
+    print(f"Replayed {count} samples in {elapsed:.1f} s ({count / max(elapsed, 1e-9):.0f} samples/s).")
+    print(json.dumps(pipeline.stats(), indent=2))
@@ -0,0 +1,438 @@
+import argparse
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import services.config_service as config_service
+import services.type_dictionary as type_dictionary
+import services.sinks as sinks
+import services.capture as capture
+from services.memory_service import MemoryMonitor
+from services.opcua_service import DEFAULT_TIMEOUT, is_node_error
+from services.postgres_service import DEFAULT_LAYOUT, DEFAULT_WRITE_METHOD
+from services.session_manager import sessions
+from services.scheduler import PollScheduler
+from services.rollup_service import build_aggregator
+from services.pipeline import IngestPipeline
+from services.entity_diff import EntityDiffer
+from services.lifecycle import LifecycleTracker, DEFAULT_TERMINAL_STATES
+from services.lease_service import LeaseManager, DEFAULT_LEASE_SECONDS, DEFAULT_RENEW_INTERVAL
+from services.read_api import LiveStore, ReadApiServer, DEFAULT_HOST, DEFAULT_PORT, DEFAULT_HISTORY_SIZE
+
+# Connect -> poll -> pipeline path shared by the GUI and the headless
+# collector. Nothing here runs on the Qt thread: every server has its own read
+# lane (a single worker thread), so a slow or hanging server only delays its
+# own nodes, and the poll thread hands each lane the nodes that are due. Nodes
+# that become due while their lane is still reading are read together in the
+# lane's next request. Results leave through callbacks (on_status, on_decoded)
+# that the GUI turns into queued signals.
+#
+# Run it headless with python -m services.collector. With --leases several
+# instances can share one config.json and split the servers between them (see
+# lease_service).
+
+DEFAULT_RECONNECT_INTERVAL = 300  # seconds, like the GUI's retry timer
+
+class Collector:
+    def __init__(self, config, conn_str=None, on_status=None, on_decoded=None, live_store=None, leases=None):
+        '''
+        Parameters
+        ----------
+        config: The configuration (see config_service.load_config) for the pipeline, sinks and defaults.
+        conn_str: Postgres connection string for the postgres sinks.
+        on_status: Optional callback(server_name, status), called from worker threads.
+        on_decoded: Optional callback with each batch of decoded records (see IngestPipeline).
+        live_store: Optional read_api.LiveStore kept up to date with values and statuses.
+        leases: Optional lease_service.LeaseManager; a server is only read while its lease is held.
+        '''
+        self.config = config
+        self.leases = leases
+        self.on_status = on_status
+        self.live_store = live_store
+        self.scheduler = PollScheduler()
+        rollup_config = config.get('rollups', {})
+        self.rollups = build_aggregator(rollup_config)
+        storage_config = config.get('storage', {})
+        pipeline_sinks = sinks.build_sinks(sinks.sink_configs(config), conn_str=conn_str,
+                                           layout=storage_config.get('layout', DEFAULT_LAYOUT),
+                                           write_method=storage_config.get('write_method', DEFAULT_WRITE_METHOD))
+        self.differ = EntityDiffer() if config.get('entity_diff', False) else None
+        self.pipeline = IngestPipeline(config.get('pipeline', {}), pipeline_sinks,
+                                       listeners=[self.on_record],
+                                       on_decoded=on_decoded,
+                                       differ=self.differ,
+                                       capture=capture.open_capture(config.get('capture', {})),
+                                       rollups=self.rollups,
+                                       rollup_flush_interval=rollup_config.get('flush_interval', 30))
+        self.lifecycle = LifecycleTracker(self.pipeline.emit,
+                                          config.get('lifecycle', {}).get('terminal_states', DEFAULT_TERMINAL_STATES))
+        self.pipeline.listeners.append(self.lifecycle)
+        self.memory = MemoryMonitor(config.get('memory', {}))
+        self.memory.register('decode_queue', self.pipeline.decode_queue.memory_bytes, self.pipeline.decode_queue.shed)
+        for sink in pipeline_sinks:
+            self.memory.register(f'sink:{sink.name}', sink.memory_bytes, sink.shed)
+        if self.differ:
+            self.memory.register('entity_diff', self.differ.memory_bytes, self.differ.shed, stateful=True)
+        if live_store:
+            self.memory.register('live_store', live_store.memory_bytes, live_store.shed)
+        self.memory.register('scheduler', self.scheduler.memory_bytes)
+        if self.rollups:
+            self.memory.register('rollups', self.rollups.memory_bytes, self.rollups.shed, stateful=True)
+        self.memory.register('lifecycle', self.lifecycle.memory_bytes)
+        self.memory.register('codecs', type_dictionary.cache_bytes)
+        self.servers = {}  # display_name -> server_info
+        self.lock = threading.Lock()
+        self.running = False
+        self.thread = None
+
+    def start(self):
+        self.pipeline.start()
+        self.memory.start()
+        self.running = True
+        self.thread = threading.Thread(target=self._poll_loop, name='collector-poll', daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        '''Stops polling and every server, then drains the pipeline.'''
+        self.running = False
+        if self.thread:
+            self.thread.join()
+        connects = [info['connect_thread'] for info in list(self.servers.values()) if info['connect_thread']]
+        for display_name in list(self.servers):
+            self.stop_server(display_name)
+        for thread in connects:
+            thread.join()
+        self.pipeline.stop()
+        self.memory.stop()
+
+    def on_record(self, record):
+        # Decode thread; the scheduler is thread-safe
+        self.scheduler.report(record['server_name'], record['node_id'],
+                              record['raw'][3] if record['raw'] else record['decoded'])
+        if self.live_store:
+            self.live_store.update(record['server_name'], record['node_id'], record['decoded'],
+                                   record['datatype_name'], record['timestamp'])
+
+    def _set_status(self, server_info, status):
+        server_info['status'] = status
+        if self.live_store and not server_info['stopped']:
+            self.live_store.set_status(server_info['display_name'], status)
+        if self.on_status:
+            self.on_status(server_info['display_name'], status)
+
+    def start_server(self, server):
+        url = server.get('url', '')
+        display_name = server.get('display_name', url)
+        if not url or display_name in self.servers:
+            return None
+        server_info = {
+            'opc_service': None,
+            'timeout': server.get('timeout', DEFAULT_TIMEOUT),
+            'security': server.get('security'),
+            'display_name': display_name,
+            'refresh_rate': server.get('refresh_rate', 10),
+            'nodes': config_service.node_ids(server),
+            'config': server,
+            'url': url,
+            'disconnected': True,
+            'connecting': False,
+            'reconnect_at': None,
+            'stopped': False,
+            'datatypes': {},
+            'ingest_mode': server.get('ingest_mode', self.config.get('ingest_mode', 'decoded')),
+            'generated_decoders': server.get('generated_decoders', True),
+            'codecs': None,
+            'connect_thread': None,
+            'failed_nodes': set(),  # Nodes whose last read failed on their own, logged once
+            'lane': ThreadPoolExecutor(max_workers=1, thread_name_prefix=f'opcua-lane-{display_name}'),
+            'pending': {},  # node_id -> None, in due order; read by the lane's next request
+            'busy': False,
+            'lease_lost': False,  # The lease was not certainly held at the last read
+            'skipped_reads': 0,  # Node reads skipped for that reason
+        }
+        with self.lock:
+            self.servers[display_name] = server_info
+        # Nodes stay paused until the session is up
+        self.scheduler.pause(display_name)
+        self._schedule(server_info, server_info['nodes'])
+        self._connect(server_info)
+        return server_info
+
+    def _schedule(self, server_info, node_ids):
+        entries = {config_service.node_id_of(e): e for e in server_info['config'].get('nodes', [])}
+        config = dict(server_info['config'], refresh_rate=server_info['refresh_rate'])
+        for node_id in node_ids:
+            interval, max_interval = config_service.node_rates(config, entries.get(node_id, node_id))
+            self.scheduler.add(server_info['display_name'], node_id, interval, max_interval)
+
+    def update_server(self, server, changes):
+        '''
+        Applies changes that do not need a new session (see config_service.diff_servers)
+        to a running server: ingest mode, refresh rates and added or removed nodes.
+        '''
+        server_info = self.servers.get(server.get('display_name', server.get('url', '')))
+        if server_info is None:
+            return
+        server_info['ingest_mode'] = server.get('ingest_mode', self.config.get('ingest_mode', 'decoded'))
+        server_info['config'] = server
+        if changes['refresh_rate'] is not None:
+            server_info['refresh_rate'] = changes['refresh_rate']
+            self._schedule(server_info, server_info['nodes'])
+        elif changes['nodes_retimed']:
+            self._schedule(server_info, changes['nodes_retimed'])
+        if changes['nodes_added'] or changes['nodes_removed']:
+            server_info['nodes'] = config_service.node_ids(server)
+            self._schedule(server_info, changes['nodes_added'])
+            for node_id in changes['nodes_removed']:
+                with self.lock:
+                    server_info['pending'].pop(node_id, None)
+                self.scheduler.remove(server_info['display_name'], node_id)
+                if self.live_store:
+                    self.live_store.remove(server_info['display_name'], node_id)
+                if self.differ:
+                    self.differ.forget(server_info['display_name'], node_id)
+
+    def stop_server(self, display_name):
+        with self.lock:
+            server_info = self.servers.pop(display_name, None)
+            if server_info is None:
+                return
+            server_info['stopped'] = True
+            server_info['pending'].clear()
+        self.scheduler.remove(display_name)
+        if self.live_store:
+            self.live_store.remove(display_name)
+        if self.differ:
+            self.differ.forget(display_name)
+        self.lifecycle.forget(display_name)
+        # Lets a read in progress finish on its own; the session is released after it
+        server_info['lane'].submit(self._release, server_info)
+        server_info['lane'].shutdown(wait=False)
+        self._set_status(server_info, 'Stopped')
+
+    def sync(self, servers):
+        '''
+        Makes the collected servers match a list of server configs: new ones are
+        started, missing ones stopped, and changed ones updated in place or
+        reconnected if their url, timeout or security changed.
+        '''
+        wanted = {s.get('display_name', s.get('url', '')): s for s in servers}
+        for display_name, server_info in list(self.servers.items()):
+            server = wanted.get(display_name)
+            if server is None:
+                self.stop_server(display_name)
+            elif server != server_info['config']:
+                diff = config_service.diff_servers({'opcua_servers': [server_info['config']]}, {'opcua_servers': [server]})
+                changes = diff['changed'][0][2]
+                if changes['reconnect']:
+                    self.stop_server(display_name)
+                else:
+                    self.update_server(server, changes)
+        for display_name, server in wanted.items():
+            if display_name not in self.servers:
+                self.start_server(server)
+
+    def _release(self, server_info):
+        if server_info['opc_service']:
+            sessions.release(server_info['opc_service'])
+            server_info['opc_service'] = None
+
+    def _connect(self, server_info):
+        server_info['connecting'] = True
+        server_info['reconnect_at'] = None
+        self._set_status(server_info, 'Connecting...')
+        # One thread per connecting server (there is never more than one), so however many servers
+        # hang until their timeout, the others still connect right away
+        thread = threading.Thread(target=self._connect_worker, args=(server_info,),
+                                  name=f"opcua-connect-{server_info['display_name']}", daemon=True)
+        server_info['connect_thread'] = thread
+        thread.start()
+
+    def _connect_worker(self, server_info):
+        self._release(server_info)
+        server_info['datatypes'] = {}
+        try:
+            opc_service = sessions.acquire(server_info['url'], server_info['timeout'], server_info['security'])
+        except Exception as e:
+            print(f"Failed to connect to server {server_info['display_name']}: {e}")
+            self._set_status(server_info, f'Failed: {e}')
+            server_info['reconnect_at'] = time.monotonic() + DEFAULT_RECONNECT_INTERVAL
+            server_info['connecting'] = False
+            return
+        server_info['opc_service'] = opc_service
+        server_info['codecs'] = None
+        if server_info['generated_decoders']:
+            try:
+                server_info['codecs'] = type_dictionary.load_codecs(opc_service)
+            except Exception as e:
+                print(f"Using built-in decoders for {server_info['display_name']}, type dictionary unavailable: {e}")
+        server_info['connecting'] = False
+        if server_info['stopped']:
+            self._release(server_info)
+            return
+        server_info['disconnected'] = False
+        self._set_status(server_info, 'Connected')
+        print(f"Connected to {server_info['display_name']}.")
+        self.scheduler.resume(server_info['display_name'])
+
+    def _poll_loop(self):
+        while self.running:
+            time.sleep(self.scheduler.tick)
+            now = time.monotonic()
+            with self.lock:
+                servers = dict(self.servers)
+            for display_name, node_ids in self.scheduler.due().items():
+                server_info = servers.get(display_name)
+                if server_info and not server_info['disconnected']:
+                    self._dispatch(server_info, node_ids)
+            for server_info in servers.values():
+                if server_info['reconnect_at'] is not None and now >= server_info['reconnect_at']:
+                    print(f"Attempting to reconnect to {server_info['display_name']}...")
+                    self._connect(server_info)
+
+    def _dispatch(self, server_info, node_ids):
+        with self.lock:
+            if server_info['stopped']:
+                return
+            server_info['pending'].update(dict.fromkeys(node_ids))
+            if server_info['busy']:
+                return  # The lane picks them up when its current read is done
+            server_info['busy'] = True
+        server_info['lane'].submit(self._drain_lane, server_info)
+
+    def _drain_lane(self, server_info):
+        while True:
+            with self.lock:
+                node_ids = list(server_info['pending'])
+                server_info['pending'].clear()
+                if not node_ids or server_info['stopped'] or server_info['disconnected']:
+                    server_info['busy'] = False
+                    return
+            if self.leases and not self.leases.holds(server_info['display_name']):
+                # The lease may have expired while renewing hangs; the next owner could already be reading
+                if not server_info['lease_lost']:
+                    print(f"Lease of {server_info['display_name']} is not certainly held, skipping reads until it is renewed.")
+                    server_info['lease_lost'] = True
+                server_info['skipped_reads'] += len(node_ids)
+                continue
+            if server_info['lease_lost']:
+                print(f"Lease of {server_info['display_name']} renewed ({server_info['skipped_reads']} node reads skipped so far).")
+                server_info['lease_lost'] = False
+            self._read(server_info, node_ids)
+
+    def _read(self, server_info, node_ids):
+        try:
+            # One round trip for every node that is due
+            values = server_info['opc_service'].get_values(node_ids)
+            timestamp = time.time()
+            for node_id, value in zip(node_ids, values):
+                datatype_node = server_info['datatypes'].get(node_id)
+                if datatype_node is None:
+                    try:
+                        datatype_node = server_info['opc_service'].get_datatype(node_id)
+                    except Exception as e:
+                        if not is_node_error(e):
+                            raise
+                        # The session is fine; only this node is skipped until it can be read again
+                        if node_id not in server_info['failed_nodes']:
+                            print(f"Skipping node {node_id} on {server_info['display_name']}: {e}")
+                            server_info['failed_nodes'].add(node_id)
+                        continue
+                    server_info['datatypes'][node_id] = datatype_node
+                    server_info['failed_nodes'].discard(node_id)
+                self.pipeline.submit({
+                    'server_name': server_info['display_name'],
+                    'node_id': node_id,
+                    'datatype_name': datatype_node.Name,
+                    'datatype_ns': datatype_node.NamespaceIndex,
+                    'value': value,
+                    'timestamp': timestamp,
+                    'ingest_mode': server_info['ingest_mode'],
+                    'codecs': server_info['codecs'],
+                })
+        except Exception as e:
+            if server_info['stopped']:
+                return
+            print(f"Error reading from server {server_info['display_name']}: {e}")
+            server_info['disconnected'] = True
+            self.scheduler.pause(server_info['display_name'])
+            if server_info['opc_service']:
+                sessions.invalidate(server_info['opc_service'])
+                server_info['opc_service'] = None
+            self._set_status(server_info, f'Disconnected: {e}')
+            server_info['reconnect_at'] = time.monotonic() + DEFAULT_RECONNECT_INTERVAL
+
+    def stats(self):
+        return {
+            'scheduler': self.scheduler.stats(),
+            'pipeline': self.pipeline.stats(),
+            'sessions': sessions.stats(),
+            'memory': self.memory.stats(),
+            'servers': {name: {'status': info.get('status', ''), 'pending': len(info['pending']), 'busy': info['busy'],
+                               'skipped_reads': info['skipped_reads'], 'failed_nodes': len(info['failed_nodes'])}
+                        for name, info in list(self.servers.items())},
+        }
+
+def run(conn_str, instance_id=None, leases=False, lease_seconds=DEFAULT_LEASE_SECONDS,
+        renew_interval=DEFAULT_RENEW_INTERVAL, stats_interval=60):
+    '''
+    Collects the servers in config.json until interrupted. With leases, only the
+    servers this instance holds a lease for are collected.
+    '''
+    config = config_service.load_config()
+    session_config = config.get('sessions', {})
+    sessions.idle_timeout = session_config.get('idle_timeout', sessions.idle_timeout)
+    sessions.keepalive_interval = session_config.get('keepalive_interval', sessions.keepalive_interval)
+    # Like the GUI, the headless collector serves its values over the read API
+    api_config = config.get('read_api', {})
+    live_store = LiveStore(api_config.get('history_size', DEFAULT_HISTORY_SIZE)) if api_config.get('enabled', True) else None
+    lease_manager = LeaseManager(conn_str, instance_id, lease_seconds, renew_interval) if leases else None
+    collector = Collector(config, conn_str, live_store=live_store, leases=lease_manager)
+    collector.start()
+    read_api = None
+    if live_store:
+        try:
+            read_api = ReadApiServer(live_store, api_config.get('host', DEFAULT_HOST), api_config.get('port', DEFAULT_PORT),
+                                     api_config.get('sse', True), collector.stats, collector.memory)
+            read_api.start()
+        except OSError as e:
+            # E.g. a second instance on the same host; give each one its own read_api port
+            print(f"Read API disabled: {e}")
+    last_stats = time.monotonic()
+    try:
+        while True:
+            # Server changes in config.json are picked up on every round; pipeline settings need a restart
+            config = config_service.load_config()
+            collector.config = config
+            servers = config.get('opcua_servers', [])
+            if lease_manager:
+                owned = lease_manager.update([s.get('display_name', s.get('url', '')) for s in servers])
+                servers = [s for s in servers if s.get('display_name', s.get('url', '')) in owned]
+            collector.sync(servers)
+            if time.monotonic() - last_stats >= stats_interval:
+                last_stats = time.monotonic()
+                summary = {name: info['status'] for name, info in collector.stats()['servers'].items()}
+                if lease_manager:
+                    summary = dict(lease_manager.stats(), servers=summary)
+                print(json.dumps(summary))
+            time.sleep(renew_interval)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        # Collection stops before the leases are given up, so the next owner never overlaps with this one
+        if read_api:
+            read_api.stop()
+        collector.stop()
+        if lease_manager:
+            lease_manager.release_all()
+        sessions.close_all()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Collect the OPC UA servers in data/config.json without the GUI.')
+    parser.add_argument('conn_str', help='Postgres connection string, e.g. "dbname=... user=... password=... host=..."')
+    parser.add_argument('--leases', action='store_true', help='Share the servers with other instances through leases in Postgres')
+    parser.add_argument('--instance-id', help='Unique name of this instance; defaults to host name and start time')
+    parser.add_argument('--lease-seconds', type=float, default=DEFAULT_LEASE_SECONDS)
+    parser.add_argument('--renew-interval', type=float, default=DEFAULT_RENEW_INTERVAL)
+    args = parser.parse_args()
+    run(args.conn_str, args.instance_id, args.leases, args.lease_seconds, args.renew_interval)
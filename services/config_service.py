@@ -1,14 +1,178 @@
+import copy
 import json
 import os
+import tempfile
+import threading
 
 CONFIG_PATH = "data/config.json"
 
+_lock = threading.RLock()
+_cache = {"stat": None, "config": {}, "loaded": False}
+_subscribers = []
+
+def _stat_key():
+    try:
+        st = os.stat(CONFIG_PATH)
+    except FileNotFoundError:
+        return None
+    return (st.st_mtime_ns, st.st_size)
+
+def subscribe(callback):
+    '''
+    Registers a callback that is called as callback(old_config, new_config)
+    whenever the configuration changes, either through save_config or because
+    the file was edited on disk and picked up by load_config.
+    Callbacks run on the thread that detected the change.
+    '''
+    with _lock:
+        if callback not in _subscribers:
+            _subscribers.append(callback)
+
+def unsubscribe(callback):
+    with _lock:
+        if callback in _subscribers:
+            _subscribers.remove(callback)
+
+def _notify(old, new):
+    with _lock:
+        subscribers = list(_subscribers)
+    for callback in subscribers:
+        try:
+            callback(copy.deepcopy(old), copy.deepcopy(new))
+        except Exception as e:
+            print(f"Config subscriber {callback} failed: {e}")
+
 def load_config():
-    if not os.path.exists(CONFIG_PATH):
-        return {}
-    with open(CONFIG_PATH, "r") as f:
-        return json.load(f)
+    '''
+    Returns the parsed configuration.
+
+    The file is only re-read when its mtime or size changed since the last
+    call, so this is cheap enough to call on every UI event. A deep copy is
+    returned so callers can modify it before passing it to save_config.
+    '''
+    with _lock:
+        key = _stat_key()
+        if _cache["loaded"] and key == _cache["stat"]:
+            return copy.deepcopy(_cache["config"])
+        old = _cache["config"]
+        if key is None:
+            new = {}
+        else:
+            with open(CONFIG_PATH, "r") as f:
+                new = json.load(f)
+        # Only the very first read is not a change; a file created after a start without one is
+        first_load = not _cache["loaded"]
+        _cache["loaded"] = True
+        _cache["stat"] = key
+        _cache["config"] = new
+    if not first_load and old != new:
+        _notify(old, new)
+    return copy.deepcopy(new)
 
 def save_config(config):
-    with open(CONFIG_PATH, "w") as f:
-        json.dump(config, f, indent=2)
\ No newline at end of file
+    '''
+    Writes the configuration atomically: the data goes to a temporary file in
+    the same directory which then replaces config.json, so a crash mid-write
+    leaves either the old or the new file, never a truncated one.
+    '''
+    directory = os.path.dirname(CONFIG_PATH) or "."
+    os.makedirs(directory, exist_ok=True)
+    with _lock:
+        old = _cache["config"]
+        fd, tmp_path = tempfile.mkstemp(prefix=".config.", suffix=".tmp", dir=directory)
+        try:
+            with os.fdopen(fd, "w") as f:
+                json.dump(config, f, indent=2)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, CONFIG_PATH)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        new = copy.deepcopy(config)
+        _cache["stat"] = _stat_key()
+        _cache["config"] = new
+        _cache["loaded"] = True
+    if old != new:
+        _notify(old, new)
+
+def node_id_of(entry):
+    '''
+    Returns the node id of a "nodes" entry. Entries are either a node id string
+    or a dict such as {"node_id": "ns=2;s=Work.CurrentRun", "rate": 1, "max_rate": 30}.
+    '''
+    return entry["node_id"] if isinstance(entry, dict) else entry
+
+def node_ids(server):
+    return [node_id_of(entry) for entry in server.get("nodes", [])]
+
+def node_rates(server, entry):
+    '''
+    Returns (interval, max_interval) in seconds for a "nodes" entry. Nodes without
+    their own "rate" use the server's refresh_rate; "max_rate" lets the scheduler
+    slow a node down up to that interval while its value is static.
+    '''
+    interval = server.get("refresh_rate", 10)
+    max_interval = None
+    if isinstance(entry, dict):
+        interval = entry.get("rate", interval)
+        max_interval = entry.get("max_rate")
+    return interval, max_interval
+
+def find_server_by_url(config, url):
+    '''Returns the configured server dict with this url, or None.'''
+    for server in config.get("opcua_servers", []):
+        if server.get("url") == url:
+            return server
+    return None
+
+def merge_nodes(existing, selected_ids):
+    '''
+    Builds a new "nodes" list from selected node ids, keeping the per-node
+    settings of entries that were already configured.
+    '''
+    by_id = {node_id_of(entry): entry for entry in existing}
+    return [by_id.get(node_id, node_id) for node_id in selected_ids]
+
+def diff_servers(old_config, new_config):
+    '''
+    Compares the opcua_servers sections of two configurations.
+
+    Servers are matched by display_name, so a rename shows up as one removed
+    and one added server.
+
+    Returns
+    -------
+    dict with keys
+        added: list of server dicts only present in new_config
+        removed: list of server dicts only present in old_config
+        changed: list of (old_server, new_server, changes) tuples where changes
+            has the keys 'reconnect' (url, timeout or security changed), 'refresh_rate'
+            (new rate or None), and the node id lists 'nodes_added',
+            'nodes_removed' and 'nodes_retimed' (rate or max_rate changed).
+    '''
+    old_servers = {s.get("display_name", s.get("url", "")): s for s in old_config.get("opcua_servers", [])}
+    new_servers = {s.get("display_name", s.get("url", "")): s for s in new_config.get("opcua_servers", [])}
+    diff = {"added": [], "removed": [], "changed": []}
+    for name, server in new_servers.items():
+        if name not in old_servers:
+            diff["added"].append(server)
+    for name, server in old_servers.items():
+        if name not in new_servers:
+            diff["removed"].append(server)
+            continue
+        new = new_servers[name]
+        if server == new:
+            continue
+        old_nodes = {node_id_of(n): node_rates(server, n) for n in server.get("nodes", [])}
+        new_nodes = {node_id_of(n): node_rates(new, n) for n in new.get("nodes", [])}
+        changes = {
+            "reconnect": any(server.get(k) != new.get(k) for k in ("url", "timeout", "security")),
+            "refresh_rate": new.get("refresh_rate", 10) if server.get("refresh_rate", 10) != new.get("refresh_rate", 10) else None,
+            "nodes_added": [n for n in new_nodes if n not in old_nodes],
+            "nodes_removed": [n for n in old_nodes if n not in new_nodes],
+            "nodes_retimed": [n for n in new_nodes if n in old_nodes and old_nodes[n] != new_nodes[n]],
+        }
+        diff["changed"].append((server, new, changes))
+    return diff
@@ -0,0 +1,128 @@
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import services.opcua_structures as opcua_structures
+import services.type_dictionary as type_dictionary
+
+# Optional process pool for decoding large structure arrays (PlanInfo[],
+# PartInfo[], ...). Their elements are variable-length and full of strings, so
+# decoding is pure Python and holds the GIL; in the decode thread a big job
+# list stalls the read lanes of every other server. With a pool the bodies of
+# a large array are split into chunks that worker processes decode in
+# parallel, while the decode thread only waits (without the GIL). Chunks come
+# back column-wise (field names once, then one list per field), which pickles
+# much smaller than a list of dicts. Arrays below min_bytes are decoded inline
+# because shipping them would cost more than decoding them.
+
+DEFAULT_DECODE_POOL_CONFIG = {
+    'workers': 0,          # 0 disables the pool
+    'min_bytes': 65536,    # Smaller arrays are decoded inline
+    'chunk_size': 256,     # Elements per task
+}
+
+_worker_codecs = {}  # version -> Codecs, compiled once per worker process
+
+def _worker_decoder(datatype_name, codecs_spec):
+    codecs = None
+    if codecs_spec is not None:
+        codecs = _worker_codecs.get(codecs_spec[0])
+        if codecs is None:
+            codecs = type_dictionary.compile_codecs(codecs_spec[1])
+            _worker_codecs[codecs_spec[0]] = codecs
+    return opcua_structures.get_decoder(datatype_name, codecs)
+
+def decode_chunk(datatype_name, codecs_spec, bodies):
+    '''
+    Runs in a worker process and decodes a chunk of element bodies.
+
+    Returns
+    -------
+    (fields, columns): The field names and one list of values per field, or
+        (None, rows) if the decoded elements do not all have the same fields.
+    '''
+    decoder = _worker_decoder(datatype_name, codecs_spec)
+    rows = [decoder(body) for body in bodies]
+    if not rows:
+        return [], []
+    fields = list(rows[0])
+    if any(len(row) != len(fields) or list(row) != fields for row in rows):
+        return None, rows
+    return fields, [[row[field] for row in rows] for field in fields]
+
+def rows_from_columns(fields, columns):
+    '''Reverses the column-wise result of decode_chunk into a list of dicts.'''
+    if fields is None:
+        return columns
+    return [dict(zip(fields, values)) for values in zip(*columns)]
+
+class DecodePool:
+    '''
+    Decodes arrays of ExtensionObject bodies in worker processes. The workers
+    are spawned (not forked, the collector is multi-threaded) on first use.
+    If the pool breaks, e.g. a worker was killed, arrays are decoded inline
+    and a new pool is started for the next one.
+    '''
+    def __init__(self, workers, min_bytes=DEFAULT_DECODE_POOL_CONFIG['min_bytes'],
+                 chunk_size=DEFAULT_DECODE_POOL_CONFIG['chunk_size']):
+        self.workers = workers
+        self.min_bytes = min_bytes
+        self.chunk_size = max(int(chunk_size), 1)
+        self.executor = None
+        self.specs = {}  # codecs version -> (version, type dictionaries) for type_dictionary.compile_codecs
+        self.lock = threading.Lock()
+        self.pooled = 0
+        self.chunks = 0
+        self.fallbacks = 0
+
+    def wants(self, bodies):
+        '''True if an array with these bodies is worth shipping to the pool.'''
+        return sum(len(body) for body in bodies) >= self.min_bytes
+
+    def _executor(self):
+        with self.lock:
+            if self.executor is None:
+                self.executor = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context('spawn'))
+            return self.executor
+
+    def _spec(self, codecs):
+        if codecs is None:
+            return None
+        spec = self.specs.get(codecs.version)
+        if spec is None:
+            spec = (codecs.version, codecs.dictionaries)
+            self.specs[codecs.version] = spec
+        return spec
+
+    def decode_array(self, datatype_name, codecs, bodies, inline_decoder):
+        '''
+        Decodes the bodies of an array with the pool and returns the list of dicts
+        in element order. inline_decoder is used if the pool is unavailable.
+        Decoder errors (ValueError, struct.error, ...) are raised like inline.
+        '''
+        spec = self._spec(codecs)
+        chunks = [bodies[i:i + self.chunk_size] for i in range(0, len(bodies), self.chunk_size)]
+        try:
+            executor = self._executor()
+            futures = [executor.submit(decode_chunk, datatype_name, spec, chunk) for chunk in chunks]
+            decoded = []
+            for future in futures:
+                decoded.extend(rows_from_columns(*future.result()))
+        except BrokenProcessPool as e:
+            print(f"Decode pool failed, decoding {datatype_name} inline: {e}")
+            with self.lock:
+                self.executor = None
+            self.fallbacks += 1
+            return [inline_decoder(body) for body in bodies]
+        self.pooled += 1
+        self.chunks += len(chunks)
+        return decoded
+
+    def shutdown(self):
+        with self.lock:
+            executor, self.executor = self.executor, None
+        if executor:
+            executor.shutdown(wait=True)
+
+    def stats(self):
+        return {'workers': self.workers, 'pooled': self.pooled, 'chunks': self.chunks, 'fallbacks': self.fallbacks}
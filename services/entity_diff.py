@@ -0,0 +1,113 @@
+import threading
+from services.memory_service import approx_size
+from services.opcua_structures import field_value
+
+# Element-level diffing of structure arrays such as Work.CurrentPlans
+# (PlanInfo[]) or Work.CurrentRunParts (RunPartInfo[]). Instead of storing
+# the whole array on every read, each element is identified by its natural
+# key and only elements that were added, changed or removed since the last
+# read are emitted, as 'entity' records that the Postgres sink upserts into
+# one table per structure type (see PostgresService.upsert_entities).
+
+# Structure name -> fields forming the natural key of an element, named as in the
+# hand-written decoders (see opcua_structures.field_value for generated ones)
+ENTITY_KEYS = {
+    'JobInfo': ('JobGuid',),
+    'PartInfo': ('JobGuid', 'PartID'),
+    'PlanInfo': ('PlanGuid',),
+    'RunInfo': ('RunGuid',),
+    'RunPartInfo': ('RunGuid', 'PartId'),
+    'PlateOperatingData': ('PlateGuid',),
+    'PartOperatingData': ('PlateGuid', 'PartID'),
+}
+
+UPSERT = 'upsert'
+REMOVE = 'remove'
+
+def entity_table_name(entity):
+    '''Returns the table an entity type is stored in, e.g. opcua_entity_planinfo for PlanInfo.'''
+    return f'opcua_entity_{entity.lower()}'
+
+def entity_key(entity, element):
+    '''Returns the key of an array element as text (parts joined by "/"), or None if a key field is missing.'''
+    parts = []
+    for field in ENTITY_KEYS[entity]:
+        value = field_value(element, field)
+        if value is None:
+            return None
+        parts.append(str(value))
+    return '/'.join(parts)
+
+class EntityDiffer:
+    '''
+    Remembers the last elements of every diffed node and turns a new array
+    into entity records for the elements that changed.
+    '''
+    def __init__(self):
+        self.state = {}  # (server_name, node_id) -> {entity_key: element}
+        self.lock = threading.Lock()
+
+    def handles(self, record):
+        '''True for decoded arrays of structures with a known key.'''
+        value = record['decoded']
+        return (record.get('raw') is None and record['datatype_name'] in ENTITY_KEYS
+                and isinstance(value, list) and all(isinstance(element, dict) for element in value))
+
+    def diff(self, record):
+        '''
+        Returns the entity records for a sample record of an array node, or None
+        if the array cannot be diffed (an element lacks its key fields or two
+        elements share a key), in which case the whole array should be stored.
+        '''
+        entity = record['datatype_name']
+        elements = {}
+        for element in record['decoded']:
+            key = entity_key(entity, element)
+            if key is None or key in elements:
+                return None
+            elements[key] = element
+        node = (record['server_name'], record['node_id'])
+        with self.lock:
+            previous = self.state.get(node, {})
+            self.state[node] = elements
+        changes = []
+        for key, element in elements.items():
+            if previous.get(key) != element:
+                changes.append(self._record(record, entity, key, UPSERT, element))
+        for key in previous:
+            if key not in elements:
+                changes.append(self._record(record, entity, key, REMOVE, None))
+        return changes
+
+    def _record(self, record, entity, key, op, element):
+        return {
+            'kind': 'entity',
+            'server_name': record['server_name'],
+            'node_id': record['node_id'],
+            'datatype_name': entity,
+            'timestamp': record['timestamp'],
+            'entity_key': key,
+            'op': op,
+            'value': element,
+            'decoded': element,
+            'raw': None,
+        }
+
+    def memory_bytes(self):
+        with self.lock:
+            return approx_size(self.state)
+
+    def shed(self, fraction):
+        '''
+        Forgets the remembered elements of every node (fraction is ignored, a
+        partial array state would emit removals). The next read of each node
+        upserts all of its elements again.
+        '''
+        with self.lock:
+            self.state = {}
+
+    def forget(self, server_name, node_id=None):
+        '''Drops the remembered elements of one node, or of every node of a server.'''
+        with self.lock:
+            for node in [n for n in self.state if n[0] == server_name and (node_id is None or n[1] == node_id)]:
+                del self.state[node]
@@ -0,0 +1,162 @@
+import argparse
+import csv
+import json
+from datetime import datetime
+
+# Streaming export of logged samples to Parquet or CSV. Rows are read from
+# Postgres with a server-side cursor and written chunk by chunk, so memory
+# use depends on the chunk size only and an export of months of data can run
+# on the Pi itself. Decoded structures are expanded into one typed column per
+# field; the columns are taken from the newest sample of every exported node
+# before streaming starts, since a Parquet schema cannot grow while writing.
+
+BASE_COLUMNS = ['timestamp', 'server_name', 'node_id', 'value_num', 'value_text']
+DEFAULT_CHUNK_SIZE = 10000
+
+def field_type(value):
+    '''Column type of a structure field: bool, int64, float64, string or json (nested values as JSON text).'''
+    if isinstance(value, bool):
+        return 'bool'
+    if isinstance(value, int):
+        return 'int64'
+    if isinstance(value, float):
+        return 'float64'
+    if isinstance(value, str):
+        return 'string'
+    return 'json'
+
+def coerce(value, column_type):
+    '''Converts a field value to its column type, or None if it does not fit.'''
+    if value is None:
+        return None
+    try:
+        if column_type == 'json':
+            return json.dumps(value)
+        if column_type == 'string':
+            return value if isinstance(value, str) else json.dumps(value)
+        if column_type == 'bool':
+            return bool(value) if isinstance(value, (bool, int)) else None
+        if column_type == 'int64':
+            return int(value) if isinstance(value, (bool, int)) or float(value).is_integer() else None
+        if column_type == 'float64':
+            return float(value)
+    except (TypeError, ValueError):
+        return None
+    return None
+
+def discover_fields(pg_service, start=None, end=None, servers=None, nodes=None):
+    '''
+    Returns an ordered dict of structure field name -> column type from the newest sample of
+    every node in the range. Field names that clash with the base columns get a field_ prefix.
+    '''
+    fields = {}
+    for _, _, _, value in pg_service.latest_samples(start, end, servers, nodes):
+        if isinstance(value, dict):
+            for name, item in value.items():
+                fields.setdefault(name, field_type(item))
+    return {(f'field_{name}' if name in BASE_COLUMNS else name): (name, column_type)
+            for name, column_type in fields.items()}
+
+def chunk_columns(chunk, fields):
+    '''Turns a chunk of (timestamp, server_name, node_id, value) samples into a dict of column lists.'''
+    columns = {name: [] for name in BASE_COLUMNS}
+    columns.update({name: [] for name in fields})
+    for timestamp, server_name, node_id, value in chunk:
+        columns['timestamp'].append(timestamp)
+        columns['server_name'].append(server_name)
+        columns['node_id'].append(node_id)
+        is_number = isinstance(value, (bool, int, float))
+        columns['value_num'].append(float(value) if is_number else None)
+        if isinstance(value, dict) or is_number or value is None:
+            columns['value_text'].append(None)
+        else:
+            columns['value_text'].append(str(value))
+        for column, (name, column_type) in fields.items():
+            columns[column].append(coerce(value.get(name), column_type) if isinstance(value, dict) else None)
+    return columns
+
+class CsvExportWriter:
+    def __init__(self, path, fields):
+        self.file = open(path, 'w', newline='', encoding='utf-8')
+        self.writer = csv.writer(self.file)
+        self.writer.writerow(BASE_COLUMNS + list(fields))
+
+    def write(self, columns):
+        self.writer.writerows(zip(*columns.values()))
+
+    def close(self):
+        self.file.close()
+
+class ParquetExportWriter:
+    '''Writes one Parquet row group per chunk. Needs pyarrow, which is not installed by default.'''
+    def __init__(self, path, fields):
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise Exception('Parquet export needs pyarrow (pip install pyarrow); use --format csv otherwise')
+        self.pa = pa
+        types = {'bool': pa.bool_(), 'int64': pa.int64(), 'float64': pa.float64(), 'string': pa.string(), 'json': pa.string()}
+        self.schema = pa.schema(
+            [('timestamp', pa.timestamp('ms')), ('server_name', pa.string()), ('node_id', pa.string()),
+             ('value_num', pa.float64()), ('value_text', pa.string())]
+            + [(column, types[column_type]) for column, (_, column_type) in fields.items()])
+        self.writer = pq.ParquetWriter(path, self.schema, compression='zstd')
+
+    def write(self, columns):
+        self.writer.write_table(self.pa.Table.from_pydict(columns, schema=self.schema))
+
+    def close(self):
+        self.writer.close()
+
+def export(pg_service, path, fmt='parquet', start=None, end=None, servers=None, nodes=None,
+           chunk_size=DEFAULT_CHUNK_SIZE):
+    '''
+    Exports samples to a Parquet or CSV file.
+
+    Parameters
+    ----------
+    pg_service: A connected PostgresService (either storage layout).
+    path: Output file.
+    fmt: 'parquet' or 'csv'.
+    start, end: Optional datetimes bounding the range (start inclusive, end exclusive).
+    servers, nodes: Optional lists of server names and node ids.
+    chunk_size: Rows fetched and written at a time; bounds memory use.
+
+    Returns
+    -------
+    count: Number of rows written.
+    '''
+    fields = discover_fields(pg_service, start, end, servers, nodes)
+    writer_class = ParquetExportWriter if fmt == 'parquet' else CsvExportWriter
+    writer = writer_class(path, fields)
+    count = 0
+    try:
+        for chunk in pg_service.iter_samples(start, end, servers, nodes, chunk_size):
+            writer.write(chunk_columns(chunk, fields))
+            count += len(chunk)
+    finally:
+        writer.close()
+    return count
+
+if __name__ == '__main__':
+    from services.postgres_service import PostgresService, DEFAULT_LAYOUT
+    parser = argparse.ArgumentParser(description='Export logged OPC UA samples to Parquet or CSV.')
+    parser.add_argument('conn_str', help='Postgres connection string, e.g. "dbname=... user=... password=... host=..."')
+    parser.add_argument('output', help='Output file')
+    parser.add_argument('--format', choices=['parquet', 'csv'], default=None, help='Defaults to the output file extension')
+    parser.add_argument('--start', type=datetime.fromisoformat, help='e.g. 2025-01-01 or 2025-01-01T06:00')
+    parser.add_argument('--end', type=datetime.fromisoformat)
+    parser.add_argument('--server', action='append', help='Server display name; can be repeated')
+    parser.add_argument('--node', action='append', help='Node id; can be repeated')
+    parser.add_argument('--layout', choices=['normalized', 'wide'], default=DEFAULT_LAYOUT)
+    parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE)
+    args = parser.parse_args()
+    fmt = args.format or ('csv' if args.output.lower().endswith('.csv') else 'parquet')
+    pg_service = PostgresService(args.conn_str, layout=args.layout)
+    pg_service.connect()
+    try:
+        count = export(pg_service, args.output, fmt, args.start, args.end, args.server, args.node, args.chunk_size)
+        print(f"Exported {count} rows to {args.output}.")
+    finally:
+        pg_service.disconnect()
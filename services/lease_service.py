@@ -0,0 +1,113 @@
+import hashlib
+import math
+import socket
+import time
+from services.postgres_service import PostgresService
+
+# Lease-based assignment of OPC UA servers to collector instances. Several
+# collectors (python -m services.collector) share one config.json and one
+# database; each server is collected by exactly the instance holding its lease
+# in opcua_server_leases. Every renew_interval seconds an instance heartbeats
+# into opcua_collectors, renews its leases, gives up leases above its fair
+# share (servers / live instances) and claims free or expired ones up to it.
+# An instance that stops renewing loses its servers when the leases expire,
+# and a joining instance gets its share as the others release theirs.
+#
+# Two instances never collect the same server at once: a lease is only
+# claimed once it has been released or has expired, a released server is
+# stopped before its lease is deleted, and an instance that cannot reach the
+# database stops collecting before its leases can expire. The lease connection
+# has connect and statement timeouts below renew_interval, and the collector's
+# read lanes check holds() before every read, so a hanging database cannot
+# keep an instance collecting past valid_until either.
+
+DEFAULT_LEASE_SECONDS = 30
+DEFAULT_RENEW_INTERVAL = 10
+
+def rendezvous_score(server_name, instance_id):
+    '''Stable preference of an instance for a server, so the same instances tend to keep the same servers.'''
+    return int(hashlib.sha1(f'{server_name}\0{instance_id}'.encode('utf-8')).hexdigest()[:16], 16)
+
+class LeaseManager:
+    def __init__(self, conn_str, instance_id=None, lease_seconds=DEFAULT_LEASE_SECONDS,
+                 renew_interval=DEFAULT_RENEW_INTERVAL):
+        self.statement_timeout = renew_interval / 2
+        if lease_seconds <= 2 * renew_interval + self.statement_timeout:
+            raise ValueError('lease_seconds must be more than 2.5 times renew_interval')
+        # libpq waits at least 2 s for a connection, whatever connect_timeout says
+        self.pg_service = PostgresService(conn_str, connect_options={
+            'connect_timeout': max(int(self.statement_timeout), 2),
+            'options': f'-c statement_timeout={int(self.statement_timeout * 1000)}',
+        })
+        self.instance_id = instance_id or f'{socket.gethostname()}-{int(time.time())}'
+        self.lease_seconds = lease_seconds
+        self.renew_interval = renew_interval
+        self.owned = set()
+        self.releasing = set()  # Given up during the last update; deleted on the next one, after collection stopped
+        self.instances = []
+        self.valid_until = 0.0  # time.monotonic() until which the owned leases are certainly still ours
+
+    def update(self, server_names):
+        '''
+        Renews, releases and claims leases for the configured server names and
+        returns the set of servers this instance should collect now. Servers
+        missing from the result must be stopped before the next update.
+        '''
+        started = time.monotonic()
+        server_names = sorted(set(server_names))
+        try:
+            if not self.pg_service.conn:
+                self.pg_service.connect()
+            if self.releasing:
+                self.pg_service.release_leases(self.instance_id, self.releasing)
+                self.releasing = set()
+            self.instances = self.pg_service.heartbeat_collector(self.instance_id, socket.gethostname(), self.lease_seconds)
+            share = math.ceil(len(server_names) / max(len(self.instances), 1))
+            owned = set(self.pg_service.renew_leases(self.instance_id, server_names, self.lease_seconds))
+            preference = sorted(server_names, key=lambda name: rendezvous_score(name, self.instance_id), reverse=True)
+            if len(owned) > share:
+                # Another instance joined: keep the preferred servers, stop the rest and release them next time
+                self.releasing = set([name for name in reversed(preference) if name in owned][:len(owned) - share])
+                owned -= self.releasing
+            elif len(owned) < share:
+                free = set(self.pg_service.free_leases(server_names))
+                wanted = [name for name in preference if name in free and name not in owned][:share - len(owned)]
+                if wanted:
+                    owned.update(self.pg_service.claim_leases(self.instance_id, wanted, self.lease_seconds))
+            self.owned = owned
+            # Leases now last until at least started + lease_seconds. The next update starts about
+            # renew_interval after this one and is done a statement_timeout later, so reads stay
+            # allowed until then but stop before the leases can expire
+            self.valid_until = started + self.lease_seconds - self.renew_interval - self.statement_timeout
+        except Exception as e:
+            print(f"Lease update for {self.instance_id} failed: {e}")
+            self.pg_service.disconnect()  # Reconnect on the next update
+            if self.owned and time.monotonic() >= self.valid_until:
+                print(f"Leases of {self.instance_id} may have expired, stopping {len(self.owned)} servers.")
+                self.owned = set()
+        return set(self.owned)
+
+    def holds(self, server_name):
+        '''True while server_name may be collected: its lease is owned and certainly not expired.'''
+        return server_name in self.owned and time.monotonic() < self.valid_until
+
+    def release_all(self):
+        '''Gives up every lease and unregisters the instance, e.g. on shutdown after collection stopped.'''
+        try:
+            if not self.pg_service.conn:
+                self.pg_service.connect()
+            self.pg_service.release_leases(self.instance_id, unregister=True)
+        except Exception as e:
+            print(f"Could not release the leases of {self.instance_id}, they expire in {self.lease_seconds} s: {e}")
+        finally:
+            self.owned = set()
+            self.releasing = set()
+            self.pg_service.disconnect()
+
+    def stats(self):
+        return {
+            'instance_id': self.instance_id,
+            'instances': list(self.instances),
+            'owned': sorted(self.owned),
+            'releasing': sorted(self.releasing),
+        }
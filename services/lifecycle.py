@@ -0,0 +1,262 @@
+import threading
+from collections import deque
+from services.memory_service import approx_size
+from services.opcua_structures import field_value, is_unset
+
+# Incremental run and plate lifecycle tracking. The tracker follows the
+# RunStates, RunInfo and PlateOperatingData values of every server as they
+# are decoded and emits one summary record per finished run or plate, so KPI
+# queries read opcua_run_summary / opcua_plate_summary instead of re-parsing
+# the raw history.
+#
+# A run ends when RunStates reports a different RunGuid or one of the
+# terminal states; its time in each CurrentState is accumulated from the
+# transitions. A plate ends when PlateOperatingData reports a different
+# PlateGuid or a final PlateStae (anything but "Undefined"). Fields are looked
+# up with opcua_structures.field_value, so the names of the hand-written and the
+# generated decoders both work.
+
+DEFAULT_TERMINAL_STATES = ('Completed', 'Finished', 'Aborted', 'Cancelled', 'Canceled', 'Failed')
+
+# OPC UA DateTime ticks (100 ns since 1601-01-01) at the Unix epoch
+EPOCH_TICKS = 116444736000000000
+
+# kind -> (table, [(column, SQL type)], key columns); values are epoch seconds for TIMESTAMP columns
+SUMMARY_TABLES = {
+    'run_summary': ('opcua_run_summary', [
+        ('server_name', 'TEXT NOT NULL'),
+        ('run_guid', 'TEXT NOT NULL'),
+        ('job_guid', 'TEXT'),
+        ('plan_guid', 'TEXT'),
+        ('run_name', 'TEXT'),
+        ('started_at', 'TIMESTAMP'),
+        ('ended_at', 'TIMESTAMP'),
+        ('duration', 'DOUBLE PRECISION'),
+        ('final_state', 'TEXT'),
+        ('transitions', 'INTEGER'),
+        ('state_durations', 'TEXT'),
+        ('cut_state', 'TEXT'),
+        ('cut_start', 'TIMESTAMP'),
+        ('cut_end', 'TIMESTAMP'),
+        ('sort_start', 'TIMESTAMP'),
+        ('sort_end', 'TIMESTAMP'),
+        ('cut_time', 'DOUBLE PRECISION'),
+        ('stop_time', 'DOUBLE PRECISION'),
+        ('wait_time', 'DOUBLE PRECISION'),
+        ('sort_time', 'DOUBLE PRECISION'),
+        ('partial', 'BOOLEAN'),
+    ], ('server_name', 'run_guid')),
+    'plate_summary': ('opcua_plate_summary', [
+        ('server_name', 'TEXT NOT NULL'),
+        ('plate_guid', 'TEXT NOT NULL'),
+        ('plate_state', 'TEXT'),
+        ('started_at', 'TIMESTAMP'),
+        ('ended_at', 'TIMESTAMP'),
+        ('cutting_time', 'DOUBLE PRECISION'),
+        ('system_wait_time', 'DOUBLE PRECISION'),
+        ('stop_time', 'DOUBLE PRECISION'),
+        ('operate_events', 'INTEGER'),
+        ('operate_stops', 'INTEGER'),
+        ('system_events', 'INTEGER'),
+        ('system_stops', 'INTEGER'),
+        ('breakoffs', 'INTEGER'),
+        ('partial', 'BOOLEAN'),
+    ], ('server_name', 'plate_guid')),
+}
+
+def ticks_to_epoch(ticks):
+    '''Converts an OPC UA DateTime tick count to epoch seconds, None for 0 (not set).'''
+    if not ticks:
+        return None
+    return (ticks - EPOCH_TICKS) / 1e7
+
+class LifecycleTracker:
+    '''
+    Pipeline listener (see IngestPipeline listeners) keeping one run and one
+    plate state machine per server. emit is called with each summary record;
+    it runs on the decode thread.
+    '''
+    def __init__(self, emit, terminal_states=DEFAULT_TERMINAL_STATES):
+        self.emit = emit
+        self.terminal_states = set(terminal_states)
+        self.runs = {}  # server_name -> current run state
+        self.plates = {}  # server_name -> current plate state
+        self.run_info = {}  # server_name -> {run_guid: latest RunInfo dict} for the last few runs
+        self.finished = deque(maxlen=1000)  # (kind, server_name, guid) already summarized
+        # Servers whose first RunStates/PlateOperatingData value has been seen; anything open at
+        # that point started before the collector did and is flagged partial
+        self.seen_runs = set()
+        self.seen_plates = set()
+        self.lock = threading.Lock()
+
+    def __call__(self, record):
+        if record.get('kind', 'sample') != 'sample' or record.get('raw'):
+            return
+        handler = {
+            'RunStates': self.on_run_state,
+            'RunInfo': self.on_run_info,
+            'PlateOperatingData': self.on_plate_data,
+        }.get(record['datatype_name'])
+        if handler is None:
+            return
+        values = record['decoded'] if isinstance(record['decoded'], list) else [record['decoded']]
+        with self.lock:
+            for value in values:
+                if isinstance(value, dict):
+                    handler(record, value)
+
+    def _summary(self, kind, record, guid, summary):
+        key = (kind, record['server_name'], guid)
+        if key in self.finished:
+            return
+        self.finished.append(key)
+        self.emit({
+            'kind': kind,
+            'server_name': record['server_name'],
+            'node_id': record['node_id'],
+            'datatype_name': kind,
+            'timestamp': record['timestamp'],
+            'entity_key': guid,
+            'value': summary,
+            'decoded': summary,
+            'raw': None,
+        })
+
+    def on_run_state(self, record, value):
+        server = record['server_name']
+        now = ticks_to_epoch(field_value(value, 'Timestamp')) or record['timestamp']
+        run_guid = field_value(value, 'RunGuid')
+        state = field_value(value, 'CurrentState')
+        run = self.runs.get(server)
+        if run is not None and run['run_guid'] != run_guid:
+            self._finish_run(record, run, now)
+            run = None
+        if run is None:
+            if not run_guid or ('run_summary', server, run_guid) in self.finished:
+                # No run, or the run that just ended is still reported until the next one starts
+                self.seen_runs.add(server)
+                return
+            run = {
+                'run_guid': run_guid,
+                'job_guid': field_value(value, 'JobGuid'),
+                'plan_guid': field_value(value, 'PlanGuid'),
+                'run_name': field_value(value, 'RunName'),
+                'started_at': now,
+                'state': state,
+                'state_since': now,
+                'state_durations': {},
+                'transitions': 0,
+                'partial': server not in self.seen_runs,
+            }
+            self.runs[server] = run
+        elif state != run['state']:
+            self._close_state(run, now)
+            run['state'] = state
+            run['transitions'] += 1
+        self.seen_runs.add(server)
+        if run['state'] in self.terminal_states:
+            self._finish_run(record, run, now)
+            del self.runs[server]
+
+    def _close_state(self, run, now):
+        if run['state'] is not None:
+            run['state_durations'][run['state']] = run['state_durations'].get(run['state'], 0.0) + max(now - run['state_since'], 0.0)
+        run['state_since'] = now
+
+    def _finish_run(self, record, run, now):
+        self._close_state(run, now)
+        info = self.run_info.get(record['server_name'], {}).pop(run['run_guid'], {})
+        cut_start = ticks_to_epoch(field_value(info, 'CutStartTime'))
+        cut_end = ticks_to_epoch(field_value(info, 'CutEndTime'))
+        sort_start = ticks_to_epoch(field_value(info, 'SortStartTime'))
+        sort_end = ticks_to_epoch(field_value(info, 'SortEndTime'))
+        cut_state = field_value(info, 'CutState')
+        summary = {
+            'server_name': record['server_name'],
+            'run_guid': run['run_guid'],
+            'job_guid': run['job_guid'],
+            'plan_guid': run['plan_guid'],
+            'run_name': run['run_name'],
+            'started_at': run['started_at'],
+            'ended_at': now,
+            'duration': max(now - run['started_at'], 0.0),
+            'final_state': run['state'],
+            'transitions': run['transitions'],
+            'state_durations': run['state_durations'],
+            'cut_state': str(cut_state) if cut_state is not None else None,
+            'cut_start': cut_start,
+            'cut_end': cut_end,
+            'sort_start': sort_start,
+            'sort_end': sort_end,
+            'cut_time': field_value(info, 'ActualCutTime'),
+            'stop_time': field_value(info, 'ActualStopTime'),
+            'wait_time': field_value(info, 'ActualWaitTime'),
+            'sort_time': sort_end - sort_start if sort_start and sort_end else None,
+            'partial': run['partial'],
+        }
+        self._summary('run_summary', record, run['run_guid'], summary)
+
+    def on_run_info(self, record, value):
+        run_guid = field_value(value, 'RunGuid')
+        if not run_guid:
+            return
+        infos = self.run_info.setdefault(record['server_name'], {})
+        infos.pop(run_guid, None)
+        infos[run_guid] = value
+        if len(infos) > 10:
+            del infos[next(iter(infos))]  # Runs that were never reported by RunStates
+
+    def on_plate_data(self, record, value):
+        server = record['server_name']
+        now = ticks_to_epoch(field_value(value, 'Timestamp')) or record['timestamp']
+        plate_guid = field_value(value, 'PlateGuid')
+        plate = self.plates.get(server)
+        if plate is not None and plate['plate_guid'] != plate_guid:
+            self._finish_plate(record, plate, now)
+            plate = None
+        if plate is None:
+            if not plate_guid:
+                self.seen_plates.add(server)
+                return
+            plate = {'plate_guid': plate_guid, 'started_at': now, 'partial': server not in self.seen_plates}
+            self.plates[server] = plate
+        self.seen_plates.add(server)
+        plate['data'] = value
+        plate['updated_at'] = now
+        if not is_unset(field_value(value, 'PlateStae')):
+            # Stays the current plate until the next one appears, but is only summarized once
+            self._finish_plate(record, plate, now)
+
+    def _finish_plate(self, record, plate, now):
+        data = plate['data']
+        plate_state = field_value(data, 'PlateStae')
+        summary = {
+            'server_name': record['server_name'],
+            'plate_guid': plate['plate_guid'],
+            'plate_state': str(plate_state) if plate_state is not None else None,
+            'started_at': plate['started_at'],
+            'ended_at': plate.get('updated_at', now),
+            'cutting_time': field_value(data, 'CuttingTime'),
+            'system_wait_time': field_value(data, 'SystemWaitTime'),
+            'stop_time': field_value(data, 'StopTime'),
+            'operate_events': field_value(data, 'OperateEvent'),
+            'operate_stops': field_value(data, 'OperateStops'),
+            'system_events': field_value(data, 'SystemEvents'),
+            'system_stops': field_value(data, 'SystemStops'),
+            'breakoffs': field_value(data, 'BreakOffs'),
+            'partial': plate['partial'],
+        }
+        self._summary('plate_summary', record, plate['plate_guid'], summary)
+
+    def memory_bytes(self):
+        with self.lock:
+            return approx_size([self.runs, self.plates, self.run_info, self.finished])
+
+    def forget(self, server_name):
+        '''Drops the open run and plate of a server, e.g. when it is removed from the config.'''
+        with self.lock:
+            self.runs.pop(server_name, None)
+            self.plates.pop(server_name, None)
+            self.run_info.pop(server_name, None)
+            self.seen_runs.discard(server_name)
+            self.seen_plates.discard(server_name)
@@ -0,0 +1,199 @@
+import itertools
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from collections import deque
+
+# Memory accounting for long-running collectors on small Pis. Every subsystem
+# that holds data (queues, caches, the live store, the GUI's node table, ...)
+# registers a function returning its approximate size in bytes and, if it can
+# give memory back, a shed function. The monitor checks the sizes every
+# interval seconds: a subsystem above its budget is asked to shed, and if the
+# process RSS is above rss_budget_mb every sheddable subsystem that is not
+# stateful is (shedding the state of e.g. the entity differ or the rollup
+# buckets loses data, so they only shed above their own budget). Sizes are
+# estimated from a sample of each container's items, so a check stays cheap
+# even with large queues. tracemalloc snapshots can be taken on demand (read
+# API /memory) to find what is growing.
+
+DEFAULT_MEMORY_CONFIG = {
+    'interval': 60,           # Seconds between checks
+    'budgets_mb': {},         # Subsystem name (or prefix before ':', e.g. "sink") -> MB
+    'rss_budget_mb': None,    # Process RSS above which everything sheddable and not stateful is shed
+    'shed_fraction': 0.5,     # Share of a subsystem's data dropped per shed
+    'tracemalloc': False,     # Trace allocations from the start (costs CPU and memory)
+}
+
+DEFAULT_SAMPLE = 32  # Items per container measured by approx_size
+MAX_DEPTH = 8
+MB = 1024 * 1024
+
+def approx_size(obj, sample=DEFAULT_SAMPLE, _depth=0):
+    '''
+    Estimates the deep size of obj in bytes. Containers with more than sample
+    items are extrapolated from their first items; objects shared between
+    containers are counted every time they are reached.
+    '''
+    size = sys.getsizeof(obj)
+    if _depth >= MAX_DEPTH or isinstance(obj, (str, bytes, bytearray, int, float, bool, type(None))):
+        return size
+    if isinstance(obj, dict):
+        if not obj:
+            return size
+        picked = list(itertools.islice(obj.items(), sample))
+        measured = sum(approx_size(k, sample, _depth + 1) + approx_size(v, sample, _depth + 1) for k, v in picked)
+        return size + measured * len(obj) // len(picked)
+    if isinstance(obj, (list, tuple, set, frozenset, deque)):
+        if not obj:
+            return size
+        picked = list(itertools.islice(obj, sample))
+        measured = sum(approx_size(item, sample, _depth + 1) for item in picked)
+        return size + measured * len(obj) // len(picked)
+    if hasattr(obj, '__dict__'):
+        return size + approx_size(vars(obj), sample, _depth + 1)
+    return size
+
+def rss_bytes():
+    '''Current resident set size of the process, or its peak where the current value is not available.'''
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == 'darwin' else peak * 1024
+
+class MemoryMonitor:
+    def __init__(self, config=None):
+        config = dict(DEFAULT_MEMORY_CONFIG, **(config or {}))
+        self.interval = config['interval']
+        self.budgets = {name: mb * MB for name, mb in config['budgets_mb'].items()}
+        self.rss_budget = config['rss_budget_mb'] * MB if config['rss_budget_mb'] else None
+        self.shed_fraction = config['shed_fraction']
+        self.subsystems = {}  # name -> (size_fn, shed_fn or None, stateful)
+        self.lock = threading.Lock()
+        self.last = {}
+        self.events = deque(maxlen=50)  # Recent sheds, newest last
+        self.previous_snapshot = None
+        self.stopped = threading.Event()
+        self.thread = None
+        if config['tracemalloc'] and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    def register(self, name, size_fn, shed_fn=None, stateful=False):
+        '''
+        Adds a subsystem. size_fn() returns its approximate size in bytes;
+        shed_fn(fraction), if given, drops about that share of its data. A
+        stateful subsystem is only shed above its own budget, not when the
+        RSS is over budget.
+        '''
+        with self.lock:
+            self.subsystems[name] = (size_fn, shed_fn, stateful)
+
+    def unregister(self, name):
+        with self.lock:
+            self.subsystems.pop(name, None)
+
+    def account(self):
+        '''Returns {subsystem: bytes}; None for a subsystem whose size could not be taken.'''
+        with self.lock:
+            subsystems = dict(self.subsystems)
+        sizes = {}
+        for name, (size_fn, _, _) in subsystems.items():
+            try:
+                sizes[name] = size_fn()
+            except Exception as e:
+                print(f"Memory accounting of {name} failed: {e}")
+                sizes[name] = None
+        return sizes
+
+    def _budget(self, name):
+        if name in self.budgets:
+            return self.budgets[name]
+        return self.budgets.get(name.split(':', 1)[0])
+
+    def _shed(self, name, reason):
+        with self.lock:
+            shed_fn = self.subsystems.get(name, (None, None, False))[1]
+        if shed_fn is None:
+            return
+        try:
+            shed_fn(self.shed_fraction)
+        except Exception as e:
+            print(f"Shedding {name} failed: {e}")
+            return
+        print(f"Memory: shed {self.shed_fraction:.0%} of {name} ({reason})")
+        self.events.append({'time': time.time(), 'subsystem': name, 'reason': reason})
+
+    def measure(self):
+        '''Returns {time, rss, subsystems} without shedding anything.'''
+        self.last = {'time': time.time(), 'rss': rss_bytes(), 'subsystems': self.account()}
+        return self.last
+
+    def check(self):
+        '''Measures every subsystem and sheds the ones over budget. Returns the measurement.'''
+        last = self.measure()
+        sizes, rss = last['subsystems'], last['rss']
+        for name, size in sizes.items():
+            budget = self._budget(name)
+            if budget is not None and size is not None and size > budget:
+                self._shed(name, f'{size / MB:.1f} MB over its budget of {budget / MB:.1f} MB')
+        if self.rss_budget is not None and rss > self.rss_budget:
+            with self.lock:
+                stateful = {name for name, (_, _, flag) in self.subsystems.items() if flag}
+            for name, _ in sorted(sizes.items(), key=lambda item: item[1] or 0, reverse=True):
+                if name not in stateful:
+                    self._shed(name, f'RSS {rss / MB:.0f} MB over the budget of {self.rss_budget / MB:.0f} MB')
+        return last
+
+    def start(self):
+        self.stopped.clear()
+        self.thread = threading.Thread(target=self._run, name='memory-monitor', daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        while not self.stopped.wait(self.interval):
+            self.check()
+
+    def stop(self):
+        self.stopped.set()
+
+    def snapshot(self, top=20):
+        '''
+        Takes a tracemalloc snapshot and returns the top allocation sites and
+        their growth since the previous snapshot. Tracing starts with the first
+        call if it is not already on, so the first result only covers what was
+        allocated from then on.
+        '''
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self.previous_snapshot = None
+            return {'tracing': True, 'started': True, 'top': []}
+        snapshot = tracemalloc.take_snapshot().filter_traces([
+            tracemalloc.Filter(False, tracemalloc.__file__),
+        ])
+        if self.previous_snapshot is not None:
+            stats = snapshot.compare_to(self.previous_snapshot, 'lineno')[:top]
+            entries = [{'where': str(stat.traceback), 'size': stat.size, 'size_diff': stat.size_diff,
+                        'count': stat.count, 'count_diff': stat.count_diff} for stat in stats]
+        else:
+            entries = [{'where': str(stat.traceback), 'size': stat.size, 'count': stat.count}
+                       for stat in snapshot.statistics('lineno')[:top]]
+        self.previous_snapshot = snapshot
+        traced, peak = tracemalloc.get_traced_memory()
+        return {'tracing': True, 'traced': traced, 'peak': peak, 'top': entries}
+
+    def stats(self, refresh=False):
+        '''Sizes from the last check, or measured now with refresh (or before the first check).'''
+        last = self.measure() if refresh or not self.last else self.last
+        return {
+            'rss_mb': round(last['rss'] / MB, 1),
+            'subsystems_mb': {name: round(size / MB, 2) if size is not None else None
+                              for name, size in last['subsystems'].items()},
+            'budgets_mb': {name: budget / MB for name, budget in self.budgets.items()},
+            'rss_budget_mb': self.rss_budget / MB if self.rss_budget else None,
+            'sheds': list(self.events),
+            'tracemalloc': tracemalloc.is_tracing(),
+        }
@@ -1,15 +1,39 @@
-from opcua import Client
+from opcua import Client, ua
 
 # This file was moved to services/opcua_service.py for better project structure.
 
+DEFAULT_TIMEOUT = 5  # seconds, bounds both the TCP connect and each request
+
+# Status codes that concern a single node (e.g. one removed by a firmware update), not the session
+NODE_STATUS_CODES = {
+    'BadNodeIdUnknown', 'BadNodeIdInvalid', 'BadAttributeIdInvalid', 'BadNotReadable', 'BadUserAccessDenied',
+    'BadIndexRangeInvalid', 'BadIndexRangeNoData', 'BadDataEncodingInvalid', 'BadDataEncodingUnsupported',
+    'BadDataTypeIdUnknown', 'BadNotSupported', 'BadNoCommunication', 'BadWaitingForInitialData', 'BadOutOfService',
+}
+
+def is_node_error(error):
+    '''
+    Returns True if an exception raised by a request for one node is about that
+    node only, so the session is still good and the other nodes can be read.
+    '''
+    if not isinstance(error, ua.UaStatusCodeError):
+        return False
+    return ua.StatusCode(error.code).name in NODE_STATUS_CODES
+
 class OPCUAService:
-    def __init__(self, url):
+    def __init__(self, url, timeout=DEFAULT_TIMEOUT, security=None):
         self.url = url
+        self.timeout = timeout
+        # python-opcua security string, e.g. "Basic256Sha256,SignAndEncrypt,cert.pem,key.pem"
+        self.security = security
         self.client = None
 
     def connect(self):
-        self.client = Client(self.url)
-        self.client.connect()
+        client = Client(self.url, timeout=self.timeout)
+        if self.security:
+            client.set_security_string(self.security)
+        client.connect()
+        self.client = client
         return self.client
 
     def disconnect(self):
@@ -67,6 +91,21 @@ class OPCUAService:
         node = self.client.get_node(node_id)
         return node.get_value()
     
+    def get_values(self, node_ids):
+        '''
+        This function reads the values of several nodes in a single request.
+        Parameters
+        ----------
+        node_ids: A list of NodeIds.
+
+        Returns
+        -------
+        values: The node values, in the same order as node_ids.'''
+        if not self.client:
+            raise Exception('Not connected')
+        nodes = [self.client.get_node(node_id) for node_id in node_ids]
+        return self.client.get_values(nodes)
+
     def get_datatype(self, node_id):
         '''
         This function retrieves the data type of a node from the OPCUA server.
@@ -84,3 +123,35 @@ class OPCUAService:
         node = self.client.get_node(node_id)
         dtype = node.get_data_type()
         return self.client.get_node(dtype).get_browse_name()
+
+    def get_server_state(self):
+        '''
+        This function reads the server's state (ServerStatus.State), a cheap request that
+        is used as a keepalive.
+
+        Returns
+        -------
+        state: The ServerState value, 0 meaning running.'''
+        if not self.client:
+            raise Exception('Not connected')
+        return self.client.get_node(ua.ObjectIds.Server_ServerStatus_State).get_value()
+
+    def get_type_dictionaries(self):
+        '''
+        This function reads the server's OPC Binary type dictionaries, which describe
+        the layout of every custom structure and enum.
+
+        Returns
+        -------
+        dictionaries: A list of XML documents (bytes), one per non-standard namespace.'''
+        if not self.client:
+            raise Exception('Not connected')
+        type_system = self.client.get_node(ua.ObjectIds.OPCBinarySchema_TypeSystem)
+        dictionaries = []
+        for child in type_system.get_children():
+            if child.nodeid.NamespaceIndex == 0:
+                continue  # The standard Opc.Ua dictionary is large and not needed
+            value = child.get_value()
+            if value:
+                dictionaries.append(value)
+        return dictionaries
@@ -1,5 +1,32 @@
 import struct
 
+def pack_bodies(bodies):
+    """
+    Packs a list of ExtensionObject bodies into one byte string using the OPC UA
+    ByteString array layout (Int32 count, then Int32 length + bytes per element).
+    Used to store structure arrays in a single bytea column.
+    """
+    parts = [struct.pack('<i', len(bodies))]
+    for body in bodies:
+        parts.append(struct.pack('<i', len(body)))
+        parts.append(body)
+    return b''.join(parts)
+
+def unpack_bodies(data):
+    """
+    Reverses pack_bodies and returns the list of element bodies.
+    """
+    data = bytes(data)
+    count = struct.unpack_from('<i', data, 0)[0]
+    offset = 4
+    bodies = []
+    for _ in range(count):
+        length = struct.unpack_from('<i', data, offset)[0]
+        offset += 4
+        bodies.append(data[offset:offset+length])
+        offset += length
+    return bodies
+
 def map_structures(datatype_name):
     """
     Maps OPC UA data types to Python classes.
@@ -27,7 +54,88 @@ def map_structures(datatype_name):
     
     return mapping.get(datatype_name, None)
 
+def get_decoder(datatype_name, codecs=None):
+    """
+    Returns a function that decodes an ExtensionObject body into a dict.
+
+    Parameters
+    ----------
+    datatype_name : str
+        The name of the OPC UA data type.
+    codecs : type_dictionary.Codecs, optional
+        Decoders generated from the server's type dictionary. They are preferred
+        because they follow the server's actual layout; the hand-written classes
+        are the fallback when no dictionary could be read.
+
+    Returns
+    -------
+    function or None
+    """
+    if codecs is not None:
+        decoder = codecs.decoders.get(datatype_name)
+        if decoder:
+            return decoder
+    StructClass = map_structures(datatype_name)
+    if StructClass:
+        return lambda body: StructClass(body).as_dict()
+    return None
+
+# Field names of the hand-written classes -> the spelling in type dictionaries, whose
+# names the generated decoders use. Case differences (PartId/PartID) need no entry.
+FIELD_ALIASES = {
+    "PlateStae": ("PlateState",),
+    "OperateEvent": ("OperateEvents",),
+}
+
+# Enum value names meaning "not set", compared case-insensitively and without a "_0" suffix
+UNSET_NAMES = {"", "undefined", "none", "unknown", "notset"}
+
+def field_value(element, name):
+    """
+    Returns a field of a decoded structure whichever decoders produced it.
+
+    Parameters
+    ----------
+    element : dict
+        A structure decoded by a hand-written class or a generated decoder.
+    name : str
+        The field name used by the hand-written class, e.g. "PlateStae".
+
+    Returns
+    -------
+    The value of name, of one of its FIELD_ALIASES or of a field differing only in
+    case, or None if the structure has no such field.
+    """
+    if name in element:
+        return element[name]
+    for alias in FIELD_ALIASES.get(name, ()):
+        if alias in element:
+            return element[alias]
+    lowered = name.lower()
+    for field, value in element.items():
+        if field.lower() == lowered:
+            return value
+    return None
+
+def is_unset(value):
+    """
+    True for an enum field that is not set: None, 0, or a name such as "Undefined"
+    (hand-written classes) or "Undefined_0" (some type dictionaries).
+    """
+    if value is None or value == 0:
+        return True
+    if isinstance(value, str):
+        name = value.lower().replace(" ", "")
+        if name.endswith("_0"):
+            name = name[:-2]
+        return name in UNSET_NAMES
+    return False
+
 class OpcuaStructBase:
+    # Bump in a subclass whenever its field layout or decoding changes, so rows
+    # stored in raw mode can be re-decoded with the fixed decoder
+    SCHEMA_VERSION = 1
+
     def read_guid(self, data, offset):
         guid_bytes = data[offset:offset+16]
         guid = (
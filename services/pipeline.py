@@ -0,0 +1,365 @@
+import threading
+import time
+from collections import deque
+from opcua.ua import ExtensionObject
+import services.opcua_structures as opcua_structures
+from services.decode_pool import DecodePool, DEFAULT_DECODE_POOL_CONFIG
+from services.memory_service import approx_size
+from services.rollup_service import rollup_record
+
+# Read -> decode -> write pipeline. The poll loop only reads values and puts
+# them on the decode queue; a decode thread turns them into records and puts
+# those on the queue of every sink (services/sinks.py), whose own threads
+# write them in batches. All queues are bounded and apply an overload policy
+# when full, so memory and latency stay bounded while a destination is slow or
+# down.
+
+BLOCK = 'block'                        # Wait for space (up to block_timeout, None: as long as it takes), then drop the new item
+DROP_OLDEST = 'drop_oldest'            # Discard the oldest queued item
+LATEST_PER_NODE = 'latest_per_node'    # Replace the queued item of the same node, else drop the oldest
+POLICIES = (BLOCK, DROP_OLDEST, LATEST_PER_NODE)
+
+DEFAULT_PIPELINE_CONFIG = {
+    'decode_queue': {'size': 1000, 'policy': LATEST_PER_NODE},
+    'decode_batch': 200,
+    'block_timeout': 1.0,
+    'decode_pool': DEFAULT_DECODE_POOL_CONFIG,
+}
+
+class BoundedQueue:
+    '''
+    Thread-safe FIFO with a fixed capacity and an overload policy.
+
+    Items are put with a key (server_name, node_id) so the latest_per_node
+    policy can coalesce samples of the same node instead of dropping other
+    nodes' data. on_drop, if set, is called with every item that is dropped
+    (not with one replaced by a newer value of the same key).
+    '''
+    def __init__(self, name, maxsize, policy=DROP_OLDEST, block_timeout=1.0):
+        if policy not in POLICIES:
+            raise ValueError(f'Unknown overload policy {policy!r}, expected one of {POLICIES}')
+        self.name = name
+        self.maxsize = maxsize
+        self.policy = policy
+        self.block_timeout = block_timeout
+        self.items = deque()  # [key, item] entries
+        self.latest = {}  # key -> newest queued entry, for latest_per_node
+        self.cond = threading.Condition()
+        self.enqueued = 0
+        self.dropped = 0
+        self.high_water = 0
+        self.on_drop = None
+
+    def __len__(self):
+        with self.cond:
+            return len(self.items)
+
+    def _pop_oldest(self):
+        entry = self.items.popleft()
+        if self.latest.get(entry[0]) is entry:
+            del self.latest[entry[0]]
+        return entry
+
+    def _drop(self, item):
+        self.dropped += 1
+        if self.on_drop:
+            try:
+                self.on_drop(item)
+            except Exception as e:
+                print(f"Queue {self.name} on_drop failed: {e}")
+
+    def put(self, item, key=None):
+        '''Adds an item, applying the overload policy. Returns False if an item was dropped.'''
+        with self.cond:
+            self.enqueued += 1
+            accepted = True
+            if len(self.items) >= self.maxsize:
+                if self.policy == BLOCK:
+                    if not self.cond.wait_for(lambda: len(self.items) < self.maxsize, timeout=self.block_timeout):
+                        self._drop(item)
+                        return False
+                elif self.policy == LATEST_PER_NODE and key is not None and key in self.latest:
+                    # Keep the queue position but replace the stale value
+                    self.latest[key][1] = item
+                    self.dropped += 1
+                    self.cond.notify_all()
+                    return False
+                else:
+                    self._drop(self._pop_oldest()[1])
+                    accepted = False
+            entry = [key, item]
+            self.items.append(entry)
+            if key is not None:
+                self.latest[key] = entry
+            self.high_water = max(self.high_water, len(self.items))
+            self.cond.notify_all()
+            return accepted
+
+    def get_batch(self, max_items, timeout=None):
+        '''Waits up to timeout for at least one item and returns up to max_items of them.'''
+        with self.cond:
+            if not self.cond.wait_for(lambda: self.items, timeout=timeout):
+                return []
+            batch = []
+            while self.items and len(batch) < max_items:
+                batch.append(self._pop_oldest()[1])
+            self.cond.notify_all()
+            return batch
+
+    def memory_bytes(self):
+        '''Approximate size of the queued items (see memory_service.approx_size).'''
+        with self.cond:
+            return approx_size(self.items)
+
+    def shed(self, fraction):
+        '''Drops the oldest fraction of the queued items, counting them as dropped.'''
+        with self.cond:
+            for _ in range(int(len(self.items) * fraction)):
+                self._drop(self._pop_oldest()[1])
+            self.cond.notify_all()
+
+    def stats(self):
+        with self.cond:
+            return {
+                'depth': len(self.items),
+                'maxsize': self.maxsize,
+                'policy': self.policy,
+                'enqueued': self.enqueued,
+                'dropped': self.dropped,
+                'high_water': self.high_water,
+            }
+
+def is_extension_object_value(value):
+    if isinstance(value, ExtensionObject):
+        return True
+    return isinstance(value, list) and all(isinstance(item, ExtensionObject) for item in value)
+
+def decode_sample(sample, pool=None):
+    '''
+    Turns a read sample into a record for the write stage.
+
+    Parameters
+    ----------
+    sample: dict with server_name, node_id, datatype_name, datatype_ns, value, timestamp,
+        ingest_mode and codecs (generated decoders of the server, or None).
+    pool: Optional decode_pool.DecodePool for large structure arrays.
+
+    Returns
+    -------
+    record: dict with kind ('sample'), server_name, node_id, datatype_name, timestamp, value (what is stored in
+        opcua_data), decoded (decoded value before arrays are flattened to text), raw
+        (insert_raw arguments when the body is stored undecoded, else None) and codecs (the codecs a raw
+        body is to be decoded with, else None).
+    '''
+    value = sample['value']
+    datatype_name = sample['datatype_name']
+    decoded = value
+    raw = None
+    if sample['datatype_ns'] != 0:  # Custom structures and enums live in the server's own namespaces
+        codecs = sample['codecs']
+        if sample['ingest_mode'] == 'raw' and is_extension_object_value(value):
+            # Store the body undecoded; services/raw_decoder.py decodes it later
+            StructClass = opcua_structures.map_structures(datatype_name)
+            if isinstance(value, ExtensionObject):
+                body, is_array, type_id = value.Body, False, value.TypeId
+            else:
+                body = opcua_structures.pack_bodies([item.Body for item in value])
+                is_array = True
+                type_id = value[0].TypeId if value else None
+            raw = (datatype_name, str(type_id) if type_id else None,
+                   StructClass.SCHEMA_VERSION if StructClass else 0, body, is_array,
+                   codecs.version if codecs else None)
+            value = f'<raw {datatype_name}, {len(body)} bytes>'
+            decoded = value
+        elif is_extension_object_value(value):
+            decoder = opcua_structures.get_decoder(datatype_name, codecs)
+            if decoder:
+                if isinstance(value, ExtensionObject):
+                    value = decoder(value.Body)
+                    decoded = value
+                else:
+                    # It is an array of ExtensionObjects
+                    bodies = [item.Body for item in value]
+                    if pool is not None and pool.wants(bodies):
+                        decoded = pool.decode_array(datatype_name, codecs, bodies, decoder)
+                    else:
+                        decoded = [decoder(body) for body in bodies]
+                    value = str(decoded)
+        elif codecs is not None and datatype_name in codecs.enums:
+            value = codecs.decode_enum(datatype_name, value)
+            decoded = value
+    return {
+        'kind': 'sample',
+        'server_name': sample['server_name'],
+        'node_id': sample['node_id'],
+        'datatype_name': datatype_name,
+        'timestamp': sample['timestamp'],
+        'value': value,
+        'decoded': decoded,
+        'raw': raw,
+        'codecs': sample['codecs'] if raw else None,
+    }
+
+class IngestPipeline:
+    '''
+    Owns the decode stage and fans decoded records out to the sinks.
+
+    listeners are called from the decode thread with each record (rollups,
+    live store, scheduler feedback, ...) and must be thread-safe; on_decoded
+    is called once per decoded batch with the list of records, e.g. to hand
+    them to the UI through a queued signal. With a differ (an
+    entity_diff.EntityDiffer), arrays of keyed structures reach the sinks as
+    entity records for their changed elements instead of as whole samples.
+    With decode_pool workers configured, large structure arrays are decoded
+    in worker processes (see decode_pool). With a capture (a capture.CaptureWriter), every submitted sample is also
+    recorded undecoded so it can be replayed later; the pipeline closes it
+    when stopped. With rollups (a rollup_service.RollupAggregator), every
+    record is aggregated and closed buckets reach the sinks as rollup records
+    every rollup_flush_interval seconds, whichever sinks are configured; the
+    still open buckets follow when the pipeline stops.
+    '''
+    def __init__(self, config=None, sinks=(), listeners=(), on_decoded=None, differ=None, capture=None, rollups=None,
+                 rollup_flush_interval=30):
+        config = dict(DEFAULT_PIPELINE_CONFIG, **(config or {}))
+        decode_config = dict(DEFAULT_PIPELINE_CONFIG['decode_queue'], **config['decode_queue'])
+        self.decode_queue = BoundedQueue('decode', decode_config['size'], decode_config['policy'], config['block_timeout'])
+        self.decode_batch = config.get('decode_batch', config.get('write_batch', 200))
+        pool_config = dict(DEFAULT_DECODE_POOL_CONFIG, **config['decode_pool'])
+        self.decode_pool = DecodePool(pool_config['workers'], pool_config['min_bytes'],
+                                      pool_config['chunk_size']) if pool_config['workers'] > 0 else None
+        self.sinks = list(sinks)
+        self.listeners = list(listeners)
+        self.on_decoded = on_decoded
+        self.differ = differ
+        for sink in self.sinks:
+            sink.on_drop = self._on_sink_drop
+        self.capture = capture
+        self.rollups = rollups
+        self.rollup_flush_interval = rollup_flush_interval
+        self.next_rollup_flush = time.monotonic() + rollup_flush_interval
+        self.decode_errors = 0
+        self.running = False
+        self.thread = None
+
+    def set_conn_str(self, conn_str):
+        for sink in self.sinks:
+            if hasattr(sink, 'set_conn_str'):
+                sink.set_conn_str(conn_str)
+
+    def start(self):
+        for sink in self.sinks:
+            sink.start()
+        self.running = True
+        self.thread = threading.Thread(target=self._decode_loop, name='pipeline-decode', daemon=True)
+        self.thread.start()
+
+    def stop(self, timeout=5.0):
+        '''Stops decoding after draining the decode queue (within timeout), then stops every sink.'''
+        deadline = time.monotonic() + timeout
+        while len(self.decode_queue) and time.monotonic() < deadline:
+            time.sleep(0.05)
+        self.running = False
+        if self.thread:
+            self.thread.join(max(deadline - time.monotonic(), 0.1))
+        if self.decode_pool:
+            self.decode_pool.shutdown()
+        # The upsert merges a bucket written early with the rest of it if logging continues
+        self.flush_rollups(force=True)
+        # Sinks drain in parallel so one stuck destination does not use up the others' time
+        stoppers = [threading.Thread(target=sink.stop, args=(max(deadline - time.monotonic(), 1.0),)) for sink in self.sinks]
+        for stopper in stoppers:
+            stopper.start()
+        for stopper in stoppers:
+            stopper.join()
+        if self.capture:
+            self.capture.close()
+
+    def submit(self, sample):
+        '''Called by the read stage with one sample (see decode_sample).'''
+        if self.capture:
+            self.capture.write(sample)
+        self.decode_queue.put(sample, key=(sample['server_name'], sample['node_id']))
+
+    def emit(self, record):
+        '''Hands a record that did not come from the decode stage (e.g. a summary row) to the sinks.'''
+        for sink in self.sinks:
+            try:
+                sink.submit(record)
+            except Exception as e:
+                print(f"Sink {sink.name} rejected a record of {record['node_id']} on {record['server_name']}: {e}")
+
+    def _on_sink_drop(self, record):
+        # The differ already counts a dropped change as written; forgetting the node makes its
+        # next read upsert every element again instead of losing the change for good
+        if record.get('kind') == 'entity' and self.differ:
+            self.differ.forget(record['server_name'], record['node_id'])
+
+    def flush_rollups(self, force=False):
+        '''Emits the closed rollup buckets (all of them with force), so none are kept once written.'''
+        if not self.rollups:
+            return
+        for row in self.rollups.flush(force=force):
+            self.emit(rollup_record(row))
+
+    def _decode_loop(self):
+        while self.running:
+            batch = self.decode_queue.get_batch(self.decode_batch, timeout=0.5)
+            records = []
+            for sample in batch:
+                try:
+                    record = decode_sample(sample, self.decode_pool)
+                except Exception as e:
+                    # A layout mismatch or a value the decoder does not know (e.g. a new enum value) affects
+                    # this sample only; the decode thread must keep running for every other node
+                    self.decode_errors += 1
+                    print(f"Failed to decode {sample['datatype_name']} from {sample['node_id']} on {sample['server_name']}: {e}")
+                    continue
+                if self.rollups:
+                    try:
+                        self.rollups.add(record['server_name'], record['node_id'], record['decoded'], record['timestamp'],
+                                         record['datatype_name'])
+                    except Exception as e:
+                        print(f"Rollup of {record['node_id']} on {record['server_name']} failed: {e}")
+                for listener in self.listeners:
+                    try:
+                        listener(record)
+                    except Exception as e:
+                        print(f"Pipeline listener {listener} failed: {e}")
+                try:
+                    changes = self.differ.diff(record) if self.differ and self.differ.handles(record) else None
+                except Exception as e:
+                    print(f"Entity diff of {record['node_id']} on {record['server_name']} failed, storing the whole array: {e}")
+                    changes = None
+                if changes is None:
+                    self.emit(record)
+                else:
+                    for change in changes:
+                        self.emit(change)
+                records.append(record)
+            if records and self.on_decoded:
+                try:
+                    self.on_decoded(records)
+                except Exception as e:
+                    print(f"Pipeline on_decoded {self.on_decoded} failed: {e}")
+            if batch and self.capture:
+                try:
+                    self.capture.flush()
+                except Exception as e:
+                    print(f"Capture flush failed: {e}")
+            if time.monotonic() >= self.next_rollup_flush:
+                self.flush_rollups()
+                self.next_rollup_flush = time.monotonic() + self.rollup_flush_interval
+
+    def stats(self):
+        stats = {
+            'queues': {'decode': self.decode_queue.stats()},
+            'decode_errors': self.decode_errors,
+            'sinks': {sink.name: sink.stats() for sink in self.sinks},
+        }
+        if self.decode_pool:
+            stats['decode_pool'] = self.decode_pool.stats()
+        if self.capture:
+            stats['capture'] = self.capture.stats()
+        if self.rollups:
+            stats['rollups'] = self.rollups.stats()
+        return stats
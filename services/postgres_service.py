@@ -1,61 +1,971 @@
+import json
+import math
+import time
+from contextlib import contextmanager
 import psycopg2
+from psycopg2.extras import execute_values
+from services.rollup_service import rollup_table_name
+from services.entity_diff import entity_table_name
+from services.lifecycle import SUMMARY_TABLES
 
 # This file was moved to services/postgres_service.py for better project structure.
 
+# Storage layouts for logged samples:
+#   'wide':       the original opcua_data table repeating node_id/server_name in every row.
+#   'normalized': opcua_servers and opcua_nodes dimension tables with integer keys and a
+#                 narrow opcua_samples fact table (node_key, timestamp, value_kind, num_value,
+#                 text_value). The opcua_data_view view presents it with the columns of
+#                 opcua_data. Opt-in: existing opcua_data rows are not migrated.
+NORMALIZED = 'normalized'
+WIDE = 'wide'
+DEFAULT_LAYOUT = WIDE
+
+# How batches of samples, raw bodies and entity changes are sent:
+#   'values': execute_values, one multi-row INSERT ... VALUES statement per batch. Its text
+#             changes with every batch, so the server parses and plans each one.
+#   'unnest': INSERT ... SELECT FROM unnest($1, $2, ...) prepared once per connection; each
+#             column of a batch is sent as one typed array literal. For databases behind
+#             proxies that do not allow COPY (see services/write_benchmark.py).
+VALUES = 'values'
+UNNEST = 'unnest'
+WRITE_METHODS = (VALUES, UNNEST)
+DEFAULT_WRITE_METHOD = VALUES
+
+def value_kind(value):
+    '''Kind of a sample value: 'bool', 'int', 'float', 'dict' or 'str'.'''
+    if isinstance(value, bool):
+        return 'bool'
+    if isinstance(value, int):
+        return 'int'
+    if isinstance(value, float):
+        return 'float'
+    if isinstance(value, dict):
+        return 'dict'
+    return 'str'
+
+def kind_code(value):
+    '''Kind of a sample value as stored in opcua_samples.value_kind, its first letter (b, i, f, d, s).'''
+    return value_kind(value)[0]
+
+def narrow_value(value):
+    '''Splits a value into the (num_value, text_value) columns of opcua_samples.'''
+    if isinstance(value, (bool, int, float)):
+        return float(value), None
+    if isinstance(value, dict):
+        return None, json.dumps(value)
+    return None, str(value) if value is not None else None
+
+def _array_element(value):
+    if value is None:
+        return 'NULL'
+    if isinstance(value, bool):
+        return 't' if value else 'f'
+    if isinstance(value, int):
+        return str(value)
+    if isinstance(value, float):
+        if math.isnan(value):
+            return 'NaN'
+        if math.isinf(value):
+            return 'Infinity' if value > 0 else '-Infinity'
+        return repr(value)
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        text = '\\x' + bytes(value).hex()
+    else:
+        text = str(value)
+    return '"' + text.replace('\\', '\\\\').replace('"', '\\"') + '"'
+
+def array_literal(values):
+    '''
+    Formats a list as a Postgres array literal, e.g. [1.5, None] -> '{1.5,NULL}' and
+    ['a"b'] -> '{"a\\"b"}'. The element type comes from the parameter it is passed to.
+    '''
+    return '{' + ','.join(_array_element(value) for value in values) + '}'
+
 class PostgresService:
-    def __init__(self, conn_str):
+    def __init__(self, conn_str, layout=DEFAULT_LAYOUT, write_method=DEFAULT_WRITE_METHOD, connect_options=None):
+        if layout not in (NORMALIZED, WIDE):
+            raise ValueError(f'Unknown storage layout {layout!r}')
+        if write_method not in WRITE_METHODS:
+            raise ValueError(f'Unknown write method {write_method!r}, expected one of {WRITE_METHODS}')
         self.conn_str = conn_str
+        self.connect_options = connect_options or {}  # Extra psycopg2.connect keywords, e.g. connect_timeout
+        self.layout = layout
+        self.write_method = write_method
         self.conn = None
+        self.created_tables = set()
+        self.prepared = set()  # Statements prepared on the current connection
+        self.server_keys = {}  # server_name -> server_key
+        self.node_keys = {}  # (server_key, node_id) -> node_key
+        self.in_transaction = False
 
     def connect(self):
-        self.conn = psycopg2.connect(self.conn_str)
+        self.conn = psycopg2.connect(self.conn_str, **self.connect_options)
         return self.conn
 
     def disconnect(self):
         if self.conn:
             self.conn.close()
             self.conn = None
+        self.created_tables = set()
+        self.prepared = set()
+        self.server_keys = {}
+        self.node_keys = {}
+
+    def _execute_unnest(self, cur, name, types, statement, rows):
+        '''
+        Runs statement, prepared as name on first use, with one array parameter
+        per column of rows. statement refers to the columns as $1..$n, e.g.
+        INSERT INTO t (a, b) SELECT * FROM unnest($1, $2); types are the SQL
+        array types of the parameters.
+        '''
+        if name not in self.prepared:
+            cur.execute(f'PREPARE {name} ({", ".join(types)}) AS {statement}')
+            self.prepared.add(name)
+        columns = list(zip(*rows)) if rows else [()] * len(types)
+        cur.execute(f'EXECUTE {name} ({", ".join(["%s"] * len(types))})', [array_literal(c) for c in columns])
+
+    def _rollback(self):
+        self.conn.rollback()
+        if self.prepared:
+            # Whether a statement prepared in the failed transaction survived is not worth guessing
+            try:
+                with self.conn.cursor() as cur:
+                    cur.execute('DEALLOCATE ALL')
+                self.conn.commit()
+            except Exception:
+                self.conn.rollback()
+            self.prepared = set()
+
+    def _commit(self):
+        if not self.in_transaction:
+            self.conn.commit()
+
+    @contextmanager
+    def transaction(self):
+        '''
+        Commits the bulk writes made inside the block together, or none of them: a
+        batch retried after a failure must not write its first parts twice.
+        '''
+        if not self.conn:
+            raise Exception('Not connected')
+        self.in_transaction = True
+        try:
+            yield self
+            self.conn.commit()
+        except Exception:
+            self._rollback()
+            # Tables and keys created in the rolled back transaction may not exist
+            self.created_tables = set()
+            self.server_keys = {}
+            self.node_keys = {}
+            raise
+        finally:
+            self.in_transaction = False
 
     def test_connection(self):
         conn = psycopg2.connect(self.conn_str)
         conn.close()
         return True
 
+    def _ensure_data_table(self, cur):
+        if 'opcua_data' in self.created_tables:
+            return
+        cur.execute('''
+            CREATE TABLE IF NOT EXISTS opcua_data (
+                node_id TEXT,
+                double_value DOUBLE PRECISION,
+                float_value REAL,
+                int_value INTEGER,
+                bool_value BOOLEAN,
+                timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                string_val TEXT,
+                dictionary_val TEXT,
+                server_name TEXT
+            )
+        ''')
+
+    @staticmethod
+    def _typed_values(value):
+        '''Splits a value into the (double, float, int, bool, string, dictionary) columns of opcua_data.'''
+        double_value = float(value) if isinstance(value, float) else None
+        float_value = float(value) if isinstance(value, float) else None
+        int_value = int(value) if isinstance(value, int) else None
+        bool_value = bool(value) if isinstance(value, bool) else None
+        string_val = str(value) if isinstance(value, str) else None
+        dictionary_val = None
+
+        # If value is a dict, store as JSON string
+        if isinstance(value, dict):
+            dictionary_val = json.dumps(value)
+            string_val = None  # Don't store dict as string
+        return double_value, float_value, int_value, bool_value, string_val, dictionary_val
+
     def insert_data(self, node_id, value, server_name=None):
         if not self.conn:
             raise Exception('Not connected')
+        if self.layout == NORMALIZED:
+            return self.insert_many([(node_id, value, server_name, time.time())])
         with self.conn.cursor() as cur:
-            cur.execute('''
-                CREATE TABLE IF NOT EXISTS opcua_data (
-                    node_id TEXT,
-                    double_value DOUBLE PRECISION,
-                    float_value REAL,
-                    int_value INTEGER,
-                    bool_value BOOLEAN,
-                    timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    string_val TEXT,
-                    dictionary_val TEXT,
-                    server_name TEXT
-                )
-            ''')
-
-            # Prepare value types
-            double_value = float(value) if isinstance(value, float) else None
-            float_value = float(value) if isinstance(value, float) else None
-            int_value = int(value) if isinstance(value, int) else None
-            bool_value = bool(value) if isinstance(value, bool) else None
-            string_val = str(value) if isinstance(value, str) else None
-            dictionary_val = None
-
-            # If value is a dict, store as JSON string
-            import json
-            if isinstance(value, dict):
-                dictionary_val = json.dumps(value)
-                string_val = None  # Don't store dict as string
-
+            self._ensure_data_table(cur)
             cur.execute('''
                 INSERT INTO opcua_data (
                     node_id, double_value, float_value, int_value, bool_value, string_val, dictionary_val, server_name
                 ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
-            ''', (node_id, double_value, float_value, int_value, bool_value, string_val, dictionary_val, server_name))
+            ''', (node_id,) + self._typed_values(value) + (server_name,))
             self.conn.commit()
+        self.created_tables.add('opcua_data')
+
+    def insert_many(self, rows):
+        '''
+        Bulk-inserts samples into opcua_data in one transaction.
+
+        Parameters
+        ----------
+        rows: (node_id, value, server_name, timestamp) tuples, timestamp in epoch seconds
+            (the time the value was read, not the time it is written).
+        '''
+        if not self.conn:
+            raise Exception('Not connected')
+        if self.layout == NORMALIZED:
+            return self._insert_samples(rows)
+        values = [(node_id,) + self._typed_values(value) + (server_name, timestamp)
+                  for node_id, value, server_name, timestamp in rows]
+        try:
+            with self.conn.cursor() as cur:
+                self._ensure_data_table(cur)
+                if self.write_method == UNNEST:
+                    self._execute_unnest(cur, 'opcua_insert_data', (
+                        'text[]', 'double precision[]', 'real[]', 'integer[]', 'boolean[]', 'text[]', 'text[]',
+                        'text[]', 'double precision[]'), '''
+                        INSERT INTO opcua_data (
+                            node_id, double_value, float_value, int_value, bool_value, string_val, dictionary_val,
+                            server_name, timestamp
+                        )
+                        SELECT n, d, f, i, b, s, j, v, to_timestamp(t)::timestamp
+                        FROM unnest($1, $2, $3, $4, $5, $6, $7, $8, $9) AS u(n, d, f, i, b, s, j, v, t)
+                    ''', values)
+                else:
+                    execute_values(cur, '''
+                        INSERT INTO opcua_data (
+                            node_id, double_value, float_value, int_value, bool_value, string_val, dictionary_val,
+                            server_name, timestamp
+                        ) VALUES %s
+                    ''', values, template='(%s, %s, %s, %s, %s, %s, %s, %s, to_timestamp(%s)::timestamp)')
+            self._commit()
+        except Exception:
+            self._rollback()
+            raise
+        self.created_tables.add('opcua_data')
+
+    def _ensure_normalized_tables(self, cur):
+        if 'opcua_samples' in self.created_tables:
+            return
+        cur.execute('''
+            CREATE TABLE IF NOT EXISTS opcua_servers (
+                server_key SERIAL PRIMARY KEY,
+                server_name TEXT NOT NULL UNIQUE
+            )
+        ''')
+        cur.execute('''
+            CREATE TABLE IF NOT EXISTS opcua_nodes (
+                node_key SERIAL PRIMARY KEY,
+                server_key INTEGER NOT NULL REFERENCES opcua_servers (server_key),
+                node_id TEXT NOT NULL,
+                value_kind TEXT,
+                UNIQUE (server_key, node_id)
+            )
+        ''')
+        # value_kind is kept per sample, since a node can change type (e.g. a None or a string between
+        # numbers); opcua_nodes.value_kind is the kind of the node's first value, used for samples
+        # written before the column existed
+        cur.execute('''
+            CREATE TABLE IF NOT EXISTS opcua_samples (
+                node_key INTEGER NOT NULL,
+                timestamp TIMESTAMP NOT NULL,
+                value_kind "char",
+                num_value DOUBLE PRECISION,
+                text_value TEXT
+            )
+        ''')
+        cur.execute('ALTER TABLE opcua_samples ADD COLUMN IF NOT EXISTS value_kind "char"')
+        cur.execute('''
+            CREATE INDEX IF NOT EXISTS opcua_samples_node_time ON opcua_samples (node_key, timestamp)
+        ''')
+        # Same columns as opcua_data so existing queries only need the table name changed
+        cur.execute('''
+            CREATE OR REPLACE VIEW opcua_data_view AS
+            SELECT n.node_id,
+                   CASE WHEN k.kind = 'f' THEN s.num_value END AS double_value,
+                   CASE WHEN k.kind = 'f' THEN s.num_value::real END AS float_value,
+                   CASE WHEN k.kind IN ('i', 'b') THEN s.num_value::integer END AS int_value,
+                   CASE WHEN k.kind = 'b' THEN s.num_value <> 0 END AS bool_value,
+                   s.timestamp,
+                   CASE WHEN k.kind = 's' THEN s.text_value END AS string_val,
+                   CASE WHEN k.kind = 'd' THEN s.text_value END AS dictionary_val,
+                   v.server_name
+            FROM opcua_samples s
+            JOIN opcua_nodes n ON n.node_key = s.node_key
+            JOIN opcua_servers v ON v.server_key = n.server_key
+            CROSS JOIN LATERAL (SELECT COALESCE(s.value_kind::text, left(n.value_kind, 1)) AS kind) k
+        ''')
+
+    def _server_key(self, cur, server_name):
+        key = self.server_keys.get(server_name)
+        if key is None:
+            # DO UPDATE instead of DO NOTHING so RETURNING also yields existing rows
+            cur.execute('''
+                INSERT INTO opcua_servers (server_name) VALUES (%s)
+                ON CONFLICT (server_name) DO UPDATE SET server_name = EXCLUDED.server_name
+                RETURNING server_key
+            ''', (server_name,))
+            key = cur.fetchone()[0]
+            self.server_keys[server_name] = key
+        return key
+
+    def _node_keys(self, cur, wanted):
+        '''
+        Resolves (server_key, node_id) -> node_key for wanted, a dict of (server_key, node_id) ->
+        value_kind, inserting unknown nodes with that kind. The kind of a known node is never changed.
+        '''
+        missing = [(server_key, node_id, kind) for (server_key, node_id), kind in wanted.items()
+                   if (server_key, node_id) not in self.node_keys]
+        if missing:
+            # DO UPDATE instead of DO NOTHING so RETURNING also yields existing rows
+            result = execute_values(cur, '''
+                INSERT INTO opcua_nodes (server_key, node_id, value_kind) VALUES %s
+                ON CONFLICT (server_key, node_id) DO UPDATE SET node_id = EXCLUDED.node_id
+                RETURNING server_key, node_id, node_key
+            ''', missing, fetch=True)
+            for server_key, node_id, node_key in result:
+                self.node_keys[(server_key, node_id)] = node_key
+        return {key: self.node_keys[key] for key in wanted}
+
+    def _insert_samples(self, rows):
+        try:
+            with self.conn.cursor() as cur:
+                self._ensure_normalized_tables(cur)
+                keyed = []
+                wanted = {}
+                for node_id, value, server_name, timestamp in rows:
+                    key = (self._server_key(cur, server_name), node_id)
+                    wanted.setdefault(key, value_kind(value))
+                    keyed.append((key, value, timestamp))
+                node_keys = self._node_keys(cur, wanted)
+                values = [(node_keys[key], timestamp, kind_code(value)) + narrow_value(value)
+                          for key, value, timestamp in keyed]
+                if self.write_method == UNNEST:
+                    self._execute_unnest(cur, 'opcua_insert_samples', (
+                        'integer[]', 'double precision[]', '"char"[]', 'double precision[]', 'text[]'), '''
+                        INSERT INTO opcua_samples (node_key, timestamp, value_kind, num_value, text_value)
+                        SELECT k, to_timestamp(t)::timestamp, c, n, x FROM unnest($1, $2, $3, $4, $5) AS u(k, t, c, n, x)
+                    ''', values)
+                else:
+                    execute_values(cur, '''
+                        INSERT INTO opcua_samples (node_key, timestamp, value_kind, num_value, text_value) VALUES %s
+                    ''', values, template='(%s, to_timestamp(%s)::timestamp, %s, %s, %s)')
+            self._commit()
+        except Exception:
+            self._rollback()
+            # Keys handed out in the rolled back transaction may not exist
+            self.server_keys = {}
+            self.node_keys = {}
+            raise
+        self.created_tables.add('opcua_samples')
+
+    def _ensure_raw_table(self, cur):
+        if 'opcua_raw_data' in self.created_tables:
+            return
+        cur.execute('''
+            CREATE TABLE IF NOT EXISTS opcua_raw_data (
+                id BIGSERIAL PRIMARY KEY,
+                node_id TEXT,
+                server_name TEXT,
+                timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                type_name TEXT,
+                type_id TEXT,
+                schema_version INTEGER,
+                is_array BOOLEAN,
+                body BYTEA,
+                decoded_val TEXT,
+                decoded_version INTEGER,
+                codecs_version TEXT
+            )
+        ''')
+        # Tables created before raw bodies recorded the codecs they belong to
+        cur.execute('ALTER TABLE opcua_raw_data ADD COLUMN IF NOT EXISTS codecs_version TEXT')
+        cur.execute('''
+            CREATE INDEX IF NOT EXISTS opcua_raw_data_undecoded
+            ON opcua_raw_data (id) WHERE decoded_val IS NULL
+        ''')
+
+    def insert_raw(self, node_id, type_name, type_id, schema_version, body, is_array, codecs_version=None,
+                   server_name=None):
+        '''
+        Stores an undecoded ExtensionObject body (or a packed array of bodies, see
+        opcua_structures.pack_bodies) so decoding can be deferred to
+        services.raw_decoder. codecs_version is the version of the server's
+        generated codecs (see store_type_dictionaries), if it had any.
+        '''
+        if not self.conn:
+            raise Exception('Not connected')
+        with self.conn.cursor() as cur:
+            self._ensure_raw_table(cur)
+            cur.execute('''
+                INSERT INTO opcua_raw_data (
+                    node_id, server_name, type_name, type_id, schema_version, is_array, body, codecs_version
+                ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+            ''', (node_id, server_name, type_name, type_id, schema_version, is_array, psycopg2.Binary(body),
+                  codecs_version))
+            self.conn.commit()
+        self.created_tables.add('opcua_raw_data')
+
+    def insert_raw_many(self, rows):
+        '''
+        Bulk version of insert_raw.
+
+        Parameters
+        ----------
+        rows: (node_id, type_name, type_id, schema_version, body, is_array, codecs_version, server_name,
+            timestamp) tuples, timestamp in epoch seconds.
+        '''
+        if not self.conn:
+            raise Exception('Not connected')
+        try:
+            with self.conn.cursor() as cur:
+                self._ensure_raw_table(cur)
+                if self.write_method == UNNEST:
+                    values = [(node_id, server_name, timestamp, type_name, type_id, schema_version, is_array, bytes(body),
+                               codecs_version)
+                              for node_id, type_name, type_id, schema_version, body, is_array, codecs_version, server_name,
+                              timestamp in rows]
+                    self._execute_unnest(cur, 'opcua_insert_raw', (
+                        'text[]', 'text[]', 'double precision[]', 'text[]', 'text[]', 'integer[]', 'boolean[]',
+                        'bytea[]', 'text[]'), '''
+                        INSERT INTO opcua_raw_data (
+                            node_id, server_name, timestamp, type_name, type_id, schema_version, is_array, body,
+                            codecs_version
+                        )
+                        SELECT n, v, to_timestamp(t)::timestamp, tn, ti, sv, a, b, cv
+                        FROM unnest($1, $2, $3, $4, $5, $6, $7, $8, $9) AS u(n, v, t, tn, ti, sv, a, b, cv)
+                    ''', values)
+                else:
+                    values = [(node_id, server_name, timestamp, type_name, type_id, schema_version, is_array,
+                               psycopg2.Binary(body), codecs_version)
+                              for node_id, type_name, type_id, schema_version, body, is_array, codecs_version, server_name,
+                              timestamp in rows]
+                    execute_values(cur, '''
+                        INSERT INTO opcua_raw_data (
+                            node_id, server_name, timestamp, type_name, type_id, schema_version, is_array, body,
+                            codecs_version
+                        ) VALUES %s
+                    ''', values, template='(%s, %s, to_timestamp(%s)::timestamp, %s, %s, %s, %s, %s, %s)')
+            self._commit()
+        except Exception:
+            self._rollback()
+            raise
+        self.created_tables.add('opcua_raw_data')
+
+    def _ensure_dictionary_table(self, cur):
+        if 'opcua_type_dictionaries' in self.created_tables:
+            return
+        cur.execute('''
+            CREATE TABLE IF NOT EXISTS opcua_type_dictionaries (
+                version TEXT PRIMARY KEY,
+                dictionaries BYTEA[],
+                first_seen TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+
+    def store_type_dictionaries(self, version, dictionaries):
+        '''
+        Stores the type dictionary XML documents a codecs version was compiled
+        from (see type_dictionary.compile_codecs), unless they are stored already.
+        '''
+        if not self.conn:
+            raise Exception('Not connected')
+        try:
+            with self.conn.cursor() as cur:
+                self._ensure_dictionary_table(cur)
+                cur.execute('''
+                    INSERT INTO opcua_type_dictionaries (version, dictionaries) VALUES (%s, %s)
+                    ON CONFLICT (version) DO NOTHING
+                ''', (version, [psycopg2.Binary(xml_bytes) for xml_bytes in dictionaries]))
+            self._commit()
+        except Exception:
+            self._rollback()
+            raise
+        self.created_tables.add('opcua_type_dictionaries')
+
+    def fetch_type_dictionaries(self, version):
+        '''
+        Returns the type dictionary XML documents stored for a codecs version, or None.
+        '''
+        if not self.conn:
+            raise Exception('Not connected')
+        with self.conn.cursor() as cur:
+            cur.execute('SELECT to_regclass(%s)', ('opcua_type_dictionaries',))
+            if cur.fetchone()[0] is None:
+                return None
+            cur.execute('SELECT dictionaries FROM opcua_type_dictionaries WHERE version = %s', (version,))
+            row = cur.fetchone()
+        return [bytes(xml_bytes) for xml_bytes in row[0]] if row else None
+
+    def fetch_raw(self, where='', params=(), limit=None, for_update=False):
+        '''
+        Returns (id, node_id, server_name, timestamp, type_name, schema_version, is_array, body,
+        decoded_val, decoded_version, codecs_version) rows from opcua_raw_data ordered by id.
+        where is an SQL condition using %s placeholders filled from params.
+        '''
+        if not self.conn:
+            raise Exception('Not connected')
+        sql = '''
+            SELECT id, node_id, server_name, timestamp, type_name, schema_version, is_array, body,
+                   decoded_val, decoded_version, codecs_version
+            FROM opcua_raw_data
+        '''
+        if where:
+            sql += f' WHERE {where}'
+        sql += ' ORDER BY id'
+        if limit:
+            sql += f' LIMIT {int(limit)}'
+        if for_update:
+            sql += ' FOR UPDATE SKIP LOCKED'
+        with self.conn.cursor() as cur:
+            cur.execute(sql, params)
+            return cur.fetchall()
+
+    def update_decoded(self, rows):
+        '''
+        Writes decoder output back to opcua_raw_data.
+
+        Parameters
+        ----------
+        rows: (id, decoded_val, decoded_version) tuples, decoded_val being a JSON string.
+        '''
+        if not self.conn:
+            raise Exception('Not connected')
+        with self.conn.cursor() as cur:
+            execute_values(cur, '''
+                UPDATE opcua_raw_data AS r
+                SET decoded_val = v.decoded_val, decoded_version = v.decoded_version
+                FROM (VALUES %s) AS v (id, decoded_val, decoded_version)
+                WHERE r.id = v.id
+            ''', rows, template='(%s::bigint, %s::text, %s::integer)')
+        self.conn.commit()
+
+    def _sample_query(self, start, end, servers, nodes, latest=False):
+        if self.layout == NORMALIZED:
+            select = '''
+                SELECT s.timestamp, v.server_name, n.node_id, COALESCE(s.value_kind::text, left(n.value_kind, 1)),
+                       s.num_value, s.text_value
+                FROM opcua_samples s
+                JOIN opcua_nodes n ON n.node_key = s.node_key
+                JOIN opcua_servers v ON v.server_key = n.server_key
+            '''
+            columns = {'timestamp': 's.timestamp', 'server_name': 'v.server_name', 'node_id': 'n.node_id'}
+            node_order = 's.node_key'
+        else:
+            select = '''
+                SELECT timestamp, server_name, node_id, double_value, int_value, bool_value, string_val, dictionary_val
+                FROM opcua_data
+            '''
+            columns = {'timestamp': 'timestamp', 'server_name': 'server_name', 'node_id': 'node_id'}
+            node_order = 'server_name, node_id'
+        conditions = []
+        params = []
+        if start is not None:
+            conditions.append(f"{columns['timestamp']} >= %s")
+            params.append(start)
+        if end is not None:
+            conditions.append(f"{columns['timestamp']} < %s")
+            params.append(end)
+        if servers:
+            conditions.append(f"{columns['server_name']} = ANY(%s)")
+            params.append(list(servers))
+        if nodes:
+            conditions.append(f"{columns['node_id']} = ANY(%s)")
+            params.append(list(nodes))
+        sql = select
+        if latest:
+            sql = sql.replace('SELECT', f'SELECT DISTINCT ON ({node_order})', 1)
+        if conditions:
+            sql += ' WHERE ' + ' AND '.join(conditions)
+        if latest:
+            sql += f" ORDER BY {node_order}, {columns['timestamp']} DESC"
+        else:
+            sql += f" ORDER BY {columns['timestamp']}"
+        return sql, params
+
+    def _sample_rows(self, rows):
+        if self.layout == NORMALIZED:
+            return [(t, server, node, self._narrow_to_value(kind, num, text))
+                    for t, server, node, kind, num, text in rows]
+        return [(t, server, node, self._wide_to_value(*values)) for t, server, node, *values in rows]
+
+    def iter_samples(self, start=None, end=None, servers=None, nodes=None, chunk_size=10000):
+        '''
+        Streams logged samples ordered by timestamp without loading the result into memory.
+
+        Uses a named (server-side) cursor, so only chunk_size rows are held by the client at a
+        time. Reads opcua_samples or opcua_data depending on the layout.
+
+        Parameters
+        ----------
+        start, end: Optional datetimes bounding the range (start inclusive, end exclusive).
+        servers, nodes: Optional lists of server names and node ids to export.
+        chunk_size: Rows fetched per round trip.
+
+        Yields
+        ------
+        chunk: A list of (timestamp, server_name, node_id, value) tuples, value being a float,
+            int, bool, str or dict like the value that was logged.
+        '''
+        if not self.conn:
+            raise Exception('Not connected')
+        sql, params = self._sample_query(start, end, servers, nodes)
+        # A named cursor lives in a transaction, which is ended once the rows are consumed
+        try:
+            with self.conn.cursor(name='opcua_export') as cur:
+                cur.itersize = chunk_size
+                cur.execute(sql, params)
+                while True:
+                    rows = cur.fetchmany(chunk_size)
+                    if not rows:
+                        break
+                    yield self._sample_rows(rows)
+        finally:
+            self.conn.rollback()
+
+    def latest_samples(self, start=None, end=None, servers=None, nodes=None):
+        '''Returns the newest (timestamp, server_name, node_id, value) sample of every node in the range.'''
+        if not self.conn:
+            raise Exception('Not connected')
+        sql, params = self._sample_query(start, end, servers, nodes, latest=True)
+        try:
+            with self.conn.cursor() as cur:
+                cur.execute(sql, params)
+                return self._sample_rows(cur.fetchall())
+        finally:
+            self.conn.rollback()
+
+    @staticmethod
+    def _narrow_to_value(kind, num_value, text_value):
+        '''kind is the code from kind_code.'''
+        if kind == 'd':
+            return json.loads(text_value) if text_value is not None else None
+        if num_value is None:
+            return text_value
+        if kind == 'b':
+            return num_value != 0
+        if kind == 'i':
+            return int(num_value)
+        return num_value
+
+    @staticmethod
+    def _wide_to_value(double_value, int_value, bool_value, string_val, dictionary_val):
+        if dictionary_val is not None:
+            return json.loads(dictionary_val)
+        if bool_value is not None:
+            return bool_value
+        if double_value is not None:
+            return double_value
+        if int_value is not None:
+            return int_value
+        return string_val
+
+    def upsert_entities(self, rows):
+        '''
+        Applies changed elements of structure arrays to one table per structure type
+        (opcua_entity_planinfo, opcua_entity_runpartinfo, ...).
+
+        Parameters
+        ----------
+        rows: (entity, server_name, entity_key, node_id, element, timestamp, removed) tuples as
+            produced from EntityDiffer records. element is the decoded dict (None when removed),
+            timestamp is in epoch seconds.
+
+        Each table holds one row per (server_name, entity_key) with the latest element as JSON,
+        when it was first seen and last changed, and removed_at once it left the array.
+        '''
+        if not self.conn:
+            raise Exception('Not connected')
+        by_table = {}
+        for entity, server_name, key, node_id, element, timestamp, removed in rows:
+            # One row per key and statement: ON CONFLICT cannot update the same row twice
+            by_table.setdefault(entity_table_name(entity), {})[(server_name, key)] = (
+                server_name, key, node_id, json.dumps(element) if element is not None else None,
+                timestamp, timestamp, timestamp if removed else None)
+        try:
+            with self.conn.cursor() as cur:
+                for table, values in by_table.items():
+                    if table not in self.created_tables:
+                        cur.execute(f'''
+                            CREATE TABLE IF NOT EXISTS {table} (
+                                server_name TEXT NOT NULL,
+                                entity_key TEXT NOT NULL,
+                                node_id TEXT,
+                                data TEXT,
+                                first_seen TIMESTAMP,
+                                last_changed TIMESTAMP,
+                                removed_at TIMESTAMP,
+                                PRIMARY KEY (server_name, entity_key)
+                            )
+                        ''')
+                    conflict = f'''
+                        ON CONFLICT (server_name, entity_key) DO UPDATE SET
+                            node_id = EXCLUDED.node_id,
+                            data = COALESCE(EXCLUDED.data, {table}.data),
+                            last_changed = EXCLUDED.last_changed,
+                            removed_at = EXCLUDED.removed_at
+                    '''
+                    if self.write_method == UNNEST:
+                        self._execute_unnest(cur, f'upsert_{table}', (
+                            'text[]', 'text[]', 'text[]', 'text[]', 'double precision[]', 'double precision[]',
+                            'double precision[]'), f'''
+                            INSERT INTO {table} (
+                                server_name, entity_key, node_id, data, first_seen, last_changed, removed_at
+                            )
+                            SELECT v, k, n, d, to_timestamp(f)::timestamp, to_timestamp(c)::timestamp,
+                                   to_timestamp(r)::timestamp
+                            FROM unnest($1, $2, $3, $4, $5, $6, $7) AS u(v, k, n, d, f, c, r)
+                        ''' + conflict, list(values.values()))
+                    else:
+                        execute_values(cur, f'''
+                            INSERT INTO {table} (
+                                server_name, entity_key, node_id, data, first_seen, last_changed, removed_at
+                            ) VALUES %s
+                        ''' + conflict, list(values.values()), template='(%s, %s, %s, %s, to_timestamp(%s)::timestamp, '
+                                                                       'to_timestamp(%s)::timestamp, to_timestamp(%s)::timestamp)')
+            self._commit()
+        except Exception:
+            self._rollback()
+            raise
+        self.created_tables.update(by_table)
+
+    def upsert_summaries(self, kind, summaries):
+        '''
+        Writes finished run or plate summaries (see services.lifecycle).
+
+        Parameters
+        ----------
+        kind: 'run_summary' or 'plate_summary'; selects the table and columns from SUMMARY_TABLES.
+        summaries: dicts keyed by column name. TIMESTAMP columns are epoch seconds, dicts are
+            stored as JSON. A summary written again for the same key replaces the earlier one.
+        '''
+        if not self.conn:
+            raise Exception('Not connected')
+        table, columns, key_columns = SUMMARY_TABLES[kind]
+        names = [name for name, _ in columns]
+        template = '(' + ', '.join('to_timestamp(%s)::timestamp' if sql_type == 'TIMESTAMP' else '%s'
+                                   for _, sql_type in columns) + ')'
+        values = {}
+        for summary in summaries:
+            row = tuple(json.dumps(summary.get(name)) if isinstance(summary.get(name), dict) else summary.get(name)
+                        for name in names)
+            values[tuple(summary[k] for k in key_columns)] = row
+        updates = ', '.join(f'{name} = EXCLUDED.{name}' for name in names if name not in key_columns)
+        try:
+            with self.conn.cursor() as cur:
+                if table not in self.created_tables:
+                    column_sql = ',\n'.join(f'{name} {sql_type}' for name, sql_type in columns)
+                    cur.execute(f'''
+                        CREATE TABLE IF NOT EXISTS {table} (
+                            {column_sql},
+                            PRIMARY KEY ({', '.join(key_columns)})
+                        )
+                    ''')
+                conflict = f'''
+                    ON CONFLICT ({', '.join(key_columns)}) DO UPDATE SET {updates}
+                '''
+                if self.write_method == UNNEST:
+                    # Timestamps travel as epoch seconds like in the VALUES template
+                    types = ['double precision[]' if sql_type == 'TIMESTAMP' else sql_type.replace(' NOT NULL', '').lower() + '[]'
+                             for _, sql_type in columns]
+                    select = ', '.join(f'to_timestamp(c{i})::timestamp' if sql_type == 'TIMESTAMP' else f'c{i}'
+                                       for i, (_, sql_type) in enumerate(columns))
+                    params = ', '.join(f'${i + 1}' for i in range(len(columns)))
+                    aliases = ', '.join(f'c{i}' for i in range(len(columns)))
+                    self._execute_unnest(cur, f'upsert_{table}', types, f'''
+                        INSERT INTO {table} ({', '.join(names)})
+                        SELECT {select} FROM unnest({params}) AS u({aliases})
+                    ''' + conflict, list(values.values()))
+                else:
+                    execute_values(cur, f'''
+                        INSERT INTO {table} ({', '.join(names)}) VALUES %s
+                    ''' + conflict, list(values.values()), template=template)
+            self._commit()
+        except Exception:
+            self._rollback()
+            raise
+        self.created_tables.add(table)
+
+    def insert_rollups(self, rows):
+        '''
+        Bulk-writes closed rollup buckets, one table per bucket width.
+
+        Parameters
+        ----------
+        rows: (bucket_seconds, bucket_start, server_name, node_id, field, count, sum, min, max)
+            tuples as returned by RollupAggregator.flush(). bucket_start is in epoch
+            seconds and is stored in session time like opcua_data.timestamp.
+
+        A bucket that already exists (e.g. flushed early on shutdown) is merged
+        with the new aggregate instead of being overwritten.
+        '''
+        if not self.conn:
+            raise Exception('Not connected')
+        by_table = {}
+        for width, bucket_start, server_name, node_id, field, count, total, low, high in rows:
+            # Merged here too: ON CONFLICT cannot update the same row twice in one statement
+            buckets = by_table.setdefault(rollup_table_name(width), {})
+            key = (server_name, node_id, field, bucket_start)
+            if key in buckets:
+                _, _, _, _, count0, total0, low0, high0 = buckets[key]
+                count, total, low, high = count0 + count, total0 + total, min(low0, low), max(high0, high)
+            buckets[key] = key + (count, total, low, high)
+        by_table = {table: list(buckets.values()) for table, buckets in by_table.items()}
+        try:
+            self._write_rollups(by_table)
+        except Exception:
+            self._rollback()
+            raise
+
+    def _write_rollups(self, by_table):
+        with self.conn.cursor() as cur:
+            for table, values in by_table.items():
+                if table not in self.created_tables:
+                    cur.execute(f'''
+                        CREATE TABLE IF NOT EXISTS {table} (
+                            server_name TEXT NOT NULL,
+                            node_id TEXT NOT NULL,
+                            field TEXT NOT NULL,
+                            bucket_start TIMESTAMP NOT NULL,
+                            sample_count BIGINT NOT NULL,
+                            sum_value DOUBLE PRECISION,
+                            min_value DOUBLE PRECISION,
+                            max_value DOUBLE PRECISION,
+                            PRIMARY KEY (server_name, node_id, field, bucket_start)
+                        )
+                    ''')
+                conflict = f'''
+                    ON CONFLICT (server_name, node_id, field, bucket_start) DO UPDATE SET
+                        sample_count = {table}.sample_count + EXCLUDED.sample_count,
+                        sum_value = {table}.sum_value + EXCLUDED.sum_value,
+                        min_value = LEAST({table}.min_value, EXCLUDED.min_value),
+                        max_value = GREATEST({table}.max_value, EXCLUDED.max_value)
+                '''
+                if self.write_method == UNNEST:
+                    self._execute_unnest(cur, f'insert_{table}', (
+                        'text[]', 'text[]', 'text[]', 'double precision[]', 'bigint[]', 'double precision[]',
+                        'double precision[]', 'double precision[]'), f'''
+                        INSERT INTO {table} (
+                            server_name, node_id, field, bucket_start, sample_count, sum_value, min_value, max_value
+                        )
+                        SELECT v, n, f, to_timestamp(b)::timestamp, c, s, lo, hi
+                        FROM unnest($1, $2, $3, $4, $5, $6, $7, $8) AS u(v, n, f, b, c, s, lo, hi)
+                    ''' + conflict, values)
+                else:
+                    execute_values(cur, f'''
+                        INSERT INTO {table} (
+                            server_name, node_id, field, bucket_start, sample_count, sum_value, min_value, max_value
+                        ) VALUES %s
+                    ''' + conflict, values, template='(%s, %s, %s, to_timestamp(%s)::timestamp, %s, %s, %s, %s)')
+        self._commit()
+        self.created_tables.update(by_table)
+
+    def _ensure_lease_tables(self, cur):
+        if 'opcua_server_leases' in self.created_tables:
+            return
+        cur.execute('''
+            CREATE TABLE IF NOT EXISTS opcua_collectors (
+                instance_id TEXT PRIMARY KEY,
+                host TEXT,
+                last_seen TIMESTAMP NOT NULL
+            )
+        ''')
+        cur.execute('''
+            CREATE TABLE IF NOT EXISTS opcua_server_leases (
+                server_name TEXT PRIMARY KEY,
+                instance_id TEXT NOT NULL,
+                expires_at TIMESTAMP NOT NULL
+            )
+        ''')
+
+    def _lease_transaction(self, statements):
+        '''Runs (sql, params) statements in one transaction and returns the first column of the last one's rows.'''
+        if not self.conn:
+            raise Exception('Not connected')
+        try:
+            with self.conn.cursor() as cur:
+                self._ensure_lease_tables(cur)
+                for sql, params in statements:
+                    cur.execute(sql, params)
+                rows = [row[0] for row in cur.fetchall()] if cur.description else []
+            self.conn.commit()
+        except Exception:
+            self.conn.rollback()
+            raise
+        self.created_tables.add('opcua_server_leases')
+        return rows
+
+    def heartbeat_collector(self, instance_id, host, ttl):
+        '''
+        Marks a collector instance as alive and returns the ids of every instance
+        seen within the last ttl seconds, sorted. All times use the database clock.
+        '''
+        return self._lease_transaction([
+            ('''
+                INSERT INTO opcua_collectors (instance_id, host, last_seen) VALUES (%s, %s, now())
+                ON CONFLICT (instance_id) DO UPDATE SET host = EXCLUDED.host, last_seen = EXCLUDED.last_seen
+            ''', (instance_id, host)),
+            # Instances that are gone for good do not need to be kept around
+            ("DELETE FROM opcua_collectors WHERE last_seen < now() - %s * interval '1 second'", (ttl * 10,)),
+            ("SELECT instance_id FROM opcua_collectors WHERE last_seen >= now() - %s * interval '1 second' ORDER BY instance_id", (ttl,)),
+        ])
+
+    def renew_leases(self, instance_id, server_names, lease_seconds):
+        '''Extends the leases this instance holds on any of server_names and returns those server names.'''
+        return self._lease_transaction([('''
+            UPDATE opcua_server_leases SET expires_at = now() + %s * interval '1 second'
+            WHERE instance_id = %s AND server_name = ANY(%s)
+            RETURNING server_name
+        ''', (lease_seconds, instance_id, list(server_names)))])
+
+    def free_leases(self, server_names):
+        '''Returns the server names that have no lease or only an expired one.'''
+        return self._lease_transaction([('''
+            SELECT s.server_name FROM unnest(%s::text[]) AS s(server_name)
+            WHERE NOT EXISTS (
+                SELECT 1 FROM opcua_server_leases l WHERE l.server_name = s.server_name AND l.expires_at >= now()
+            )
+        ''', (list(server_names),))])
+
+    def claim_leases(self, instance_id, server_names, lease_seconds):
+        '''
+        Takes the leases on server_names that are free or expired and returns the
+        server names actually claimed. Concurrent claims of the same server are
+        decided by the primary key: only one instance gets it.
+        '''
+        return self._lease_transaction([('''
+            INSERT INTO opcua_server_leases (server_name, instance_id, expires_at)
+            SELECT server_name, %s, now() + %s * interval '1 second' FROM unnest(%s::text[]) AS s(server_name)
+            ON CONFLICT (server_name) DO UPDATE SET instance_id = EXCLUDED.instance_id, expires_at = EXCLUDED.expires_at
+            WHERE opcua_server_leases.expires_at < now() OR opcua_server_leases.instance_id = EXCLUDED.instance_id
+            RETURNING server_name
+        ''', (instance_id, lease_seconds, list(server_names)))])
+
+    def release_leases(self, instance_id, server_names=None, unregister=False):
+        '''
+        Gives up leases so other instances can claim them right away: those on
+        server_names, or all of them. unregister also removes the instance from
+        opcua_collectors, so the others rebalance without waiting for it to expire.
+        '''
+        statements = []
+        if server_names is None:
+            statements.append(('DELETE FROM opcua_server_leases WHERE instance_id = %s', (instance_id,)))
+        else:
+            statements.append(('DELETE FROM opcua_server_leases WHERE instance_id = %s AND server_name = ANY(%s)',
+                               (instance_id, list(server_names))))
+        if unregister:
+            statements.append(('DELETE FROM opcua_collectors WHERE instance_id = %s', (instance_id,)))
+        self._lease_transaction(statements)
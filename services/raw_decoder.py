@@ -0,0 +1,127 @@
+import argparse
+import json
+import services.opcua_structures as opcua_structures
+import services.type_dictionary as type_dictionary
+
+# Decoding of rows stored by the raw ingestion mode. The same decoders as the
+# live path are used: the codecs generated from the server's type dictionary
+# the row was stored with (kept in opcua_type_dictionaries), falling back to
+# the hand-written classes. Fixing a decoder and running this job with
+# --redecode re-applies the fix to historical data.
+
+_codecs = {}  # codecs_version -> Codecs rebuilt from the stored dictionaries, None if none are stored
+
+def load_codecs(pg_service, codecs_version):
+    '''Returns the codecs of a stored codecs version, compiling each version once, or None.'''
+    if codecs_version is None:
+        return None
+    if codecs_version not in _codecs:
+        dictionaries = pg_service.fetch_type_dictionaries(codecs_version)
+        _codecs[codecs_version] = type_dictionary.compile_codecs(dictionaries) if dictionaries else None
+    return _codecs[codecs_version]
+
+def decoder_version(type_name, codecs=None):
+    if codecs is not None and type_name in codecs.decoders:
+        return type_dictionary.GENERATOR_VERSION
+    StructClass = opcua_structures.map_structures(type_name)
+    return StructClass.SCHEMA_VERSION if StructClass else None
+
+def decode_body(type_name, body, is_array, codecs=None):
+    '''
+    Decodes a stored body with the generated decoder for type_name, or its
+    hand-written structure class.
+
+    Returns
+    -------
+    value: A dict, or a list of dicts for arrays, or None if there is no decoder for the type.
+    '''
+    decoder = opcua_structures.get_decoder(type_name, codecs)
+    if not decoder:
+        return None
+    if is_array:
+        return [decoder(item) for item in opcua_structures.unpack_bodies(body)]
+    return decoder(bytes(body))
+
+def decode_pending(pg_service, batch_size=500, redecode=False):
+    '''
+    Decodes stored raw rows in batches and writes the result to decoded_val.
+
+    Parameters
+    ----------
+    pg_service: A connected PostgresService.
+    batch_size: Number of rows locked and decoded per transaction.
+    redecode: Also decode rows that were decoded with an older decoder version.
+
+    Returns
+    -------
+    count: Number of rows decoded.
+    '''
+    count = 0
+    last_id = 0
+    while True:
+        # With redecode every row is visited and the version check below skips current ones
+        where = 'id > %s' if redecode else 'id > %s AND decoded_val IS NULL'
+        rows = pg_service.fetch_raw(where, (last_id,), limit=batch_size, for_update=True)
+        if not rows:
+            pg_service.conn.rollback()
+            break
+        updates = []
+        for (row_id, node_id, server_name, timestamp, type_name, schema_version, is_array, body, decoded_val,
+             decoded_version, codecs_version) in rows:
+            last_id = row_id
+            codecs = load_codecs(pg_service, codecs_version)
+            version = decoder_version(type_name, codecs)
+            if version is None:
+                continue  # No decoder yet; the row stays pending until one exists
+            if redecode and decoded_val is not None and decoded_version == version:
+                continue
+            try:
+                value = decode_body(type_name, body, is_array, codecs)
+            except Exception as e:
+                print(f"Failed to decode row {row_id} ({type_name}): {e}")
+                continue
+            updates.append((row_id, json.dumps(value), version))
+        if updates:
+            pg_service.update_decoded(updates)
+            count += len(updates)
+        else:
+            pg_service.conn.rollback()
+    return count
+
+def fetch_decoded(pg_service, server_name, node_id, start=None, end=None):
+    '''
+    Returns (timestamp, value) pairs for one node, decoding rows lazily when
+    the batch job has not processed them yet.
+    '''
+    where = 'server_name = %s AND node_id = %s'
+    params = [server_name, node_id]
+    if start is not None:
+        where += ' AND timestamp >= %s'
+        params.append(start)
+    if end is not None:
+        where += ' AND timestamp < %s'
+        params.append(end)
+    result = []
+    for row_id, _, _, timestamp, type_name, _, is_array, body, decoded_val, _, codecs_version in pg_service.fetch_raw(
+            where, tuple(params)):
+        if decoded_val is not None:
+            value = json.loads(decoded_val)
+        else:
+            value = decode_body(type_name, body, is_array, load_codecs(pg_service, codecs_version))
+        result.append((timestamp, value))
+    pg_service.conn.rollback()
+    return result
+
+if __name__ == '__main__':
+    from services.postgres_service import PostgresService
+    parser = argparse.ArgumentParser(description='Decode raw OPC UA bodies stored in opcua_raw_data.')
+    parser.add_argument('conn_str', help='Postgres connection string, e.g. "dbname=... user=... password=... host=..."')
+    parser.add_argument('--batch-size', type=int, default=500)
+    parser.add_argument('--redecode', action='store_true', help='Re-decode rows decoded with an older decoder version')
+    args = parser.parse_args()
+    pg_service = PostgresService(args.conn_str)
+    pg_service.connect()
+    try:
+        print(f"Decoded {decode_pending(pg_service, args.batch_size, args.redecode)} rows.")
+    finally:
+        pg_service.disconnect()
@@ -0,0 +1,289 @@
+import json
+import threading
+import time
+import uuid
+from collections import deque
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+from services.memory_service import approx_size
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8081
+DEFAULT_HISTORY_SIZE = 100
+
+class LiveStore:
+    '''
+    Thread-safe in-memory copy of the latest value and a short history per
+    server/node. Every update bumps a version counter which is used for ETags
+    and to feed the server-sent-events stream.
+    '''
+    def __init__(self, history_size=DEFAULT_HISTORY_SIZE):
+        self.history_size = history_size
+        self.instance = uuid.uuid4().hex[:8]  # Keeps ETags from matching across restarts
+        self.version = 0
+        self.nodes = {}  # (server_name, node_id) -> {value, datatype, timestamp, version, history}
+        self.server_status = {}  # server_name -> {status, version}
+        self.server_versions = {}  # server_name -> version of its last update, status change or removal
+        self.changes = deque(maxlen=1000)  # (version, server_name, node_id)
+        self.cond = threading.Condition()
+
+    def update(self, server_name, node_id, value, datatype=None, timestamp=None):
+        if timestamp is None:
+            timestamp = time.time()
+        with self.cond:
+            self.version += 1
+            entry = self.nodes.get((server_name, node_id))
+            if entry is None:
+                entry = {'history': deque(maxlen=self.history_size)}
+                self.nodes[(server_name, node_id)] = entry
+            entry['value'] = value
+            entry['datatype'] = datatype
+            entry['timestamp'] = timestamp
+            entry['version'] = self.version
+            entry['history'].append((timestamp, value))
+            self.server_versions[server_name] = self.version
+            self.changes.append((self.version, server_name, node_id))
+            self.cond.notify_all()
+
+    def set_status(self, server_name, status):
+        with self.cond:
+            self.version += 1
+            self.server_status[server_name] = {'status': status, 'version': self.version}
+            self.server_versions[server_name] = self.version
+            self.changes.append((self.version, server_name, None))
+            self.cond.notify_all()
+
+    def remove(self, server_name, node_id=None):
+        '''Forgets one node, or every node of a server when node_id is None.'''
+        with self.cond:
+            self.version += 1
+            for key in [k for k in self.nodes if k[0] == server_name and (node_id is None or k[1] == node_id)]:
+                del self.nodes[key]
+            if node_id is None:
+                self.server_status.pop(server_name, None)
+            # Bumped also when the server is gone, so its ETag never goes back to an earlier one
+            self.server_versions[server_name] = self.version
+            self.changes.append((self.version, server_name, node_id))
+            self.cond.notify_all()
+
+    def memory_bytes(self):
+        with self.cond:
+            return approx_size(self.nodes) + approx_size(self.changes)
+
+    def shed(self, fraction):
+        '''Shortens the history of every node by fraction, for good (at least one value is kept).'''
+        with self.cond:
+            self.history_size = max(int(self.history_size * (1 - fraction)), 1)
+            for entry in self.nodes.values():
+                entry['history'] = deque(entry['history'], maxlen=self.history_size)
+
+    def _node_json(self, key, entry):
+        return {
+            'server': key[0],
+            'node_id': key[1],
+            'value': entry['value'],
+            'datatype': entry['datatype'],
+            'timestamp': _isoformat(entry['timestamp']),
+        }
+
+    def servers(self):
+        with self.cond:
+            names = set(self.server_status) | {k[0] for k in self.nodes}
+            result = []
+            for name in sorted(names):
+                result.append({
+                    'server': name,
+                    'status': self.server_status.get(name, {}).get('status', ''),
+                    'nodes': sum(1 for k in self.nodes if k[0] == name),
+                })
+            return self.version, result
+
+    def values(self, server_name=None, node_id=None):
+        '''
+        Returns (version, values). version changes whenever the selection does:
+        the node's version for one node, the server's version (which removals
+        bump too) for one server, the store's version otherwise.
+        '''
+        with self.cond:
+            selected = [(k, e) for k, e in self.nodes.items()
+                        if (server_name is None or k[0] == server_name) and (node_id is None or k[1] == node_id)]
+            if server_name is None:
+                version = self.version
+            elif node_id is None:
+                version = self.server_versions.get(server_name, 0)
+            else:
+                version = max((e['version'] for k, e in selected), default=0)
+            return version, [self._node_json(k, e) for k, e in selected]
+
+    def history(self, server_name, node_id, limit=None):
+        with self.cond:
+            entry = self.nodes.get((server_name, node_id))
+            if entry is None:
+                return 0, None
+            items = list(entry['history'])
+            if limit is not None:
+                items = items[len(items) - limit:] if limit else []
+            return entry['version'], [{'timestamp': _isoformat(t), 'value': v} for t, v in items]
+
+    def wait_for_changes(self, since_version, timeout):
+        '''
+        Blocks until there are updates newer than since_version or the timeout
+        expires. Returns (version, changed_keys); changed_keys is None when the
+        caller fell too far behind and should resend a full snapshot.
+        '''
+        with self.cond:
+            self.cond.wait_for(lambda: self.version > since_version, timeout=timeout)
+            if self.version <= since_version:
+                return self.version, []
+            if not self.changes or self.changes[0][0] > since_version + 1:
+                return self.version, None
+            keys = []
+            for version, server_name, node_id in self.changes:
+                if version > since_version and (server_name, node_id) not in keys:
+                    keys.append((server_name, node_id))
+            return self.version, keys
+
+def _int_param(query, name):
+    '''Returns a non-negative integer query parameter, None if absent; raises ValueError otherwise.'''
+    if name not in query:
+        return None
+    try:
+        value = int(query[name])
+    except ValueError:
+        raise ValueError(f'{name} must be an integer')
+    if value < 0:
+        raise ValueError(f'{name} must not be negative')
+    return value
+
+def _isoformat(timestamp):
+    return datetime.fromtimestamp(timestamp).isoformat(timespec='milliseconds')
+
+class ReadApiHandler(BaseHTTPRequestHandler):
+    '''
+    GET /servers                             servers with status and node count
+    GET /values[?server=..][&node=..]        latest values
+    GET /history?server=..&node=..[&limit=n] recent values of one node
+    GET /events                              server-sent events with every update
+    GET /stats                               collector statistics (scheduler timing, ...)
+    GET /memory[?top=n]                      memory per subsystem; top adds a tracemalloc snapshot
+                                             with the n largest allocation sites and their growth
+    '''
+    store = None
+    sse_enabled = True
+    stats_provider = None
+    memory_monitor = None
+
+    def log_message(self, format, *args):
+        pass  # The collector prints its own status; per-request logging is too noisy on the Pi
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = {k: v[0] for k, v in parse_qs(url.query).items()}
+        try:
+            if url.path == '/servers':
+                version, body = self.store.servers()
+                self.send_json(version, body)
+            elif url.path == '/values':
+                version, body = self.store.values(query.get('server'), query.get('node'))
+                if query.get('node') and not body:
+                    return self.send_error(404, 'Unknown node')
+                self.send_json(version, body)
+            elif url.path == '/history':
+                if 'server' not in query or 'node' not in query:
+                    return self.send_error(400, 'server and node are required')
+                limit = _int_param(query, 'limit')
+                version, body = self.store.history(query['server'], query['node'], limit)
+                if body is None:
+                    return self.send_error(404, 'Unknown node')
+                self.send_json(version, body)
+            elif url.path == '/stats' and self.stats_provider:
+                self.send_json(None, self.stats_provider())
+            elif url.path == '/memory' and self.memory_monitor:
+                body = self.memory_monitor.stats(refresh=True)
+                top = _int_param(query, 'top')
+                if top is not None:
+                    body['snapshot'] = self.memory_monitor.snapshot(top)
+                self.send_json(None, body)
+            elif url.path == '/events' and self.sse_enabled:
+                self.stream_events(query.get('server'))
+            else:
+                self.send_error(404)
+        except ValueError as e:
+            self.send_error(400, str(e))
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+    def send_json(self, version, body):
+        etag = f'"{self.store.instance}-{version}"' if version is not None else None
+        if etag and self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.end_headers()
+            return
+        data = json.dumps(body, default=str).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        if etag:
+            self.send_header('ETag', etag)
+        self.send_header('Cache-Control', 'no-cache')
+        self.end_headers()
+        self.wfile.write(data)
+
+    def stream_events(self, server_name=None):
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Cache-Control', 'no-cache')
+        self.end_headers()
+        version, values = self.store.values(server_name)
+        self.send_event('snapshot', version, values)
+        while True:
+            version_before = version
+            version, keys = self.store.wait_for_changes(version, timeout=15)
+            if keys is None:
+                version, values = self.store.values(server_name)
+                self.send_event('snapshot', version, values)
+                continue
+            if version == version_before:
+                self.wfile.write(b': keepalive\n\n')
+                self.wfile.flush()
+                continue
+            for key_server, node_id in keys:
+                if server_name is not None and key_server != server_name:
+                    continue
+                if node_id is None:
+                    _, servers = self.store.servers()
+                    status = [s for s in servers if s['server'] == key_server]
+                    self.send_event('server', version, status[0] if status else {'server': key_server, 'removed': True})
+                    continue
+                _, values = self.store.values(key_server, node_id)
+                self.send_event('value', version, values[0] if values else {'server': key_server, 'node_id': node_id, 'removed': True})
+
+    def send_event(self, event, version, data):
+        payload = json.dumps(data, default=str)
+        self.wfile.write(f'id: {version}\nevent: {event}\ndata: {payload}\n\n'.encode('utf-8'))
+        self.wfile.flush()
+
+class ReadApiServer:
+    '''Serves a LiveStore over HTTP from a background thread.'''
+    def __init__(self, store, host=DEFAULT_HOST, port=DEFAULT_PORT, sse=True, stats_provider=None, memory_monitor=None):
+        handler = type('BoundReadApiHandler', (ReadApiHandler,), {
+            'store': store,
+            'sse_enabled': sse,
+            'stats_provider': staticmethod(stats_provider) if stats_provider else None,
+            'memory_monitor': memory_monitor,
+        })
+        self.httpd = ThreadingHTTPServer((host, port), handler)
+        self.httpd.daemon_threads = True
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self.httpd.serve_forever, name='read-api', daemon=True)
+        self.thread.start()
+        host, port = self.httpd.server_address[:2]
+        print(f"Read API listening on http://{host}:{port}")
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
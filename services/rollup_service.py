@@ -0,0 +1,197 @@
+import threading
+import time
+from services.entity_diff import ENTITY_KEYS, entity_key
+from services.memory_service import approx_size
+
+DEFAULT_BUCKET_SECONDS = (60, 3600)
+
+# Absolute timestamps inside the structures are not meaningful to average
+SKIP_FIELDS = {"Timestamp", "CutStartTime", "CutEndTime", "SortStartTime", "SortEndTime"}
+
+# Counters that accumulate over a run or plate (both spellings of renamed fields, see
+# opcua_structures.FIELD_ALIASES). Adding every polled value of these would count the
+# same seconds and break-offs again on every read, so their buckets aggregate the
+# increase since the previous read of the same element instead.
+CUMULATIVE_FIELDS = {"ActualCutTime", "ActualStopTime", "ActualWaitTime", "CuttingTime", "SystemWaitTime", "StopTime",
+                     "OperateEvent", "OperateEvents", "OperateStops", "SystemEvents", "SystemStops", "BreakOffs"}
+
+# Every poll adds the value it read, so for other fields sum_value is the sum over
+# samples, not over events: for a value that is read again unchanged (the RunInfo of
+# finished runs), use max_value or sum_value / sample_count, or leave the field out
+# with the skip_fields setting.
+
+def rollup_table_name(bucket_seconds):
+    '''
+    Returns the rollup table used for a bucket width, e.g. opcua_rollup_1m for
+    60 seconds and opcua_rollup_1h for 3600 seconds.
+    '''
+    bucket_seconds = int(bucket_seconds)
+    if bucket_seconds % 3600 == 0:
+        return f"opcua_rollup_{bucket_seconds // 3600}h"
+    if bucket_seconds % 60 == 0:
+        return f"opcua_rollup_{bucket_seconds // 60}m"
+    return f"opcua_rollup_{bucket_seconds}s"
+
+def numeric_fields(value, skip_fields=SKIP_FIELDS):
+    '''
+    Yields (field, number) pairs for every numeric value in a sample.
+
+    Plain numbers use the empty field name, decoded structures yield one pair
+    per numeric member and arrays of structures yield the members of every
+    element, so e.g. ActualCutTime of all runs in a list lands in one bucket.
+    '''
+    if isinstance(value, bool):
+        return
+    if isinstance(value, (int, float)):
+        yield "", float(value)
+    elif isinstance(value, dict):
+        for field, item in value.items():
+            if field in skip_fields or isinstance(item, bool):
+                continue
+            if isinstance(item, (int, float)):
+                yield field, float(item)
+    elif isinstance(value, list):
+        for element in value:
+            if isinstance(element, dict):
+                yield from numeric_fields(element, skip_fields)
+
+def element_fields(value, datatype_name=None, skip_fields=SKIP_FIELDS):
+    '''
+    Like numeric_fields, but yields (element, field, number) triples where
+    element identifies the array element a number belongs to: its entity key
+    (see entity_diff.ENTITY_KEYS), its index if it has none, or None for
+    values that are not arrays.
+    '''
+    if not isinstance(value, list):
+        for field, number in numeric_fields(value, skip_fields):
+            yield None, field, number
+        return
+    for index, element in enumerate(value):
+        if not isinstance(element, dict):
+            continue
+        key = entity_key(datatype_name, element) if datatype_name in ENTITY_KEYS else None
+        for field, number in numeric_fields(element, skip_fields):
+            yield (index if key is None else key), field, number
+
+def rollup_record(row):
+    '''
+    Turns a row returned by RollupAggregator.flush() into a pipeline record of
+    kind 'rollup', timestamped with the bucket start.
+    '''
+    width, bucket_start, server_name, node_id, field, count, total, low, high = row
+    aggregate = {"bucket_seconds": width, "field": field, "count": count, "sum": total, "min": low, "max": high}
+    return {
+        "kind": "rollup",
+        "server_name": server_name,
+        "node_id": node_id,
+        "datatype_name": None,
+        "timestamp": bucket_start,
+        "entity_key": (width, bucket_start, field),
+        "value": aggregate,
+        "decoded": aggregate,
+        "raw": None,
+    }
+
+class RollupAggregator:
+    '''
+    Keeps incremental count/sum/min/max aggregates per time bucket, node and
+    numeric field. Samples are added as they are read, and buckets whose time
+    window has passed are handed out by flush() to be bulk-written.
+    skip_fields are structure members left out in addition to SKIP_FIELDS;
+    cumulative_fields are counters aggregated as increases in addition to
+    CUMULATIVE_FIELDS. The first read of a node after start only sets the
+    baseline of its counters, an element that appears later starts from zero
+    and a counter that went down is taken as restarted.
+    '''
+    def __init__(self, bucket_seconds=DEFAULT_BUCKET_SECONDS, skip_fields=(), cumulative_fields=()):
+        self.bucket_seconds = tuple(int(b) for b in bucket_seconds)
+        self.skip_fields = SKIP_FIELDS | set(skip_fields)
+        self.cumulative_fields = CUMULATIVE_FIELDS | set(cumulative_fields)
+        self.buckets = {}  # (width, bucket_start, server_name, node_id, field) -> [count, sum, min, max]
+        self.counters = {}  # (server_name, node_id) -> {(element, field): value} of the last read
+        self.lock = threading.Lock()
+        self.dropped = 0  # Buckets given up by shed()
+
+    def add(self, server_name, node_id, value, timestamp=None, datatype_name=None):
+        if timestamp is None:
+            timestamp = time.time()
+        node = (server_name, node_id)
+        with self.lock:
+            previous = self.counters.get(node)
+            counters = {}
+            fields = []
+            for element, field, number in element_fields(value, datatype_name, self.skip_fields):
+                if field in self.cumulative_fields:
+                    counters[(element, field)] = number
+                    if previous is None:
+                        continue
+                    last = previous.get((element, field), 0.0)
+                    number = number - last if number >= last else number
+                fields.append((field, number))
+            # Replaced on every read, so finished runs that left the array are forgotten
+            if counters or previous is not None:
+                self.counters[node] = counters
+            for width in self.bucket_seconds:
+                bucket_start = int(timestamp // width) * width
+                for field, number in fields:
+                    key = (width, bucket_start, server_name, node_id, field)
+                    agg = self.buckets.get(key)
+                    if agg is None:
+                        self.buckets[key] = [1, number, number, number]
+                    else:
+                        agg[0] += 1
+                        agg[1] += number
+                        if number < agg[2]:
+                            agg[2] = number
+                        if number > agg[3]:
+                            agg[3] = number
+
+    def flush(self, now=None, force=False):
+        '''
+        Removes and returns closed buckets.
+
+        Parameters
+        ----------
+        now: Epoch seconds used to decide which buckets are closed, defaults to the current time.
+        force: Also return buckets that are still open, e.g. on shutdown.
+
+        Returns
+        -------
+        rows: A list of (bucket_seconds, bucket_start, server_name, node_id, field, count, sum, min, max) tuples.
+        '''
+        if now is None:
+            now = time.time()
+        rows = []
+        with self.lock:
+            for key in list(self.buckets):
+                width, bucket_start = key[0], key[1]
+                if force or bucket_start + width <= now:
+                    rows.append(key + tuple(self.buckets.pop(key)))
+        return rows
+
+    def memory_bytes(self):
+        '''Approximate size of the buckets not flushed yet and the last counter values.'''
+        with self.lock:
+            return approx_size(self.buckets) + approx_size(self.counters)
+
+    def shed(self, fraction):
+        '''Drops the oldest fraction of the buckets, counting them as dropped.'''
+        with self.lock:
+            oldest = sorted(self.buckets, key=lambda key: key[1])[:int(len(self.buckets) * fraction)]
+            for key in oldest:
+                del self.buckets[key]
+            self.dropped += len(oldest)
+
+    def stats(self):
+        with self.lock:
+            return {"buckets": len(self.buckets), "dropped": self.dropped}
+
+def build_aggregator(config):
+    '''
+    Returns a RollupAggregator for the "rollups" config section, or None when
+    rollups are disabled.
+    '''
+    if not config.get('enabled', True):
+        return None
+    return RollupAggregator(config.get('bucket_seconds', DEFAULT_BUCKET_SECONDS), config.get('skip_fields', ()),
+                            config.get('cumulative_fields', ()))
@@ -0,0 +1,156 @@
+import heapq
+import math
+import threading
+import time
+from services.memory_service import approx_size
+
+DEFAULT_TICK = 0.25  # seconds; due times are rounded to this grid so nodes batch together
+
+class PollScheduler:
+    '''
+    Single priority-queue scheduler for every polled node of every server.
+
+    Each node has its own interval. due() pops every node whose deadline has
+    passed and groups them per server, so nodes that share a tick are read in
+    one batched request. Deadlines advance on a fixed grid (due + interval
+    instead of now + interval) so slow reads do not accumulate drift; when a
+    node is late by more than a full interval the missed deadlines are counted
+    and skipped instead of being caught up in a burst.
+
+    A node with max_interval greater than its interval is adaptive: while its
+    value does not change the interval doubles up to max_interval, and the
+    first change snaps it back to the configured interval.
+    '''
+    def __init__(self, tick=DEFAULT_TICK):
+        self.tick = tick
+        self.heap = []  # (due, seq, key)
+        self.seq = 0
+        self.nodes = {}  # (server_name, node_id) -> state dict
+        self.paused = set()
+        self.lock = threading.Lock()
+
+    def _align(self, t):
+        return math.ceil(t / self.tick) * self.tick
+
+    def _push(self, key, due):
+        state = self.nodes[key]
+        state['due'] = due
+        self.seq += 1
+        state['seq'] = self.seq
+        heapq.heappush(self.heap, (due, self.seq, key))
+
+    def add(self, server_name, node_id, interval, max_interval=None, now=None):
+        '''Schedules a node, or changes its interval if it is already scheduled.'''
+        if now is None:
+            now = time.monotonic()
+        key = (server_name, node_id)
+        with self.lock:
+            state = self.nodes.get(key)
+            if state is None:
+                state = {'last_value': None, 'has_value': False, 'missed': 0, 'reads': 0,
+                         'lateness_total': 0.0, 'lateness_max': 0.0}
+                self.nodes[key] = state
+                due = self._align(now)
+            else:
+                due = self._align(min(state['due'], now + interval))
+            state['interval'] = float(interval)
+            state['base_interval'] = float(interval)
+            state['max_interval'] = float(max(max_interval or interval, interval))
+            self._push(key, due)
+
+    def remove(self, server_name, node_id=None):
+        '''Unschedules one node, or every node of a server when node_id is None.'''
+        with self.lock:
+            for key in [k for k in self.nodes if k[0] == server_name and (node_id is None or k[1] == node_id)]:
+                del self.nodes[key]  # The heap entry is discarded lazily by due()
+            if node_id is None:
+                self.paused.discard(server_name)
+
+    def pause(self, server_name):
+        with self.lock:
+            self.paused.add(server_name)
+
+    def resume(self, server_name, now=None):
+        '''Resumes a paused server and makes all of its nodes due immediately.'''
+        if now is None:
+            now = time.monotonic()
+        with self.lock:
+            self.paused.discard(server_name)
+            for key in [k for k in self.nodes if k[0] == server_name]:
+                self._push(key, self._align(now))
+
+    def due(self, now=None):
+        '''
+        Returns a dict of server_name -> list of node_ids whose deadline has passed
+        and schedules their next deadline.
+        '''
+        if now is None:
+            now = time.monotonic()
+        batches = {}
+        with self.lock:
+            while self.heap and self.heap[0][0] <= now:
+                due, seq, key = heapq.heappop(self.heap)
+                state = self.nodes.get(key)
+                if state is None or state['seq'] != seq:
+                    continue  # Removed or rescheduled since this entry was pushed
+                if key[0] in self.paused:
+                    # Park it; resume() pushes a fresh deadline
+                    state['seq'] = None
+                    continue
+                lateness = now - due
+                state['reads'] += 1
+                state['lateness_total'] += lateness
+                state['lateness_max'] = max(state['lateness_max'], lateness)
+                next_due = due + state['interval']
+                if next_due <= now:
+                    skipped = math.floor((now - due) / state['interval'])
+                    state['missed'] += skipped
+                    next_due = due + (skipped + 1) * state['interval']
+                self._push(key, next_due)
+                batches.setdefault(key[0], []).append(key[1])
+        return batches
+
+    def report(self, server_name, node_id, value):
+        '''Feeds a read value back so adaptive nodes can slow down while it is static.'''
+        key = (server_name, node_id)
+        with self.lock:
+            state = self.nodes.get(key)
+            if state is None:
+                return
+            changed = not state['has_value'] or state['last_value'] != value
+            state['last_value'] = value
+            state['has_value'] = True
+            if state['max_interval'] <= state['base_interval']:
+                return
+            if changed:
+                new_interval = state['base_interval']
+            else:
+                new_interval = min(state['interval'] * 2, state['max_interval'])
+            if new_interval == state['interval']:
+                return
+            old_interval = state['interval']
+            state['interval'] = new_interval
+            if changed and state['seq'] is not None:
+                # Pull the already scheduled deadline in to the configured interval
+                self._push(key, state['due'] - old_interval + new_interval)
+
+    def memory_bytes(self):
+        '''Approximate size of the node states, including the last value kept for adaptive polling.'''
+        with self.lock:
+            return approx_size(self.nodes) + approx_size(self.heap)
+
+    def stats(self):
+        '''Per-node interval, read count, missed deadlines and lateness (seconds) for monitoring.'''
+        with self.lock:
+            result = {}
+            for (server_name, node_id), state in self.nodes.items():
+                reads = state['reads']
+                result.setdefault(server_name, {})[node_id] = {
+                    'interval': state['interval'],
+                    'reads': reads,
+                    'missed': state['missed'],
+                    'lateness_avg': state['lateness_total'] / reads if reads else 0.0,
+                    'lateness_max': state['lateness_max'],
+                    'paused': server_name in self.paused,
+                }
+            return result
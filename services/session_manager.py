@@ -0,0 +1,140 @@
+import threading
+import time
+from services.opcua_service import OPCUAService, DEFAULT_TIMEOUT
+
+# Process-wide pool of OPC UA sessions. Opening a secure channel and session
+# takes seconds on the laser controllers, so the collectors and the dialogs
+# share one connected OPCUAService per (url, security) instead of each
+# opening their own. Sessions are reference counted: release() does not
+# disconnect, it only starts the idle clock, and a housekeeping thread closes
+# sessions that stayed unused for idle_timeout seconds. The same thread reads
+# the server state every keepalive_interval seconds, so a dead session is
+# noticed and dropped before the next user gets it.
+
+DEFAULT_IDLE_TIMEOUT = 120  # seconds
+DEFAULT_KEEPALIVE_INTERVAL = 30  # seconds
+
+class SessionManager:
+    def __init__(self, idle_timeout=DEFAULT_IDLE_TIMEOUT, keepalive_interval=DEFAULT_KEEPALIVE_INTERVAL):
+        self.idle_timeout = idle_timeout
+        self.keepalive_interval = keepalive_interval
+        self.lock = threading.Lock()
+        self.sessions = {}  # (url, security) -> entry dict
+        self.connecting = {}  # (url, security) -> Lock held while that session is being opened
+        self.thread = None
+        self.stopped = threading.Event()
+        self.connects = 0
+        self.reuses = 0
+
+    def _ensure_thread(self):
+        if self.thread is None or not self.thread.is_alive():
+            self.stopped.clear()
+            self.thread = threading.Thread(target=self._housekeeping, name='opcua-sessions', daemon=True)
+            self.thread.start()
+
+    def acquire(self, url, timeout=DEFAULT_TIMEOUT, security=None):
+        '''
+        Returns a connected OPCUAService for url, opening a session only if no
+        usable one exists. Every acquire must be paired with a release().
+        Blocks while another thread is opening the same session.
+        '''
+        key = (url, security or None)
+        with self.lock:
+            connect_lock = self.connecting.setdefault(key, threading.Lock())
+        # One handshake per key; concurrent callers wait for it and share the result
+        with connect_lock:
+            with self.lock:
+                entry = self.sessions.get(key)
+                if entry is not None and entry['service'].client is not None:
+                    entry['refs'] += 1
+                    entry['idle_since'] = None
+                    self.reuses += 1
+                    return entry['service']
+            service = OPCUAService(url, timeout=timeout, security=security)
+            service.connect()
+            with self.lock:
+                self.sessions[key] = {'service': service, 'refs': 1, 'idle_since': None, 'last_check': time.monotonic()}
+                self.connects += 1
+                self._ensure_thread()
+            return service
+
+    def release(self, service):
+        '''Gives a session back. It stays open for idle_timeout seconds in case it is needed again.'''
+        with self.lock:
+            entry = self._entry_of(service)
+            if entry is None:
+                return  # Already invalidated
+            entry['refs'] = max(entry['refs'] - 1, 0)
+            if entry['refs'] == 0:
+                entry['idle_since'] = time.monotonic()
+
+    def invalidate(self, service):
+        '''
+        Drops a session after a communication error so the next acquire opens a
+        new one. Other holders keep their reference; their next request fails and
+        they go through their own reconnect handling.
+        '''
+        with self.lock:
+            key = next((k for k, e in self.sessions.items() if e['service'] is service), None)
+            if key is not None:
+                del self.sessions[key]
+        self._close(service)
+
+    def _entry_of(self, service):
+        for entry in self.sessions.values():
+            if entry['service'] is service:
+                return entry
+        return None
+
+    def _close(self, service):
+        try:
+            service.disconnect()
+        except Exception:
+            service.client = None
+
+    def _housekeeping(self):
+        while not self.stopped.wait(min(self.keepalive_interval, self.idle_timeout, 5)):
+            now = time.monotonic()
+            to_close = []
+            to_check = []
+            with self.lock:
+                for key, entry in list(self.sessions.items()):
+                    if entry['refs'] == 0 and entry['idle_since'] is not None and now - entry['idle_since'] >= self.idle_timeout:
+                        del self.sessions[key]
+                        to_close.append(entry['service'])
+                    elif now - entry['last_check'] >= self.keepalive_interval:
+                        entry['last_check'] = now
+                        to_check.append(entry['service'])
+            for service in to_close:
+                self._close(service)
+            for service in to_check:
+                try:
+                    service.get_server_state()
+                except Exception as e:
+                    print(f"Session to {service.url} is no longer usable: {e}")
+                    self.invalidate(service)
+
+    def close_all(self):
+        self.stopped.set()
+        with self.lock:
+            services = [entry['service'] for entry in self.sessions.values()]
+            self.sessions.clear()
+        for service in services:
+            self._close(service)
+
+    def stats(self):
+        now = time.monotonic()
+        with self.lock:
+            return {
+                'connects': self.connects,
+                'reuses': self.reuses,
+                'sessions': [{
+                    'url': key[0],
+                    'secure': key[1] is not None,
+                    'refs': entry['refs'],
+                    'idle_seconds': round(now - entry['idle_since'], 1) if entry['idle_since'] is not None else 0,
+                } for key, entry in self.sessions.items()],
+            }
+
+# Shared by the whole process
+sessions = SessionManager()
@@ -0,0 +1,273 @@
+import argparse
+import os
+import random
+import struct
+import time
+from opcua import Server, ua
+
+# Simulated laser OPC UA server for soak tests and trying the collector without
+# a machine. It exposes the structure nodes the collector decodes
+# (Work.CurrentPlans, Work.CurrentRun, Work.RunStates,
+# Work.PlateOperatingData) with bodies in the layouts of opcua_structures,
+# plus a few scalar Machine.* nodes. Every interval runs move through their
+# states, plates are cut, plans change and are replaced, so the decode,
+# entity diff and lifecycle paths all see realistic churn. The server also
+# publishes an OPC Binary type dictionary for the structures, so the collector
+# uses generated decoders unless a server is configured with
+# "generated_decoders": false. The dictionary spells some fields differently
+# from the hand-written classes (DICTIONARY_NAMES) and declares enums, like the
+# machines do, so both sets of names are exercised.
+#
+# python -m services.simulator --port 4841 --plans 200
+
+DEFAULT_PORT = 4841
+NAMESPACE = 'urn:wic-opcua-logger:simulator'
+
+# Node ids as the collector is configured with them; the simulator's namespace is always ns=2
+SIMULATED_NODES = [
+    'ns=2;s=Work.CurrentPlans',
+    'ns=2;s=Work.CurrentRun',
+    'ns=2;s=Work.RunStates',
+    'ns=2;s=Work.PlateOperatingData',
+    'ns=2;s=Machine.LaserPower',
+    'ns=2;s=Machine.State',
+    'ns=2;s=Machine.PartCounter',
+]
+
+# OPC UA DateTime ticks (100 ns since 1601-01-01) at the Unix epoch
+EPOCH_TICKS = 116444736000000000
+
+# Field layouts, in the order opcua_structures reads them
+LAYOUTS = {
+    'PlanInfo': [
+        ('JobGuid', 'guid'), ('PlanGuid', 'guid'), ('Name', 'string'), ('Description', 'string'),
+        ('SizeX', 'double'), ('SizeY', 'double'), ('TotalRuns', 'uint32'), ('TotalParts', 'uint32'),
+        ('PlanState', 'int32'), ('EstimatedCutTime', 'double'), ('MaterialFormat', 'int32'),
+        ('MaterialName', 'string'), ('MaterialSizeX', 'double'), ('MaterialSizeY', 'double'),
+        ('MaterialThickness', 'double'), ('TubeProfile', 'int32'), ('ProfileDimA', 'double'),
+        ('ProfileDimB', 'double'), ('ProfileDimC', 'double'), ('Weight', 'double'), ('Waste', 'double'),
+        ('ArticleInfo', 'string'), ('ChargeInfo', 'string'), ('MaterialInfo1', 'string'),
+        ('MaterialInfo2', 'string'), ('MaterialInfo3', 'string'), ('ParamterFile', 'string'),
+        ('SpacerPlateInfo', 'string'),
+    ],
+    'RunInfo': [
+        ('JobGuid', 'guid'), ('PlanGuid', 'guid'), ('RunGuid', 'guid'), ('SortGuid', 'guid'),
+        ('RunNumber', 'int32'), ('CutState', 'int32'), ('CutStartTime', 'utctime'), ('CutEndTime', 'utctime'),
+        ('SortState', 'int32'), ('SortStartTime', 'utctime'), ('SortEndTime', 'utctime'),
+        ('ActualCutTime', 'double'), ('ActualStopTime', 'double'), ('ActualWaitTime', 'double'),
+        ('SheetOffsetX', 'double'), ('SheetOffsetY', 'double'), ('SheetAngle', 'double'),
+        ('ChargeInfo', 'string'), ('StorageInfo1', 'string'), ('StorageInfo2', 'string'), ('StorageInfo3', 'string'),
+    ],
+    'RunStates': [
+        ('Timestamp', 'utctime'), ('JobGuid', 'guid'), ('PlanGuid', 'guid'), ('RunGuid', 'guid'),
+        ('RunName', 'string'), ('CurrentState', 'string'), ('NextState', 'string'),
+    ],
+    'PlateOperatingData': [
+        ('Timestamp', 'utctime'), ('PlateGuid', 'guid'), ('PlateStae', 'int32'), ('CuttingTime', 'double'),
+        ('SystemWaitTime', 'double'), ('StopTime', 'double'), ('OperateEvent', 'int32'), ('OperateStops', 'int32'),
+        ('SystemEvents', 'int32'), ('SystemStops', 'int32'), ('BreakOffs', 'int32'),
+    ],
+}
+
+RUN_STATES = ['Waiting', 'Cutting', 'Sorting', 'Completed']
+
+# Field name in LAYOUTS -> name in the type dictionary
+DICTIONARY_NAMES = {'PlateStae': 'PlateState', 'OperateEvent': 'OperateEvents'}
+
+# int32 fields declared as enums in the type dictionary
+ENUMS = {'PartCutState': {0: 'Undefined', 1: 'CutCompleted', 2: 'CutCompletedWithBreaks', 3: 'CutAborted'}}
+ENUM_FIELDS = {('RunInfo', 'CutState'): 'PartCutState', ('PlateOperatingData', 'PlateStae'): 'PartCutState'}
+
+DICTIONARY_TYPES = {'guid': 'opc:Guid', 'string': 'opc:String', 'uint32': 'opc:UInt32', 'int32': 'opc:Int32',
+                    'double': 'opc:Double', 'utctime': 'opc:DateTime'}
+
+def type_dictionary():
+    '''Returns the OPC Binary type dictionary (XML bytes) describing LAYOUTS.'''
+    lines = ['<opc:TypeDictionary xmlns:opc="http://opcfoundation.org/BinarySchema/" '
+             f'xmlns:ua="http://opcfoundation.org/UA/" xmlns:tns="{NAMESPACE}" '
+             f'DefaultByteOrder="LittleEndian" TargetNamespace="{NAMESPACE}">']
+    for enum, values in ENUMS.items():
+        lines.append(f'  <opc:EnumeratedType Name="{enum}" LengthInBits="32">')
+        lines.extend(f'    <opc:EnumeratedValue Name="{name}" Value="{value}"/>' for value, name in values.items())
+        lines.append('  </opc:EnumeratedType>')
+    for datatype_name, layout in LAYOUTS.items():
+        lines.append(f'  <opc:StructuredType Name="{datatype_name}" BaseType="ua:ExtensionObject">')
+        for field, kind in layout:
+            enum = ENUM_FIELDS.get((datatype_name, field))
+            type_name = f'tns:{enum}' if enum else DICTIONARY_TYPES[kind]
+            lines.append(f'    <opc:Field Name="{DICTIONARY_NAMES.get(field, field)}" TypeName="{type_name}"/>')
+        lines.append('  </opc:StructuredType>')
+    lines.append('</opc:TypeDictionary>')
+    return '\n'.join(lines).encode('utf-8')
+
+def to_ticks(timestamp):
+    return int(timestamp * 1e7) + EPOCH_TICKS
+
+def encode(datatype_name, values):
+    '''Encodes a dict as the binary body of a datatype_name structure; missing fields are zero or empty.'''
+    parts = []
+    for field, kind in LAYOUTS[datatype_name]:
+        value = values.get(field)
+        if kind == 'guid':
+            parts.append(value or bytes(16))
+        elif kind == 'string':
+            data = (value or '').encode('utf-8')
+            parts.append(struct.pack('<i', len(data)) + data)
+        elif kind == 'uint32':
+            parts.append(struct.pack('<I', value or 0))
+        elif kind == 'int32':
+            parts.append(struct.pack('<i', value or 0))
+        elif kind == 'double':
+            parts.append(struct.pack('<d', value or 0.0))
+        elif kind == 'utctime':
+            parts.append(struct.pack('<Q', value or 0))
+    return b''.join(parts)
+
+class SimulatedServer:
+    def __init__(self, port=DEFAULT_PORT, plans=50, seed=None):
+        self.random = random.Random(seed)
+        self.server = Server()
+        self.server.set_endpoint(f'opc.tcp://0.0.0.0:{port}/')
+        self.server.set_server_name('WIC OPC UA Logger simulator')
+        self.idx = self.server.register_namespace(NAMESPACE)
+        structure = self.server.get_node(ua.ObjectIds.Structure)
+        self.datatypes = {name: structure.add_data_type(ua.NodeId(name, self.idx), f'{self.idx}:{name}').nodeid for name in LAYOUTS}
+        type_system = self.server.get_node(ua.ObjectIds.OPCBinarySchema_TypeSystem)
+        type_system.add_variable(ua.NodeId('TypeDictionary', self.idx), f'{self.idx}:TypeDictionary',
+                                 type_dictionary(), ua.VariantType.ByteString)
+        objects = self.server.get_objects_node()
+        work = objects.add_object(ua.NodeId('Work', self.idx), 'Work')
+        machine = objects.add_object(ua.NodeId('Machine', self.idx), 'Machine')
+        self.plans = [self._new_plan(i) for i in range(plans)]
+        self.plan_serial = plans
+        self.run = None
+        self.run_serial = 0
+        self.plate = None
+        self.parts = 0
+        self.variables = {
+            'Work.CurrentPlans': self._structure_variable(work, 'Work.CurrentPlans', 'PlanInfo', []),
+            'Work.CurrentRun': self._structure_variable(work, 'Work.CurrentRun', 'RunInfo', None),
+            'Work.RunStates': self._structure_variable(work, 'Work.RunStates', 'RunStates', None),
+            'Work.PlateOperatingData': self._structure_variable(work, 'Work.PlateOperatingData', 'PlateOperatingData', None),
+            'Machine.LaserPower': machine.add_variable(ua.NodeId('Machine.LaserPower', self.idx), 'LaserPower', 0.0),
+            'Machine.State': machine.add_variable(ua.NodeId('Machine.State', self.idx), 'State', 'Idle'),
+            'Machine.PartCounter': machine.add_variable(ua.NodeId('Machine.PartCounter', self.idx), 'PartCounter',
+                                                        0, ua.VariantType.UInt32),
+        }
+        self.update()
+
+    def _extension_object(self, datatype_name, values):
+        value = ua.ExtensionObject()
+        value.TypeId = self.datatypes[datatype_name]
+        value.Encoding = 1  # Binary body
+        value.Body = encode(datatype_name, values)
+        return value
+
+    def _structure_variable(self, parent, node_id, datatype_name, values):
+        if values is None:
+            value = self._extension_object(datatype_name, {})
+        else:
+            value = [self._extension_object(datatype_name, v) for v in values]
+        return parent.add_variable(ua.NodeId(node_id, self.idx), node_id.split('.')[1], value,
+                                   ua.VariantType.ExtensionObject, self.datatypes[datatype_name])
+
+    def _guid(self):
+        return self.random.getrandbits(128).to_bytes(16, 'little')
+
+    def _new_plan(self, serial):
+        return {
+            'JobGuid': self._guid(), 'PlanGuid': self._guid(), 'Name': f'Plan {serial}',
+            'Description': f'Simulated plan {serial}', 'SizeX': 3000.0, 'SizeY': 1500.0,
+            'TotalRuns': self.random.randint(1, 20), 'TotalParts': self.random.randint(1, 400),
+            'EstimatedCutTime': self.random.uniform(60, 7200), 'MaterialName': 'S235JR',
+            'MaterialSizeX': 3000.0, 'MaterialSizeY': 1500.0, 'MaterialThickness': self.random.choice([2.0, 5.0, 10.0]),
+            'Weight': self.random.uniform(50, 500), 'Waste': self.random.uniform(0, 30),
+            'ArticleInfo': f'ART-{serial:06d}', 'ParamterFile': 'default.lpf',
+        }
+
+    def _advance_run(self, now):
+        if self.run is None or self.run['state'] == 'Completed':
+            self.run_serial += 1
+            plan = self.random.choice(self.plans) if self.plans else {}
+            self.run = {'JobGuid': plan.get('JobGuid'), 'PlanGuid': plan.get('PlanGuid'), 'RunGuid': self._guid(),
+                        'SortGuid': self._guid(), 'RunNumber': self.run_serial, 'state': RUN_STATES[0]}
+        elif self.random.random() < 0.3:
+            state = RUN_STATES[RUN_STATES.index(self.run['state']) + 1]
+            self.run['state'] = state
+            if state == 'Cutting':
+                self.run['CutStartTime'] = to_ticks(now)
+            elif state == 'Sorting':
+                self.run['CutEndTime'] = self.run['SortStartTime'] = to_ticks(now)
+                self.run['ActualCutTime'] = (self.run['CutEndTime'] - self.run['CutStartTime']) / 1e7
+                self.run['CutState'] = 1
+            elif state == 'Completed':
+                self.run['SortEndTime'] = to_ticks(now)
+                self.run['SortState'] = 1
+        state = self.run['state']
+        next_state = RUN_STATES[min(RUN_STATES.index(state) + 1, len(RUN_STATES) - 1)]
+        return dict(self.run, Timestamp=to_ticks(now), RunName=f'Run {self.run_serial}',
+                    CurrentState=state, NextState=next_state)
+
+    def _advance_plate(self, now, interval):
+        if self.plate is None or self.plate['PlateStae']:
+            self.plate = {'PlateGuid': self._guid(), 'PlateStae': 0}
+        self.plate['CuttingTime'] = self.plate.get('CuttingTime', 0.0) + interval
+        self.plate['OperateEvent'] = self.plate.get('OperateEvent', 0) + self.random.randint(0, 2)
+        if self.random.random() < 0.1:
+            self.plate['PlateStae'] = self.random.choice([1, 1, 1, 2, 3])
+        return dict(self.plate, Timestamp=to_ticks(now))
+
+    def _advance_plans(self):
+        for plan in self.random.sample(self.plans, min(len(self.plans), 3)):
+            plan['PlanState'] = (plan.get('PlanState', 0) + 1) % 5
+            plan['EstimatedCutTime'] = max(plan['EstimatedCutTime'] - self.random.uniform(0, 60), 0.0)
+        if self.plans and self.random.random() < 0.2:
+            # A finished plan leaves the list and a new one is scheduled
+            self.plans.pop(self.random.randrange(len(self.plans)))
+            self.plans.append(self._new_plan(self.plan_serial))
+            self.plan_serial += 1
+
+    def update(self, interval=1.0):
+        now = time.time()
+        self._advance_plans()
+        run_state = self._advance_run(now)
+        plate = self._advance_plate(now, interval)
+        cutting = run_state['CurrentState'] == 'Cutting'
+        self.parts += self.random.randint(0, 3) if cutting else 0
+        variables = self.variables
+        variables['Work.CurrentPlans'].set_value([self._extension_object('PlanInfo', p) for p in self.plans],
+                                                 ua.VariantType.ExtensionObject)
+        variables['Work.CurrentRun'].set_value(self._extension_object('RunInfo', self.run), ua.VariantType.ExtensionObject)
+        variables['Work.RunStates'].set_value(self._extension_object('RunStates', run_state), ua.VariantType.ExtensionObject)
+        variables['Work.PlateOperatingData'].set_value(self._extension_object('PlateOperatingData', plate),
+                                                       ua.VariantType.ExtensionObject)
+        variables['Machine.LaserPower'].set_value(self.random.uniform(3000, 6000) if cutting else 0.0)
+        variables['Machine.State'].set_value(run_state['CurrentState'])
+        variables['Machine.PartCounter'].set_value(self.parts, ua.VariantType.UInt32)
+
+    def start(self):
+        self.server.start()
+
+    def stop(self):
+        self.server.stop()
+
+    def run_forever(self, interval=1.0):
+        self.start()
+        print(f"Simulator listening on {self.server.endpoint.geturl()} (pid {os.getpid()})", flush=True)
+        try:
+            while True:
+                time.sleep(interval)
+                self.update(interval)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.stop()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run a simulated laser OPC UA server.')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    parser.add_argument('--plans', type=int, default=50, help='Number of elements in Work.CurrentPlans')
+    parser.add_argument('--interval', type=float, default=1.0, help='Seconds between value updates')
+    parser.add_argument('--seed', type=int, help='Random seed for reproducible values')
+    args = parser.parse_args()
+    SimulatedServer(args.port, args.plans, args.seed).run_forever(args.interval)
@@ -0,0 +1,488 @@
+import base64
+import json
+import os
+import sys
+import threading
+import time
+from datetime import datetime
+from services.pipeline import BoundedQueue, DROP_OLDEST
+from services.memory_service import approx_size
+from services.archive import (ArchiveWriter, entity_value, DEFAULT_ARCHIVE_DIRECTORY, DEFAULT_WINDOW,
+                              DEFAULT_MAX_POINTS, DEFAULT_MAX_AGE)
+from services.postgres_service import PostgresService, DEFAULT_LAYOUT, DEFAULT_WRITE_METHOD
+
+# Destinations for decoded records. Every sink has its own bounded queue,
+# batch size, retry policy and writer thread, and the decode stage only puts
+# records on the sink queues, so a slow or failing sink drops its own oldest
+# records (or whatever its overload policy says) without delaying the other
+# sinks or the poll loop.
+#
+# Records are the dicts built by pipeline.decode_sample; record['kind'] tells
+# sinks what they are ('sample' for polled values, 'entity' for changed
+# elements of structure arrays, see entity_diff, 'run_summary' and
+# 'plate_summary' for finished runs and plates, see lifecycle, 'rollup' for
+# closed rollup buckets, see rollup_service). Sinks only receive the kinds
+# they accept.
+
+DEFAULT_SINK_CONFIG = {
+    'queue': {'size': 5000, 'policy': DROP_OLDEST},
+    'batch': 200,
+    'retry_interval': 5.0,
+    'max_retries': None,  # None retries a failing batch until it is written
+    'block_timeout': 1.0,
+}
+
+class Sink:
+    '''
+    Base class: subclasses implement write(records) and optionally open(),
+    close() and idle() (called about twice a second from the sink thread).
+    write() raising an exception keeps the batch and retries it after
+    retry_interval, up to max_retries times.
+    '''
+    kinds = None  # Record kinds this sink accepts, None for all
+
+    def __init__(self, name, config=None):
+        config = dict(DEFAULT_SINK_CONFIG, **(config or {}))
+        queue_config = dict(DEFAULT_SINK_CONFIG['queue'], **config['queue'])
+        self.name = name
+        self.queue = BoundedQueue(name, queue_config['size'], queue_config['policy'], config['block_timeout'])
+        self.batch_size = config['batch']
+        self.retry_interval = config['retry_interval']
+        self.max_retries = config['max_retries']
+        self.lock = threading.Lock()  # write()/close() from the sink thread and stop()
+        self.written = 0
+        self.write_errors = 0
+        self.discarded = 0  # Records given up on after max_retries
+        self.last_error = None
+        self.on_drop = None  # Called with every record dropped by the queue or discarded (see IngestPipeline)
+        self.queue.on_drop = self._dropped
+        self.running = False
+        self.thread = None
+
+    def accepts(self, record):
+        return self.kinds is None or record.get('kind', 'sample') in self.kinds
+
+    def submit(self, record):
+        if self.accepts(record):
+            self.queue.put(record, key=(record.get('kind', 'sample'), record['server_name'], record['node_id'],
+                                        record.get('entity_key')))
+
+    def write(self, records):
+        raise NotImplementedError
+
+    def _dropped(self, record):
+        if self.on_drop:
+            self.on_drop(record)
+
+    def open(self):
+        pass
+
+    def close(self):
+        pass
+
+    def idle(self):
+        pass
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self._run, name=f'sink-{self.name}', daemon=True)
+        self.thread.start()
+
+    def stop(self, timeout=5.0):
+        '''Writes what is still queued (within timeout), then closes the sink.'''
+        deadline = time.monotonic() + timeout
+        while (len(self.queue) and time.monotonic() < deadline and self.thread is not None and self.thread.is_alive()
+               and not self.last_error):
+            time.sleep(0.05)
+        self.running = False
+        if self.thread:
+            self.thread.join(max(deadline - time.monotonic(), 0.1))
+        with self.lock:
+            self.close()
+
+    def _write(self, records):
+        with self.lock:
+            self.write(records)
+        self.written += len(records)
+        self.last_error = None
+
+    def _run(self):
+        pending = []  # Batch that failed to write; retried before taking new items
+        attempts = 0
+        while self.running:
+            if not pending:
+                pending = self.queue.get_batch(self.batch_size, timeout=0.5)
+                attempts = 0
+            if pending:
+                try:
+                    self._write(pending)
+                    pending = []
+                except Exception as e:
+                    attempts += 1
+                    self.write_errors += 1
+                    self.last_error = str(e)
+                    with self.lock:
+                        self.close()
+                    if self.max_retries is not None and attempts > self.max_retries:
+                        print(f"Sink {self.name}: discarding {len(pending)} records after {attempts} attempts: {e}")
+                        self.discarded += len(pending)
+                        for record in pending:
+                            self._dropped(record)
+                        pending = []
+                    else:
+                        print(f"Sink {self.name}: failed to write {len(pending)} records, retrying in {self.retry_interval}s: {e}")
+                        time.sleep(self.retry_interval)
+            with self.lock:
+                self.idle()
+        if pending:
+            try:
+                self._write(pending)
+            except Exception as e:
+                print(f"Sink {self.name}: dropped {len(pending)} records on shutdown: {e}")
+                for record in pending:
+                    self._dropped(record)
+
+    def memory_bytes(self):
+        return self.queue.memory_bytes()
+
+    def shed(self, fraction):
+        self.queue.shed(fraction)
+
+    def stats(self):
+        return dict(self.queue.stats(), written=self.written, write_errors=self.write_errors,
+                    discarded=self.discarded, last_error=self.last_error)
+
+def record_json(record):
+    '''JSON-serializable form of a record, used by the file and stdout sinks.'''
+    result = {
+        'kind': record.get('kind', 'sample'),
+        'timestamp': datetime.fromtimestamp(record['timestamp']).isoformat(timespec='milliseconds'),
+        'server': record['server_name'],
+        'node_id': record['node_id'],
+        'datatype': record.get('datatype_name'),
+        'value': record['decoded'],
+    }
+    if record.get('kind') == 'entity':
+        result['entity_key'] = record['entity_key']
+        result['op'] = record['op']
+    if record.get('raw'):
+        type_name, type_id, schema_version, body, is_array, codecs_version = record['raw']
+        result['raw'] = {'type_name': type_name, 'type_id': type_id, 'schema_version': schema_version,
+                         'is_array': is_array, 'codecs_version': codecs_version,
+                         'body': base64.b64encode(bytes(body)).decode('ascii')}
+    return result
+
+class PostgresSink(Sink):
+    '''
+    Writes samples with PostgresService.insert_many/insert_raw_many, entity
+    changes with upsert_entities, run/plate summaries with upsert_summaries
+    and rollup buckets with insert_rollups. The type dictionaries of raw
+    bodies are stored once per version, so services.raw_decoder can decode
+    them with the same generated codecs as the live path.
+    '''
+    kinds = {'sample', 'entity', 'run_summary', 'plate_summary', 'rollup'}
+
+    def __init__(self, name='postgres', config=None, conn_str=None, layout=DEFAULT_LAYOUT,
+                 write_method=DEFAULT_WRITE_METHOD):
+        super().__init__(name, config)
+        self.conn_str = conn_str
+        self.layout = layout
+        self.write_method = write_method
+        self.pg_service = None
+        self.stored_dictionaries = set()  # Codecs versions already in opcua_type_dictionaries
+
+    def set_conn_str(self, conn_str):
+        if conn_str != self.conn_str:
+            with self.lock:
+                self.close()
+                self.conn_str = conn_str
+                self.last_error = None
+
+    def open(self):
+        if self.pg_service and self.pg_service.conn:
+            return self.pg_service
+        if not self.conn_str:
+            raise Exception('No database connection configured')
+        pg_service = PostgresService(self.conn_str, layout=self.layout, write_method=self.write_method)
+        pg_service.connect()
+        self.pg_service = pg_service
+        return pg_service
+
+    def close(self):
+        if self.pg_service:
+            try:
+                self.pg_service.disconnect()
+            except Exception:
+                pass
+            self.pg_service = None
+
+    def write(self, records):
+        pg_service = self.open()
+        samples = [r for r in records if r.get('kind', 'sample') == 'sample']
+        rows = [(r['node_id'], r['value'], r['server_name'], r['timestamp']) for r in samples if r['raw'] is None]
+        raw_rows = [(r['node_id'],) + r['raw'] + (r['server_name'], r['timestamp']) for r in samples if r['raw'] is not None]
+        dictionaries = {r['codecs'].version: r['codecs'].dictionaries for r in samples
+                        if r['raw'] is not None and r.get('codecs') and r['codecs'].version not in self.stored_dictionaries}
+        entity_rows = [(r['datatype_name'], r['server_name'], r['entity_key'], r['node_id'], r['value'], r['timestamp'],
+                        r['op'] == 'remove') for r in records if r.get('kind') == 'entity']
+        rollup_rows = [(r['value']['bucket_seconds'], r['timestamp'], r['server_name'], r['node_id'], r['value']['field'],
+                        r['value']['count'], r['value']['sum'], r['value']['min'], r['value']['max'])
+                       for r in records if r.get('kind') == 'rollup']
+        # One transaction, so a batch retried by _run after a failed part is not written twice
+        with pg_service.transaction():
+            if rows:
+                pg_service.insert_many(rows)
+            for version, xml_documents in dictionaries.items():
+                pg_service.store_type_dictionaries(version, xml_documents)
+            if raw_rows:
+                pg_service.insert_raw_many(raw_rows)
+            if entity_rows:
+                pg_service.upsert_entities(entity_rows)
+            for kind in ('run_summary', 'plate_summary'):
+                summaries = [r['value'] for r in records if r.get('kind') == kind]
+                if summaries:
+                    pg_service.upsert_summaries(kind, summaries)
+            if rollup_rows:
+                pg_service.insert_rollups(rollup_rows)
+        self.stored_dictionaries.update(dictionaries)
+
+class FileSink(Sink):
+    '''
+    Rolling local archive: one JSONL or Parquet file per roll_seconds window,
+    named <prefix>-YYYYmmdd-HHMMSS.<ext> after the window start.
+    '''
+    # Rollups can be recomputed from the archived samples
+    kinds = {'sample', 'entity', 'run_summary', 'plate_summary'}
+
+    def __init__(self, name='file', config=None, directory='data/archive', fmt='jsonl', roll_seconds=3600,
+                 prefix='opcua'):
+        super().__init__(name, config)
+        if fmt not in ('jsonl', 'parquet'):
+            raise ValueError(f'Unknown file sink format {fmt!r}')
+        self.directory = directory
+        self.fmt = fmt
+        self.roll_seconds = roll_seconds
+        self.prefix = prefix
+        self.window = None
+        self.file = None  # Open JSONL file or ParquetWriter
+        if fmt == 'parquet':
+            try:
+                import pyarrow as pa
+                import pyarrow.parquet as pq
+            except ImportError:
+                raise Exception('The parquet file sink needs pyarrow (pip install pyarrow); use format jsonl otherwise')
+            self.pa = pa
+            self.pq = pq
+            self.schema = pa.schema([
+                ('timestamp', pa.timestamp('ms')), ('server_name', pa.string()), ('node_id', pa.string()),
+                ('datatype', pa.string()), ('value_num', pa.float64()), ('value_text', pa.string())])
+
+    def _path(self, window):
+        name = datetime.fromtimestamp(window).strftime('%Y%m%d-%H%M%S')
+        return os.path.join(self.directory, f'{self.prefix}-{name}.{self.fmt}')
+
+    def _roll(self, window):
+        if window != self.window or self.file is None:
+            self.close()
+            os.makedirs(self.directory, exist_ok=True)
+            path = self._path(window)
+            if self.fmt == 'jsonl':
+                self.file = open(path, 'a', encoding='utf-8')
+            else:
+                if os.path.exists(path):
+                    # Parquet files cannot be appended to; continue in a new part after a restart
+                    path = path[:-len('.parquet')] + f'-{int(time.time())}.parquet'
+                self.file = self.pq.ParquetWriter(path, self.schema)
+            self.window = window
+
+    def write(self, records):
+        # Records arrive in read order, so a batch is split where it crosses into the next window
+        part = []
+        for record in records:
+            window = record['timestamp'] - record['timestamp'] % self.roll_seconds
+            if part and window != self.window:
+                self._write_part(part)
+                part = []
+            if not part:
+                self._roll(window)
+            part.append(record)
+        if part:
+            self._write_part(part)
+
+    def _write_part(self, records):
+        if self.fmt == 'jsonl':
+            self.file.write(''.join(json.dumps(record_json(r), default=str) + '\n' for r in records))
+            self.file.flush()
+            return
+        columns = {'timestamp': [], 'server_name': [], 'node_id': [], 'datatype': [], 'value_num': [], 'value_text': []}
+        for r in records:
+            value = r['decoded']
+            is_number = isinstance(value, (bool, int, float))
+            columns['timestamp'].append(datetime.fromtimestamp(r['timestamp']))
+            columns['server_name'].append(r['server_name'])
+            columns['node_id'].append(r['node_id'])
+            columns['datatype'].append(r.get('datatype_name'))
+            columns['value_num'].append(float(value) if is_number else None)
+            columns['value_text'].append(None if is_number else json.dumps(record_json(r)['value'], default=str))
+        self.file.write_table(self.pa.Table.from_pydict(columns, schema=self.schema))
+
+    def close(self):
+        if self.file is not None:
+            try:
+                self.file.close()
+            except Exception:
+                pass
+            self.file = None
+
+class StdoutSink(Sink):
+    '''Prints every record as one JSON line, e.g. to pipe into another process.'''
+    kinds = FileSink.kinds
+
+    def __init__(self, name='stdout', config=None, stream=None):
+        super().__init__(name, config)
+        self.stream = stream or sys.stdout
+
+    def write(self, records):
+        self.stream.write(''.join(json.dumps(record_json(r), default=str) + '\n' for r in records))
+        self.stream.flush()
+
+class MemorySink(Sink):
+    '''
+    Keeps written records in memory, for tests and for trying out sink
+    settings. fail and delay make write() raise or sleep to simulate a broken
+    or slow destination.
+    '''
+    def __init__(self, name='memory', config=None, fail=False, delay=0.0):
+        super().__init__(name, config)
+        self.records = []
+        self.fail = fail
+        self.delay = delay
+
+    def write(self, records):
+        if self.delay:
+            time.sleep(self.delay)
+        if self.fail:
+            raise Exception('MemorySink configured to fail')
+        self.records.extend(records)
+
+    def memory_bytes(self):
+        return self.queue.memory_bytes() + approx_size(self.records)
+
+class ArchiveSink(Sink):
+    '''
+    Compressed local history (see services.archive): samples and entity
+    changes are buffered per node and appended as delta/XOR encoded chunks to
+    one file per day. Raw records keep their undecoded body bytes.
+    '''
+    kinds = {'sample', 'entity'}
+
+    def __init__(self, name='archive', config=None, directory=DEFAULT_ARCHIVE_DIRECTORY, window=DEFAULT_WINDOW,
+                 max_points=DEFAULT_MAX_POINTS, max_age=DEFAULT_MAX_AGE, retention_days=None, fsync=False):
+        super().__init__(name, config)
+        self.writer = ArchiveWriter(directory, window, max_points, max_age, retention_days, fsync)
+
+    def write(self, records):
+        for r in records:
+            kind = r.get('kind', 'sample')
+            if kind == 'entity':
+                value = entity_value(r['entity_key'], r['op'], r['decoded'])
+            else:
+                value = bytes(r['raw'][3]) if r.get('raw') else r['decoded']
+            self.writer.append(r['server_name'], r['node_id'], r.get('datatype_name'), r['timestamp'], value, kind)
+        # The records are buffered now; a failing write must not make the batch be retried and appended twice
+        self._archive(self.writer.write_ready)
+
+    def _archive(self, write):
+        try:
+            write()
+        except OSError as e:
+            self.write_errors += 1
+            if str(e) != self.last_error:  # Retried from idle() about twice a second
+                print(f"Sink {self.name}: could not write to the archive, keeping {self.writer.buffered_points()} "
+                      f"samples buffered: {e}")
+            self.last_error = str(e)
+
+    def idle(self):
+        self._archive(self.writer.flush_due)
+
+    def close(self):
+        self._archive(self.writer.close)
+
+    def memory_bytes(self):
+        return self.queue.memory_bytes() + self.writer.memory_bytes()
+
+    def shed(self, fraction):
+        with self.lock:
+            self._archive(self.writer.flush)
+        super().shed(fraction)
+
+    def stats(self):
+        return dict(super().stats(), archive=self.writer.stats())
+
+class NullSink(Sink):
+    '''Discards every record, e.g. for soak tests of the read and decode path (see services.soak).'''
+    def write(self, records):
+        pass
+
+SINK_TYPES = {
+    'postgres': PostgresSink,
+    'file': FileSink,
+    'stdout': StdoutSink,
+    'memory': MemorySink,
+    'archive': ArchiveSink,
+    'null': NullSink,
+}
+
+def sink_configs(config):
+    '''
+    Returns the "sinks" list of config.json, defaulting to a single Postgres
+    sink that uses the write_queue/write_batch/retry_interval settings of the
+    "pipeline" section.
+    '''
+    if 'sinks' in config:
+        return config['sinks']
+    pipeline_config = config.get('pipeline', {})
+    sink_config = {'type': 'postgres'}
+    for key, option in (('write_queue', 'queue'), ('write_batch', 'batch'), ('retry_interval', 'retry_interval')):
+        if key in pipeline_config:
+            sink_config[option] = pipeline_config[key]
+    return [sink_config]
+
+def build_sinks(configs, **postgres_options):
+    '''
+    Creates sinks from the "sinks" list in config.json, e.g.
+    [{"type": "postgres"}, {"type": "file", "directory": "data/archive", "format": "jsonl"}].
+    Queue, batch and retry settings (see DEFAULT_SINK_CONFIG) can be given per sink;
+    postgres_options (conn_str, layout, write_method) are passed to Postgres sinks.
+    '''
+    sinks = []
+    names = set()
+    for sink_config in configs:
+        sink_config = dict(sink_config)
+        sink_type = sink_config.pop('type')
+        name = sink_config.pop('name', sink_type)
+        if name in names:
+            # A configured name may already look like a generated one (e.g. "file2")
+            number = 2
+            while f'{name}{number}' in names:
+                number += 1
+            name = f'{name}{number}'
+        names.add(name)
+        config = {key: sink_config.pop(key) for key in list(sink_config) if key in DEFAULT_SINK_CONFIG}
+        if sink_type == 'postgres':
+            sinks.append(PostgresSink(name, config, **postgres_options))
+        elif sink_type == 'file':
+            sinks.append(FileSink(name, config, sink_config.get('directory', 'data/archive'),
+                                  sink_config.get('format', 'jsonl'), sink_config.get('roll_seconds', 3600),
+                                  sink_config.get('prefix', 'opcua')))
+        elif sink_type == 'archive':
+            sinks.append(ArchiveSink(name, config, sink_config.get('directory', DEFAULT_ARCHIVE_DIRECTORY),
+                                     sink_config.get('window', DEFAULT_WINDOW),
+                                     sink_config.get('max_points', DEFAULT_MAX_POINTS),
+                                     sink_config.get('max_age', DEFAULT_MAX_AGE),
+                                     sink_config.get('retention_days'), sink_config.get('fsync', False)))
+        elif sink_type in SINK_TYPES:
+            sinks.append(SINK_TYPES[sink_type](name, config))
+        else:
+            raise ValueError(f'Unknown sink type {sink_type!r}, expected one of {sorted(SINK_TYPES)}')
+    return sinks
@@ -0,0 +1,111 @@
+import argparse
+import json
+import subprocess
+import sys
+import time
+import services.config_service as config_service
+from services.collector import Collector
+from services.memory_service import MB
+from services.session_manager import sessions
+from services.simulator import SIMULATED_NODES, DEFAULT_PORT
+
+# Soak test: runs a headless collector against simulated servers (see
+# services.simulator) for hours and reports how the process memory develops.
+# Every interval one JSON line with the RSS and the size of every subsystem
+# (see memory_service) is printed; at the end the RSS growth rate over the
+# run (after warm-up) is reported. A collector without leaks levels off, so a
+# rate that stays well above zero over several hours points at a leak, and
+# the subsystem sizes or --tracemalloc show where it is.
+#
+# python -m services.soak --hours 4 --servers 2 --plans 500
+
+def growth_per_hour(samples):
+    '''Least-squares slope of (elapsed seconds, bytes) samples, in MB per hour.'''
+    if len(samples) < 2:
+        return 0.0
+    n = len(samples)
+    mean_t = sum(t for t, _ in samples) / n
+    mean_b = sum(b for _, b in samples) / n
+    variance = sum((t - mean_t) ** 2 for t, _ in samples)
+    if not variance:
+        return 0.0
+    slope = sum((t - mean_t) * (b - mean_b) for t, b in samples) / variance
+    return slope * 3600 / MB
+
+def soak(hours, interval, servers, plans, refresh_rate, sink, warmup, trace, urls=None, generated_decoders=True):
+    simulators = []
+    if not urls:
+        urls = []
+        for i in range(servers):
+            port = DEFAULT_PORT + i
+            simulators.append(subprocess.Popen([sys.executable, '-m', 'services.simulator', '--port', str(port),
+                                                '--plans', str(plans), '--seed', str(i)]))
+            urls.append(f'opc.tcp://127.0.0.1:{port}/')
+        time.sleep(5)  # Server startup
+    config = config_service.load_config()
+    config['sinks'] = [{'type': sink}]
+    config['capture'] = {'enabled': False}
+    if trace:
+        config['memory'] = dict(config.get('memory', {}), tracemalloc=True)
+    server_configs = [{'display_name': f'sim{i}', 'url': url, 'refresh_rate': refresh_rate,
+                       'generated_decoders': generated_decoders, 'nodes': [{'node_id': n} for n in SIMULATED_NODES]}
+                      for i, url in enumerate(urls)]
+    collector = Collector(config)
+    collector.start()
+    collector.sync(server_configs)
+    started = time.monotonic()
+    samples = []
+    try:
+        while time.monotonic() - started < hours * 3600:
+            time.sleep(interval)
+            elapsed = time.monotonic() - started
+            memory = collector.memory.stats(refresh=True)
+            pipeline = collector.pipeline.stats()
+            if elapsed >= warmup:
+                if trace and not samples:
+                    collector.memory.snapshot()  # Baseline, so the final snapshot shows what grew after warm-up
+                samples.append((elapsed, memory['rss_mb'] * MB))
+            print(json.dumps({
+                'elapsed_h': round(elapsed / 3600, 3),
+                'rss_mb': memory['rss_mb'],
+                'growth_mb_per_h': round(growth_per_hour(samples), 2),
+                'subsystems_mb': memory['subsystems_mb'],
+                'decode_errors': pipeline['decode_errors'],
+                'servers': {name: info['status'] for name, info in collector.stats()['servers'].items()},
+            }), flush=True)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        snapshot = collector.memory.snapshot(20) if trace else None
+        collector.stop()
+        sessions.close_all()
+        for simulator in simulators:
+            simulator.terminate()
+            simulator.wait()
+    summary = {
+        'hours': round((time.monotonic() - started) / 3600, 3),
+        'rss_first_mb': round(samples[0][1] / MB, 1) if samples else None,
+        'rss_last_mb': round(samples[-1][1] / MB, 1) if samples else None,
+        'growth_mb_per_h': round(growth_per_hour(samples), 2),
+    }
+    if snapshot:
+        summary['tracemalloc_top'] = snapshot['top']
+    print(json.dumps(summary, indent=2))
+    return summary
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run the collector against simulated servers and report memory growth.')
+    parser.add_argument('--hours', type=float, default=4.0)
+    parser.add_argument('--interval', type=float, default=60.0, help='Seconds between memory samples')
+    parser.add_argument('--servers', type=int, default=1, help='Number of simulated servers to start')
+    parser.add_argument('--plans', type=int, default=200, help='Elements in each Work.CurrentPlans array')
+    parser.add_argument('--refresh-rate', type=float, default=1.0, help='Poll interval of every node in seconds')
+    parser.add_argument('--sink', default='null', help='Sink type the records go to (null discards them)')
+    parser.add_argument('--warmup', type=float, default=600.0, help='Seconds excluded from the growth rate')
+    parser.add_argument('--tracemalloc', action='store_true', help='Trace allocations and print the top sites at the end')
+    parser.add_argument('--url', action='append', help='Collect this server instead of starting simulators; can be repeated')
+    parser.add_argument('--hand-written-decoders', action='store_true',
+                        help='Decode with opcua_structures instead of decoders generated from the type dictionary')
+    args = parser.parse_args()
+    soak(args.hours, args.interval, args.servers, args.plans, args.refresh_rate, args.sink, args.warmup,
+         args.tracemalloc, args.url, not args.hand_written_decoders)
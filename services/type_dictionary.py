@@ -0,0 +1,337 @@
+import hashlib
+import struct
+import threading
+import xml.etree.ElementTree as ET
+
+# Generates decoders for every structure and enum in the server's OPC Binary
+# type dictionary (the DataTypeDictionary variables below the
+# OPCBinarySchema_TypeSystem node). Each structure becomes a generated Python
+# function in which runs of fixed-size fields are read with a single
+# precompiled struct.Struct, which is what makes it faster than the
+# hand-written classes in opcua_structures. Compiled codecs are cached per
+# server URL and dictionary version (a hash of the dictionary contents), so a
+# firmware update with a changed layout gets new codecs automatically.
+
+BSD_NS = '{http://opcfoundation.org/BinarySchema/}'
+
+# decoded_version of raw rows decoded with generated codecs (see services/raw_decoder.py). Bump it when
+# the generated code changes its output; it is kept apart from the hand-written SCHEMA_VERSION numbers.
+GENERATOR_VERSION = 1000
+
+# OPC Binary type name -> struct format. DateTime is kept as the raw UInt64
+# tick count, like OpcuaStructBase.read_utctime.
+FIXED_TYPES = {
+    'Boolean': '?',
+    'SByte': 'b',
+    'Byte': 'B',
+    'Int16': 'h',
+    'UInt16': 'H',
+    'Int32': 'i',
+    'UInt32': 'I',
+    'Int64': 'q',
+    'UInt64': 'Q',
+    'Float': 'f',
+    'Double': 'd',
+    'DateTime': 'Q',
+    'StatusCode': 'I',
+    'Guid': 'IHH8s',
+}
+STRING_TYPES = {'String', 'CharArray'}
+BYTES_TYPES = {'ByteString', 'XmlElement'}
+
+class Codecs:
+    '''
+    Decoders generated from one server's type dictionaries.
+
+    decoders maps a structure name to a function taking an ExtensionObject
+    body and returning a dict; enums maps an enum name to {value: name}.
+    dictionaries are the XML documents they were generated from, which is
+    what captures and decode pool workers rebuild them from.
+    '''
+    def __init__(self, version, decoders, enums, source, dictionaries=()):
+        self.version = version
+        self.decoders = decoders
+        self.enums = enums
+        self.source = source
+        self.dictionaries = list(dictionaries)
+
+    def decode_enum(self, datatype_name, value):
+        mapping = self.enums.get(datatype_name)
+        if mapping is None:
+            return value
+        if isinstance(value, list):
+            return [mapping.get(v, v) for v in value]
+        return mapping.get(value, value)
+
+def _local_name(type_name):
+    return type_name.split(':', 1)[-1]
+
+def parse_dictionary(xml_bytes):
+    '''
+    Parses an OPC Binary type dictionary.
+
+    Returns
+    -------
+    structs: dict of structure name -> list of field dicts (name, type, length_field,
+        switch_field, switch_value, bit_length), in declaration order.
+    enums: dict of enum name -> {int value: name}.
+    '''
+    root = ET.fromstring(xml_bytes)
+    structs = {}
+    enums = {}
+    for element in root:
+        name = element.get('Name')
+        if element.tag == BSD_NS + 'EnumeratedType':
+            enums[name] = {int(v.get('Value')): v.get('Name') for v in element.findall(BSD_NS + 'EnumeratedValue')}
+        elif element.tag == BSD_NS + 'StructuredType':
+            fields = []
+            for field in element.findall(BSD_NS + 'Field'):
+                fields.append({
+                    'name': field.get('Name'),
+                    'type': _local_name(field.get('TypeName', '')),
+                    'length_field': field.get('LengthField'),
+                    'switch_field': field.get('SwitchField'),
+                    'switch_value': int(field.get('SwitchValue')) if field.get('SwitchValue') else None,
+                    'bit_length': int(field.get('Length', 1)),
+                })
+            structs[name] = fields
+    return structs, enums
+
+class _Generator:
+    '''
+    Type and field names come from the server and can be anything (dotted
+    names, or text crafted to be code), so they only ever appear in the
+    generated source as repr() string literals: structures become decode_0,
+    decode_1, ..., enums _E_0, _E_1, ..., and locals are numbered.
+    '''
+    def __init__(self, structs, enums):
+        self.structs = structs
+        self.enums = enums
+        self.constants = {}  # Struct format -> constant name
+        self.functions = {name: f'decode_{i}' for i, name in enumerate(structs)}
+        self.enum_constants = {name: f'_E_{i}' for i, name in enumerate(enums)}
+
+    def struct_constant(self, fmt):
+        if fmt not in self.constants:
+            self.constants[fmt] = f'_S{len(self.constants)}'
+        return self.constants[fmt]
+
+    def fixed_format(self, field):
+        '''Struct format of a field that can be merged into a fixed-size run, or None.'''
+        if field['length_field'] or field['switch_field'] or field['type'] == 'Bit':
+            return None
+        if field['type'] in FIXED_TYPES:
+            return FIXED_TYPES[field['type']]
+        if field['type'] in self.enums:
+            return 'i'
+        return None
+
+    def value_expr(self, field, variables):
+        '''Python expression turning the unpacked variable(s) of a fixed field into the decoded value.'''
+        if field['type'] == 'Guid':
+            a, b, c, d = variables
+            return f"f'{{{a}:08x}}-{{{b}:04x}}-{{{c}:04x}}-{{{d}.hex()}}'"
+        if field['type'] in self.enums:
+            return f"{self.enum_constants[field['type']]}.get({variables[0]}, {variables[0]})"
+        return variables[0]
+
+    def element_code(self, type_name, target, indent):
+        '''Code decoding one element of type_name at data[off] into target.'''
+        pad = ' ' * indent
+        if type_name in STRING_TYPES or type_name in BYTES_TYPES:
+            convert = ".decode('utf-8')" if type_name in STRING_TYPES else ''
+            return [
+                f'{pad}n = _I32.unpack_from(data, off)[0]',
+                f'{pad}off += 4',
+                f'{pad}if n < 0:',
+                f'{pad}    {target} = None',
+                f'{pad}else:',
+                f'{pad}    {target} = bytes(data[off:off + n]){convert}',
+                f'{pad}    off += n',
+            ]
+        if type_name in FIXED_TYPES or type_name in self.enums:
+            fmt = FIXED_TYPES.get(type_name, 'i')
+            const = self.struct_constant('<' + fmt)
+            variables = [f'_v{i}' for i in range(len(fmt.replace('8s', 's')))]
+            field = {'type': type_name}
+            return [
+                f"{pad}{', '.join(variables)}, = {const}.unpack_from(data, off)",
+                f'{pad}off += {struct.calcsize("<" + fmt)}',
+                f'{pad}{target} = {self.value_expr(field, variables)}',
+            ]
+        return [f'{pad}{target}, off = {self.functions[type_name]}(data, off)']
+
+    def generate_struct(self, name, fields):
+        length_fields = {f['length_field'] for f in fields if f['length_field']}
+        switch_fields = {f['switch_field'] for f in fields if f['switch_field']}
+        # Field names come from the server, so locals are numbered instead of named after them
+        var_of = {f['name']: f'f{i}' for i, f in enumerate(fields)}
+        body = []
+        result = []
+        run = []  # pending fixed-size fields
+
+        def flush_run():
+            if not run:
+                return
+            fmt = ''.join(self.fixed_format(f) for f in run)
+            const = self.struct_constant('<' + fmt)
+            variables = []
+            per_field = []
+            for f in run:
+                count = len(self.fixed_format(f).replace('8s', 's'))
+                names = [f'_v{len(variables) + i}' for i in range(count)]
+                variables.extend(names)
+                per_field.append((f, names))
+            body.append(f"    {', '.join(variables)}, = {const}.unpack_from(data, off)")
+            body.append(f'    off += {struct.calcsize("<" + fmt)}')
+            for f, names in per_field:
+                body.append(f"    {var_of[f['name']]} = {self.value_expr(f, names)}")
+            run.clear()
+
+        bit_offset = 0
+        for f in fields:
+            var = var_of[f['name']]
+            if f['type'] == 'Bit':
+                flush_run()
+                if bit_offset == 0:
+                    body.append('    _bits = 0')
+                    body.append('    _nbits = 0')
+                # Bits are packed LSB first into as many bytes as needed
+                body.append(f"    while _nbits < {bit_offset + f['bit_length']}:")
+                body.append('        _bits |= data[off] << _nbits')
+                body.append('        off += 1')
+                body.append('        _nbits += 8')
+                body.append(f"    {var} = (_bits >> {bit_offset}) & {(1 << f['bit_length']) - 1}")
+                bit_offset += f['bit_length']
+                if bit_offset % 8 == 0:
+                    bit_offset = 0
+                if f['name'] not in switch_fields:
+                    result.append(f['name'])
+                continue
+            bit_offset = 0
+            if self.fixed_format(f) is not None:
+                run.append(f)
+            else:
+                flush_run()
+                indent = 4
+                if f['switch_field']:
+                    condition = var_of[f['switch_field']]
+                    if f['switch_value'] is not None:
+                        condition += f" == {f['switch_value']}"
+                    body.append(f'    if {condition}:')
+                    indent = 8
+                pad = ' ' * indent
+                if f['length_field']:
+                    body.append(f"{pad}{var} = []")
+                    body.append(f"{pad}for _i in range(max({var_of[f['length_field']]}, 0)):")
+                    body.extend(self.element_code(f['type'], '_item', indent + 4))
+                    body.append(f"{pad}    {var}.append(_item)")
+                    body.append(f"{pad}if {var_of[f['length_field']]} < 0:")
+                    body.append(f"{pad}    {var} = None")
+                else:
+                    body.extend(self.element_code(f['type'], var, indent))
+                if f['switch_field']:
+                    body.append('    else:')
+                    body.append(f'        {var} = None')
+            if f['name'] not in length_fields and f['name'] not in switch_fields:
+                result.append(f['name'])
+        flush_run()
+        lines = [f'def {self.functions[name]}(data, off):  # {name!r}']
+        lines.extend(body)
+        items = ', '.join(f"{n!r}: {var_of[n]}" for n in result if not n.startswith('Reserved'))
+        lines.append(f'    return {{{items}}}, off')
+        return lines
+
+    def known_type(self, type_name, supported):
+        return (type_name in FIXED_TYPES or type_name in STRING_TYPES or type_name in BYTES_TYPES
+                or type_name in self.enums or type_name == 'Bit' or type_name in supported)
+
+    def supported_structs(self):
+        '''Structures whose fields, including nested structures, can all be decoded.'''
+        supported = set(self.structs)
+        changed = True
+        while changed:
+            changed = False
+            for name in list(supported):
+                missing = [f['type'] for f in self.structs[name] if not self.known_type(f['type'], supported)]
+                if missing:
+                    print(f"Type dictionary: no generated decoder for {name} (field type {missing[0]})")
+                    supported.discard(name)
+                    changed = True
+        return [name for name in self.structs if name in supported]
+
+    def generate(self):
+        supported = self.supported_structs()
+        functions = ['\n'.join(self.generate_struct(name, self.structs[name])) for name in supported]
+        header = ['import struct', "_I32 = struct.Struct('<i')"]
+        for fmt, const in self.constants.items():
+            header.append(f"{const} = struct.Struct('{fmt}')")
+        for name, mapping in self.enums.items():
+            header.append(f'{self.enum_constants[name]} = {mapping!r}')
+        # Structure name -> decoder, the only place the names appear (as string literals)
+        table = ['DECODERS = {'] + [f'    {name!r}: {self.functions[name]},' for name in supported] + ['}']
+        return '\n'.join(header) + '\n\n' + '\n\n'.join(functions) + '\n\n' + '\n'.join(table) + '\n', supported
+
+def _make_decoder(function, name):
+    def decode(body):
+        value, offset = function(body, 0)
+        if offset != len(body):
+            # The server's layout differs from its dictionary, do not return shifted fields
+            raise ValueError(f'{name}: decoded {offset} of {len(body)} bytes')
+        return value
+    decode.__name__ = f'decode_{name}'
+    return decode
+
+def compile_codecs(dictionaries):
+    '''
+    Generates and compiles decoders for a list of type dictionary XML documents.
+
+    Returns
+    -------
+    codecs: A Codecs instance.
+    '''
+    structs = {}
+    enums = {}
+    digest = hashlib.sha1()
+    for xml_bytes in dictionaries:
+        digest.update(xml_bytes)
+        s, e = parse_dictionary(xml_bytes)
+        structs.update(s)
+        enums.update(e)
+    source, supported = _Generator(structs, enums).generate()
+    # Only source generated here is ever compiled; stored decoders are rebuilt from their dictionaries
+    namespace = {}
+    exec(compile(source, '<opcua type dictionary>', 'exec'), namespace)
+    decoders = {name: _make_decoder(namespace['DECODERS'][name], name) for name in supported}
+    return Codecs(digest.hexdigest()[:16], decoders, enums, source, dictionaries)
+
+_cache = {}  # (url, version) -> Codecs, the current version of every server
+_cache_lock = threading.Lock()
+
+def cache_bytes():
+    '''Approximate size of the cached codecs (their generated source; the compiled code is not counted).'''
+    with _cache_lock:
+        return sum(len(codecs.source) for codecs in _cache.values())
+
+def load_codecs(opc_service):
+    '''
+    Returns the codecs for a connected OPCUAService, reading its type
+    dictionaries once and compiling them only if this server/version
+    combination has not been seen before.
+    '''
+    dictionaries = opc_service.get_type_dictionaries()
+    digest = hashlib.sha1()
+    for xml_bytes in dictionaries:
+        digest.update(xml_bytes)
+    key = (opc_service.url, digest.hexdigest()[:16])
+    with _cache_lock:
+        codecs = _cache.get(key)
+    if codecs is None:
+        codecs = compile_codecs(dictionaries)
+        with _cache_lock:
+            # A server whose dictionaries changed does not need the decoders of the old version
+            for stale in [k for k in _cache if k[0] == key[0]]:
+                del _cache[stale]
+            _cache[key] = codecs
+        print(f"Compiled {len(codecs.decoders)} structure and {len(codecs.enums)} enum decoders for {opc_service.url} (version {codecs.version})")
+    return codecs
@@ -0,0 +1,155 @@
+import argparse
+import io
+import random
+import time
+from datetime import datetime, timezone
+from services.postgres_service import (PostgresService, narrow_value, value_kind, kind_code, NORMALIZED, WIDE, DEFAULT_LAYOUT,
+                                       VALUES, UNNEST)
+
+# Compares the ways samples can be written to Postgres, on the same synthetic
+# batches (numbers, strings and decoded structures spread over a number of
+# nodes):
+#   row     insert_data per sample, one statement and commit each
+#   values  insert_many with the 'values' write method (execute_values)
+#   unnest  insert_many with the 'unnest' write method (prepared, typed arrays)
+#   copy    COPY ... FROM STDIN, for reference where the database allows it
+# Everything is written to a scratch schema (opcua_write_benchmark) that is
+# dropped afterwards.
+#
+# python -m services.write_benchmark "dbname=... user=... host=..." --rows 50000 --batch 500
+
+SCHEMA = 'opcua_write_benchmark'
+METHODS = ('row', 'values', 'unnest', 'copy')
+
+def synthetic_rows(count, nodes, seed=0):
+    '''(node_id, value, server_name, timestamp) samples as the Postgres sink writes them.'''
+    rng = random.Random(seed)
+    start = time.time() - count
+    rows = []
+    for i in range(count):
+        node = i % nodes
+        kind = node % 4
+        if kind == 0:
+            value = rng.uniform(0, 6000)
+        elif kind == 1:
+            value = rng.randint(0, 100000)
+        elif kind == 2:
+            value = rng.choice(['Waiting', 'Cutting', 'Sorting', 'Completed'])
+        else:
+            value = {'RunName': f'Run {i}', 'CurrentState': 'Cutting', 'ActualCutTime': rng.uniform(0, 600),
+                     'RunGuid': f'{rng.getrandbits(32):08x}-0000-0000-{rng.getrandbits(64):016x}'}
+        rows.append((f'ns=2;s=Bench.Node{node}', value, 'bench', start + i))
+    return rows
+
+def _copy_text(value):
+    if value is None:
+        return '\\N'
+    return str(value).replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n').replace('\r', '\\r')
+
+def _copy_timestamp(timestamp):
+    return datetime.fromtimestamp(timestamp, timezone.utc).strftime('%Y-%m-%d %H:%M:%S.%f')
+
+def copy_many(pg_service, rows):
+    '''Writes samples like insert_many, but with COPY (node keys are resolved as insert_many does).'''
+    with pg_service.conn.cursor() as cur:
+        buffer = io.StringIO()
+        if pg_service.layout == NORMALIZED:
+            pg_service._ensure_normalized_tables(cur)
+            wanted = {}
+            keyed = []
+            for node_id, value, server_name, timestamp in rows:
+                key = (pg_service._server_key(cur, server_name), node_id)
+                wanted.setdefault(key, value_kind(value))
+                keyed.append((key, value, timestamp))
+            node_keys = pg_service._node_keys(cur, wanted)
+            for key, value, timestamp in keyed:
+                num_value, text_value = narrow_value(value)
+                buffer.write(f'{node_keys[key]}\t{_copy_timestamp(timestamp)}\t{kind_code(value)}\t{_copy_text(num_value)}\t'
+                             f'{_copy_text(text_value)}\n')
+            buffer.seek(0)
+            cur.copy_expert('COPY opcua_samples (node_key, timestamp, value_kind, num_value, text_value) FROM STDIN', buffer)
+        else:
+            pg_service._ensure_data_table(cur)
+            for node_id, value, server_name, timestamp in rows:
+                columns = (node_id,) + pg_service._typed_values(value) + (server_name, _copy_timestamp(timestamp))
+                buffer.write('\t'.join(_copy_text(c) for c in columns) + '\n')
+            buffer.seek(0)
+            cur.copy_expert('COPY opcua_data (node_id, double_value, float_value, int_value, bool_value, string_val, '
+                            'dictionary_val, server_name, timestamp) FROM STDIN', buffer)
+    pg_service.conn.commit()
+
+def _connect(conn_str, layout, write_method=VALUES):
+    pg_service = PostgresService(conn_str, layout=layout, write_method=write_method)
+    pg_service.connect()
+    with pg_service.conn.cursor() as cur:
+        cur.execute(f'CREATE SCHEMA IF NOT EXISTS {SCHEMA}')
+        cur.execute(f'SET search_path TO {SCHEMA}')
+        cur.execute("SET TIME ZONE 'UTC'")  # COPY gets the same timestamps as to_timestamp(...)::timestamp
+    pg_service.conn.commit()
+    return pg_service
+
+def _truncate(pg_service):
+    with pg_service.conn.cursor() as cur:
+        cur.execute('DROP TABLE IF EXISTS opcua_samples, opcua_data CASCADE')
+    pg_service.conn.commit()
+    pg_service.created_tables = set()
+
+def run_method(conn_str, layout, method, rows, batch):
+    '''Writes rows with one method and returns the elapsed seconds.'''
+    pg_service = _connect(conn_str, layout, UNNEST if method == 'unnest' else VALUES)
+    try:
+        _truncate(pg_service)
+        # Tables, node keys and prepared statements are set up outside the timed part
+        warmup = rows[:batch]
+        if method == 'copy':
+            copy_many(pg_service, warmup)
+        else:
+            pg_service.insert_many(warmup)
+        started = time.perf_counter()
+        if method == 'row':
+            for node_id, value, server_name, timestamp in rows:
+                pg_service.insert_data(node_id, value, server_name)
+        else:
+            for i in range(0, len(rows), batch):
+                if method == 'copy':
+                    copy_many(pg_service, rows[i:i + batch])
+                else:
+                    pg_service.insert_many(rows[i:i + batch])
+        return time.perf_counter() - started
+    finally:
+        pg_service.disconnect()
+
+def benchmark(conn_str, rows=50000, batch=500, nodes=50, layout=DEFAULT_LAYOUT, methods=METHODS, row_limit=2000, keep=False):
+    samples = synthetic_rows(rows, nodes)
+    results = []
+    try:
+        for method in methods:
+            # The per-row path is far slower; a sample of it is enough for its rate
+            method_rows = samples[:row_limit] if method == 'row' else samples
+            elapsed = run_method(conn_str, layout, method, method_rows, batch)
+            batches = len(method_rows) if method == 'row' else -(-len(method_rows) // batch)
+            results.append((method, len(method_rows), elapsed, len(method_rows) / elapsed, elapsed * 1000 / batches))
+            print(f"{method:<8}{len(method_rows):>9} rows {elapsed:>9.2f} s {len(method_rows) / elapsed:>11.0f} rows/s "
+                  f"{elapsed * 1000 / batches:>9.2f} ms/statement", flush=True)
+    finally:
+        if not keep:
+            pg_service = _connect(conn_str, layout)
+            with pg_service.conn.cursor() as cur:
+                cur.execute(f'DROP SCHEMA {SCHEMA} CASCADE')
+            pg_service.conn.commit()
+            pg_service.disconnect()
+    return results
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compare the Postgres write methods on synthetic samples.')
+    parser.add_argument('conn_str', help='Postgres connection string; tables are created in a scratch schema')
+    parser.add_argument('--rows', type=int, default=50000)
+    parser.add_argument('--batch', type=int, default=500, help='Samples per statement, like the sink batch size')
+    parser.add_argument('--nodes', type=int, default=50)
+    parser.add_argument('--layout', choices=(NORMALIZED, WIDE), default=DEFAULT_LAYOUT)
+    parser.add_argument('--method', action='append', choices=METHODS, help='Method to run; can be repeated. Defaults to all')
+    parser.add_argument('--row-limit', type=int, default=2000, help='Samples written by the per-row method')
+    parser.add_argument('--keep', action='store_true', help=f'Keep the {SCHEMA} schema for inspection')
+    args = parser.parse_args()
+    benchmark(args.conn_str, args.rows, args.batch, args.nodes, args.layout, args.method or METHODS,
+              args.row_limit, args.keep)
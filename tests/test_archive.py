@@ -0,0 +1,46 @@
+from datetime import datetime
+from services.archive import ArchiveReader, ArchiveWriter, decode_chunk, encode_chunk
+
+def round_trip(timestamps, values):
+    first, last, body = encode_chunk(timestamps, values)
+    assert (first, last) == (int(round(timestamps[0] * 1000)), int(round(timestamps[-1] * 1000)))
+    return decode_chunk(body, 0, len(timestamps), first)
+
+def test_scalars_round_trip():
+    timestamps = [1000.0 + i * 0.5 for i in range(6)]
+    for values in ([1.5, 1.5, -2.25, 0.0, 1e300, float('inf')], [3, 4, 4, -100, 2 ** 40, 0],
+                   [True, False, True, True, False, False], ['Idle', 'Cutting', 'Idle', '', 'ä', 'Idle'],
+                   [1.0, None, 'mixed', 4, None, [1, 2]]):
+        assert round_trip(timestamps, values) == (timestamps, values)
+
+def test_irregular_timestamps_round_trip_to_the_millisecond():
+    timestamps = [1700000000.123, 1700000001.124, 1700000001.5, 1700000010.0]
+    decoded, _ = round_trip(timestamps, [1, 2, 3, 4])
+    assert decoded == timestamps
+
+def test_structures_and_arrays_round_trip():
+    timestamps = [10.0, 11.0, 12.0, 13.0]
+    values = [
+        {'PlanGuid': 'a', 'Progress': 0.5, 'Started': datetime(2024, 5, 1, 12, 0, 0, 123000)},
+        [{'RunGuid': 'r1', 'ActualCutTime': 1.0}, {'RunGuid': 'r2', 'ActualCutTime': 2.0, 'Extra': None}],
+        [],
+        [1, 2, 3],
+    ]
+    assert round_trip(timestamps, values) == (timestamps, values)
+
+def test_missing_fields_stay_missing():
+    timestamps = [1.0, 2.0]
+    values = [{'a': 1, 'b': None}, {'a': 2}]
+    assert round_trip(timestamps, values)[1] == values
+
+def test_writer_and_reader_round_trip(tmp_path):
+    writer = ArchiveWriter(str(tmp_path), max_points=3)
+    for i in range(5):
+        writer.append('srv', 'power', 'Double', 1700000000.0 + i, float(i))
+    writer.append('srv', 'state', 'String', 1700000000.0, 'Idle')
+    writer.flush()
+    writer.close()
+    reader = ArchiveReader(str(tmp_path))
+    samples = list(reader.read(nodes=['power']))
+    assert [(s['timestamp'], s['value']) for s in samples] == [(1700000000.0 + i, float(i)) for i in range(5)]
+    assert {s['server_name'] for s in reader.read(start=1700000000.0, end=1700000001.0)} == {'srv'}
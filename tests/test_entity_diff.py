@@ -0,0 +1,42 @@
+from services.entity_diff import EntityDiffer, UPSERT, REMOVE
+
+def sample(elements, node_id='ns=2;s=Work.CurrentPlans'):
+    return {'server_name': 'srv', 'node_id': node_id, 'datatype_name': 'PlanInfo', 'timestamp': 1.0,
+            'decoded': elements, 'raw': None}
+
+def changes(records):
+    return sorted((r['entity_key'], r['op']) for r in records)
+
+def test_first_read_upserts_every_element():
+    differ = EntityDiffer()
+    records = differ.diff(sample([{'PlanGuid': 'a', 'Name': 'x'}, {'PlanGuid': 'b', 'Name': 'y'}]))
+    assert changes(records) == [('a', UPSERT), ('b', UPSERT)]
+    assert all(r['kind'] == 'entity' and r['datatype_name'] == 'PlanInfo' for r in records)
+
+def test_only_changed_added_and_removed_elements_are_emitted():
+    differ = EntityDiffer()
+    differ.diff(sample([{'PlanGuid': 'a', 'Name': 'x'}, {'PlanGuid': 'b', 'Name': 'y'}]))
+    records = differ.diff(sample([{'PlanGuid': 'a', 'Name': 'x'}, {'PlanGuid': 'b', 'Name': 'z'},
+                                  {'PlanGuid': 'c', 'Name': 'w'}]))
+    assert changes(records) == [('b', UPSERT), ('c', UPSERT)]
+    records = differ.diff(sample([{'PlanGuid': 'c', 'Name': 'w'}]))
+    assert changes(records) == [('a', REMOVE), ('b', REMOVE)]
+
+def test_array_without_usable_keys_is_not_diffed():
+    differ = EntityDiffer()
+    assert differ.diff(sample([{'Name': 'x'}])) is None
+    assert differ.diff(sample([{'PlanGuid': 'a'}, {'PlanGuid': 'a'}])) is None
+
+def test_keys_are_found_under_generated_decoder_names():
+    differ = EntityDiffer()
+    record = {'server_name': 'srv', 'node_id': 'parts', 'datatype_name': 'RunPartInfo', 'timestamp': 1.0,
+              'decoded': [{'RunGuid': 'r', 'PartID': 7}], 'raw': None}
+    assert changes(differ.diff(record)) == [('r/7', UPSERT)]
+
+def test_forget_makes_the_next_read_upsert_everything_again():
+    differ = EntityDiffer()
+    elements = [{'PlanGuid': 'a', 'Name': 'x'}]
+    differ.diff(sample(elements))
+    assert differ.diff(sample(elements)) == []
+    differ.forget('srv', 'ns=2;s=Work.CurrentPlans')
+    assert changes(differ.diff(sample(elements))) == [('a', UPSERT)]
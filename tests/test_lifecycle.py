@@ -0,0 +1,38 @@
+from services.lifecycle import EPOCH_TICKS, LifecycleTracker
+
+def ticks(seconds):
+    return int(seconds * 1e7) + EPOCH_TICKS
+
+def record(datatype_name, value, timestamp):
+    return {'kind': 'sample', 'server_name': 'srv', 'node_id': datatype_name, 'datatype_name': datatype_name,
+            'timestamp': timestamp, 'decoded': value, 'raw': None}
+
+def run_state(guid, state, seconds):
+    return record('RunStates', {'Timestamp': ticks(seconds), 'RunGuid': guid, 'JobGuid': 'j', 'PlanGuid': 'p',
+                                'RunName': 'run', 'CurrentState': state}, seconds)
+
+def test_finished_run_is_summarized_once_with_state_durations():
+    summaries = []
+    tracker = LifecycleTracker(summaries.append)
+    tracker(run_state('', 'Idle', 0))  # No run when the collector starts
+    tracker(run_state('r1', 'Waiting', 100))
+    tracker(run_state('r1', 'Cutting', 130))
+    tracker(record('RunInfo', [{'RunGuid': 'r1', 'ActualCutTime': 60.0}], 180))
+    tracker(run_state('r1', 'Completed', 190))
+    tracker(run_state('r1', 'Completed', 200))
+    assert len(summaries) == 1
+    summary = summaries[0]['value']
+    assert summaries[0]['kind'] == 'run_summary'
+    assert summary['run_guid'] == 'r1' and summary['final_state'] == 'Completed'
+    assert summary['duration'] == 90.0
+    assert summary['state_durations'] == {'Waiting': 30.0, 'Cutting': 60.0, 'Completed': 0.0}
+    assert summary['cut_time'] == 60.0
+    assert summary['partial'] is False
+
+def test_run_in_progress_at_start_is_partial():
+    summaries = []
+    tracker = LifecycleTracker(summaries.append)
+    tracker(run_state('r1', 'Cutting', 0))
+    tracker(run_state('r2', 'Waiting', 50))
+    assert [s['value']['run_guid'] for s in summaries] == ['r1']
+    assert summaries[0]['value']['partial'] is True
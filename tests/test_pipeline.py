@@ -0,0 +1,69 @@
+import threading
+import time
+from services.entity_diff import EntityDiffer
+from services.pipeline import BoundedQueue, IngestPipeline, BLOCK, DROP_OLDEST, LATEST_PER_NODE
+from services.sinks import MemorySink
+
+def test_drop_oldest_keeps_newest_items():
+    queue = BoundedQueue('q', 2, DROP_OLDEST)
+    assert queue.put('a', key='n1')
+    assert queue.put('b', key='n2')
+    assert not queue.put('c', key='n3')
+    assert queue.get_batch(10) == ['b', 'c']
+    assert queue.stats()['dropped'] == 1
+
+def test_latest_per_node_replaces_queued_value_of_same_node():
+    queue = BoundedQueue('q', 2, LATEST_PER_NODE)
+    queue.put('a1', key='a')
+    queue.put('b1', key='b')
+    queue.put('a2', key='a')
+    assert queue.get_batch(10) == ['a2', 'b1']
+
+def test_latest_per_node_drops_oldest_for_new_node():
+    queue = BoundedQueue('q', 2, LATEST_PER_NODE)
+    queue.put('a1', key='a')
+    queue.put('b1', key='b')
+    queue.put('c1', key='c')
+    assert queue.get_batch(10) == ['b1', 'c1']
+    # The evicted entry must not be replaced in place later
+    queue.put('a2', key='a')
+    assert queue.get_batch(10) == ['a2']
+
+def test_block_waits_for_space():
+    queue = BoundedQueue('q', 1, BLOCK, block_timeout=2.0)
+    queue.put('a')
+    threading.Timer(0.1, queue.get_batch, (1,)).start()
+    started = time.monotonic()
+    assert queue.put('b')
+    assert time.monotonic() - started >= 0.05
+    assert queue.get_batch(10) == ['b']
+
+def test_block_timeout_rejects_new_item():
+    queue = BoundedQueue('q', 1, BLOCK, block_timeout=0.05)
+    dropped = []
+    queue.on_drop = dropped.append
+    queue.put('a')
+    assert not queue.put('b')
+    assert dropped == ['b']
+    assert queue.get_batch(10) == ['a']
+
+def test_shed_drops_oldest_fraction_and_reports_it():
+    queue = BoundedQueue('q', 10)
+    dropped = []
+    queue.on_drop = dropped.append
+    for i in range(4):
+        queue.put(i, key=i)
+    queue.shed(0.5)
+    assert dropped == [0, 1]
+    assert queue.get_batch(10) == [2, 3]
+    assert queue.stats()['dropped'] == 2
+
+def test_dropped_entity_record_makes_differ_forget_its_node():
+    differ = EntityDiffer()
+    sink = MemorySink()
+    IngestPipeline(sinks=[sink], differ=differ)
+    differ.state[('srv', 'plans')] = {'a': {}}
+    differ.state[('srv', 'runs')] = {'b': {}}
+    sink.queue.on_drop({'kind': 'entity', 'server_name': 'srv', 'node_id': 'plans'})
+    sink.queue.on_drop({'kind': 'sample', 'server_name': 'srv', 'node_id': 'runs'})
+    assert list(differ.state) == [('srv', 'runs')]
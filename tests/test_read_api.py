@@ -0,0 +1,32 @@
+from services.read_api import LiveStore
+
+def test_versions_follow_the_selection():
+    store = LiveStore()
+    store.update('s1', 'a', 1)
+    store.update('s2', 'b', 2)
+    version_a, _ = store.values('s1', 'a')
+    version_s1, _ = store.values('s1')
+    version_all, _ = store.values()
+    store.update('s2', 'b', 3)
+    assert store.values('s1', 'a')[0] == version_a
+    assert store.values('s1')[0] == version_s1
+    assert store.values()[0] > version_all
+
+def test_removal_changes_the_server_version():
+    store = LiveStore()
+    store.update('s1', 'a', 1)
+    store.update('s1', 'b', 1)
+    version, values = store.values('s1')
+    assert len(values) == 2
+    store.remove('s1', 'b')
+    new_version, values = store.values('s1')
+    assert new_version > version and len(values) == 1
+
+def test_wait_for_changes_returns_the_changed_keys():
+    store = LiveStore()
+    store.update('s1', 'a', 1)
+    version, _ = store.values()
+    store.update('s1', 'b', 1)
+    store.set_status('s1', 'Connected')
+    assert store.wait_for_changes(version, timeout=0) == (version + 2, [('s1', 'b'), ('s1', None)])
+    assert store.wait_for_changes(version + 2, timeout=0) == (version + 2, [])
@@ -0,0 +1,43 @@
+from services.rollup_service import RollupAggregator, build_aggregator, rollup_table_name
+
+def test_samples_land_in_buckets_of_every_width():
+    rollups = RollupAggregator(bucket_seconds=(60, 3600))
+    for timestamp, value in ((10, 1.0), (50, 3.0), (70, 5.0)):
+        rollups.add('srv', 'power', value, timestamp)
+    rows = sorted(rollups.flush(now=3600))
+    assert rows == [
+        (60, 0, 'srv', 'power', '', 2, 4.0, 1.0, 3.0),
+        (60, 60, 'srv', 'power', '', 1, 5.0, 5.0, 5.0),
+        (3600, 0, 'srv', 'power', '', 3, 9.0, 1.0, 5.0),
+    ]
+
+def test_only_closed_buckets_are_flushed():
+    rollups = RollupAggregator(bucket_seconds=(60,))
+    rollups.add('srv', 'power', 1.0, 10)
+    rollups.add('srv', 'power', 2.0, 70)
+    assert [row[1] for row in rollups.flush(now=100)] == [0]
+    assert [row[1] for row in rollups.flush(now=100, force=True)] == [60]
+
+def test_structure_fields_are_aggregated_and_timestamps_skipped():
+    rollups = RollupAggregator(bucket_seconds=(60,))
+    rollups.add('srv', 'laser', {'Power': 2.0, 'Timestamp': 123456789, 'On': True, 'Name': 'x'}, 0)
+    assert [row[4] for row in rollups.flush(force=True)] == ['Power']
+
+def test_counters_are_aggregated_as_increases_per_run():
+    rollups = RollupAggregator(bucket_seconds=(60,))
+    def read(timestamp, *runs):
+        rollups.add('srv', 'runs', [{'RunGuid': guid, 'ActualCutTime': cut} for guid, cut in runs], timestamp, 'RunInfo')
+    read(0, ('a', 100.0))  # Baseline, the time before the collector started is not counted
+    read(10, ('a', 110.0))
+    read(20, ('a', 125.0), ('b', 5.0))  # A new run counts from zero
+    read(30, ('b', 2.0))  # Went down: restarted
+    assert rollups.flush(force=True) == [(60, 0, 'srv', 'runs', 'ActualCutTime', 4, 32.0, 2.0, 15.0)]
+
+def test_rollups_can_be_disabled():
+    assert build_aggregator({'enabled': False}) is None
+    assert build_aggregator({'bucket_seconds': [60]}).bucket_seconds == (60,)
+
+def test_table_names():
+    assert rollup_table_name(60) == 'opcua_rollup_1m'
+    assert rollup_table_name(3600) == 'opcua_rollup_1h'
+    assert rollup_table_name(90) == 'opcua_rollup_90s'
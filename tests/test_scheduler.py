@@ -0,0 +1,53 @@
+from services.scheduler import PollScheduler
+
+def test_nodes_due_in_the_same_tick_are_batched_per_server():
+    scheduler = PollScheduler(tick=0.25)
+    scheduler.add('s1', 'a', 1.0, now=0.0)
+    scheduler.add('s1', 'b', 1.0, now=0.1)
+    scheduler.add('s2', 'c', 1.0, now=0.1)
+    assert scheduler.due(now=0.1) == {'s1': ['a']}
+    assert scheduler.due(now=0.25) == {'s1': ['b'], 's2': ['c']}
+
+def test_deadlines_stay_on_the_grid_when_reads_are_late():
+    scheduler = PollScheduler(tick=0.25)
+    scheduler.add('s', 'n', 1.0, now=0.0)
+    scheduler.due(now=0.0)
+    assert scheduler.due(now=0.9) == {}
+    assert scheduler.due(now=1.3) == {'s': ['n']}
+    # The next deadline is 2.0, not 2.3
+    assert scheduler.due(now=1.99) == {}
+    assert scheduler.due(now=2.0) == {'s': ['n']}
+
+def test_missed_deadlines_are_skipped_not_caught_up():
+    scheduler = PollScheduler(tick=0.25)
+    scheduler.add('s', 'n', 1.0, now=0.0)
+    scheduler.due(now=0.0)
+    assert scheduler.due(now=3.5) == {'s': ['n']}
+    assert scheduler.due(now=3.6) == {}
+    assert scheduler.stats()['s']['n']['missed'] == 2
+    assert scheduler.due(now=4.0) == {'s': ['n']}
+
+def test_adaptive_interval_doubles_while_static_and_snaps_back():
+    scheduler = PollScheduler(tick=0.25)
+    scheduler.add('s', 'n', 1.0, max_interval=4.0, now=0.0)
+    scheduler.due(now=0.0)
+    for _ in range(4):
+        scheduler.report('s', 'n', 5)
+    assert scheduler.stats()['s']['n']['interval'] == 4.0
+    scheduler.report('s', 'n', 6)
+    assert scheduler.stats()['s']['n']['interval'] == 1.0
+
+def test_paused_server_is_not_due_until_resumed():
+    scheduler = PollScheduler(tick=0.25)
+    scheduler.add('s', 'n', 1.0, now=0.0)
+    scheduler.pause('s')
+    assert scheduler.due(now=5.0) == {}
+    scheduler.resume('s', now=5.0)
+    assert scheduler.due(now=5.0) == {'s': ['n']}
+
+def test_removed_node_is_never_due():
+    scheduler = PollScheduler(tick=0.25)
+    scheduler.add('s', 'a', 1.0, now=0.0)
+    scheduler.add('s', 'b', 1.0, now=0.0)
+    scheduler.remove('s', 'a')
+    assert scheduler.due(now=0.0) == {'s': ['b']}